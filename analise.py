@@ -0,0 +1,155 @@
+"""Análise do CFO Virtual sobre um resumo estatístico de todo o histórico.
+
+Em vez de linhas cruas, o agente recebe um texto curto calculado com pandas/NumPy sobre todas as
+notas: totais por mês e por fornecedor, carga tributária, crescimento e notas fora do padrão
+(z-score). A resposta fica guardada no banco pela impressão digital desse resumo, então clicar
+de novo sem mudança nos números não chama o LLM.
+"""
+import hashlib
+import time
+
+import numpy as np
+import pandas as pd
+
+import arquivamento
+from banco import conexao
+from extracao import MODELO_LLM
+
+COLUNAS_IMPOSTO = ['valor_icms', 'valor_ipi', 'valor_icms_st', 'valor_issqn']
+COLUNAS_ANALISE = ['emissor_nome', 'numero_nota', 'data_emissao', 'data_emissao_iso',
+                   'valor_bruto', 'valor_liquido', 'retencao_issqn'] + COLUNAS_IMPOSTO
+
+MESES_RESUMO = 12          # meses mais recentes na tabela mensal
+TOP_FORNECEDORES = 10
+MIN_NOTAS_FORNECEDOR = 5   # abaixo disso o z-score usa a média geral, não a do fornecedor
+LIMITE_Z = 3.0
+MAX_ATIPICAS = 10
+
+PROMPT_CFO = """
+Você recebe o resumo estatístico de TODO o histórico de notas fiscais da empresa (não são linhas cruas).
+Escreva um Relatório Executivo em Markdown com:
+1. Visão geral (volume, carga tributária e tendência recente).
+2. Fornecedores: concentração, variações relevantes e carga tributária fora do comum.
+3. Notas atípicas que merecem auditoria e por quê.
+4. Recomendações objetivas.
+Use apenas os números do resumo.
+---
+{resumo}
+"""
+
+
+# --- RESUMO ESTATÍSTICO ---
+def carregar_base():
+    """Colunas usadas na análise, já numéricas, para todas as notas (banco e arquivo)."""
+    with conexao() as conn:
+        df = pd.read_sql(f"SELECT {', '.join(COLUNAS_ANALISE)} FROM notas_fiscais", conn)
+    arquivo = arquivamento.tabela(COLUNAS_ANALISE)
+    if arquivo is not None: df = pd.concat([arquivo.to_pandas(), df], ignore_index=True)
+    valores = [c for c in COLUNAS_ANALISE if c.startswith(('valor_', 'retencao_'))]
+    df[valores] = df[valores].apply(pd.to_numeric, errors='coerce').fillna(0.0)
+    df['emissor_nome'] = df['emissor_nome'].fillna('').replace('', 'Não identificado')
+    df['mes'] = df['data_emissao_iso'].str[:7]
+    df['impostos'] = df[COLUNAS_IMPOSTO].sum(axis=1)
+    return df
+
+def _percentual(parte, total):
+    """parte/total em %, com 0 onde o total é zero (funciona com escalares e Series)."""
+    return 100 * np.divide(parte, total, out=np.zeros_like(parte, dtype=float), where=np.asarray(total) != 0)
+
+def _tabela(df):
+    # CSV com ';' é o formato mais enxuto em tokens para o agente ler tabelas
+    return df.to_csv(sep=';', float_format='%.2f')
+
+def _resumo_mensal(df):
+    mensal = df.dropna(subset=['mes']).groupby('mes').agg(
+        notas=('valor_bruto', 'size'), bruto=('valor_bruto', 'sum'), impostos=('impostos', 'sum')
+    ).sort_index()
+    mensal['carga_pct'] = _percentual(mensal['impostos'].to_numpy(), mensal['bruto'].to_numpy())
+    mensal['crescimento_pct'] = mensal['bruto'].pct_change().replace([np.inf, -np.inf], np.nan).mul(100)
+    return mensal.tail(MESES_RESUMO)
+
+def _resumo_fornecedores(df):
+    fornecedores = df.groupby('emissor_nome').agg(
+        notas=('valor_bruto', 'size'), bruto=('valor_bruto', 'sum'),
+        impostos=('impostos', 'sum'), retencoes=('retencao_issqn', 'sum')
+    )
+    fornecedores['participacao_pct'] = _percentual(fornecedores['bruto'].to_numpy(), fornecedores['bruto'].sum())
+    fornecedores['carga_pct'] = _percentual(fornecedores['impostos'].to_numpy(), fornecedores['bruto'].to_numpy())
+
+    # Crescimento: últimos 3 meses com nota contra os 3 anteriores
+    meses = np.sort(df['mes'].dropna().unique())
+    recentes = df[df['mes'].isin(meses[-3:])].groupby('emissor_nome')['valor_bruto'].sum()
+    anteriores = df[df['mes'].isin(meses[-6:-3])].groupby('emissor_nome')['valor_bruto'].sum()
+    base = anteriores.reindex(fornecedores.index)
+    fornecedores['crescimento_3m_pct'] = (recentes.reindex(fornecedores.index).fillna(0) / base - 1).mul(100)
+    return fornecedores.sort_values('bruto', ascending=False).head(TOP_FORNECEDORES)
+
+def _notas_atipicas(df):
+    """Notas com |z| >= LIMITE_Z no valor bruto, comparadas ao próprio fornecedor quando há histórico."""
+    valores = df['valor_bruto']
+    grupo = valores.groupby(df['emissor_nome'])
+    media, desvio, tamanho = grupo.transform('mean'), grupo.transform('std'), grupo.transform('size')
+    z_fornecedor = (valores - media) / desvio
+    desvio_geral = valores.std()
+    z_geral = (valores - valores.mean()) / desvio_geral if desvio_geral else pd.Series(0.0, index=df.index)
+    z = z_fornecedor.where((tamanho >= MIN_NOTAS_FORNECEDOR) & (desvio > 0), z_geral).fillna(0.0)
+
+    atipicas = df.assign(z=z.round(1))[z.abs() >= LIMITE_Z]
+    atipicas = atipicas.loc[atipicas['z'].abs().sort_values(ascending=False).index[:MAX_ATIPICAS]]
+    return atipicas[['data_emissao', 'numero_nota', 'emissor_nome', 'valor_bruto', 'z']].set_index('numero_nota')
+
+def resumo_estatistico(df=None):
+    """Texto compacto com as estatísticas de todo o histórico ('' se não houver notas)."""
+    df = carregar_base() if df is None else df
+    if df.empty: return ""
+
+    bruto, impostos = df['valor_bruto'].sum(), df['impostos'].sum()
+    meses = df['mes'].dropna()
+    fornecedores = _resumo_fornecedores(df)
+    linhas = [
+        "# GERAL",
+        f"notas={len(df)}; fornecedores={df['emissor_nome'].nunique()}; "
+        f"periodo={meses.min() if len(meses) else '-'} a {meses.max() if len(meses) else '-'}",
+        f"bruto={bruto:.2f}; liquido={df['valor_liquido'].sum():.2f}; impostos={impostos:.2f}; "
+        f"carga_pct={_percentual(impostos, bruto):.2f}; retencoes_iss={df['retencao_issqn'].sum():.2f}",
+        "impostos: " + "; ".join(f"{c.replace('valor_', '')}={df[c].sum():.2f}" for c in COLUNAS_IMPOSTO),
+        f"concentracao_top5_pct={fornecedores['participacao_pct'].head(5).sum():.2f}",
+        "",
+        f"# POR MES (ultimos {MESES_RESUMO})",
+        _tabela(_resumo_mensal(df)),
+        f"# TOP {TOP_FORNECEDORES} FORNECEDORES",
+        _tabela(fornecedores),
+        f"# NOTAS ATIPICAS (|z| >= {LIMITE_Z})",
+        _tabela(_notas_atipicas(df)),
+    ]
+    return "\n".join(linhas)
+
+
+# --- AGENTE E CACHE ---
+def impressao_digital(resumo):
+    return hashlib.sha256("\x1f".join([MODELO_LLM, PROMPT_CFO, resumo]).encode("utf-8")).hexdigest()
+
+def analisar_com_ia(resumo):
+    # Importado só aqui: o Dashboard usa este módulo para o resumo sem carregar a crewai
+    from crewai import Agent, Task, Crew
+
+    analista = Agent(
+        role='CFO Virtual',
+        goal='Analisar o histórico financeiro acumulado.',
+        backstory='Analisa tendências de longo prazo e carga tributária.',
+        verbose=True, allow_delegation=False, llm=MODELO_LLM
+    )
+    task = Task(description=PROMPT_CFO.format(resumo=resumo), expected_output="Relatório Executivo Markdown", agent=analista)
+    return Crew(agents=[analista], tasks=[task]).kickoff()
+
+def analise_cfo(resumo):
+    """Devolve (relatório em Markdown, veio_do_cache). Só chama o LLM para um resumo inédito."""
+    impressao = impressao_digital(resumo)
+    with conexao() as conn:
+        linha = conn.execute("SELECT resultado FROM cache_analise WHERE impressao = ?", (impressao,)).fetchone()
+    if linha: return linha[0], True
+
+    resultado = str(analisar_com_ia(resumo))
+    with conexao() as conn:
+        conn.execute("INSERT OR REPLACE INTO cache_analise VALUES (?, ?, ?)", (impressao, resultado, time.time()))
+    return resultado, False
@@ -1,20 +1,12 @@
 import streamlit as st
+import logging
 import os
-import pandas as pd
-import json
-import io
-import sqlite3
+import tempfile
 import time
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from datetime import datetime
-import plotly.express as px
-from crewai import Agent, Task, Crew
-from PyPDF2 import PdfReader
-from streamlit_option_menu import option_menu
-from reportlab.lib.pagesizes import letter
-from reportlab.pdfgen import canvas
-from reportlab.lib import colors
+
+# Logs dos módulos (sincronização, compactação das reextrações...) no terminal do Streamlit.
+# Sem efeito nos reruns: basicConfig não faz nada se o logger raiz já tem handler
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
 
 # --- 1. CONFIGURAÇÕES INICIAIS E VISUAL ---
 st.set_page_config(page_title="Opertix System", page_icon="🚀", layout="wide")
@@ -65,8 +57,6 @@ if "OPENAI_API_KEY" in st.secrets:
 else:
     os.environ["OPENAI_API_KEY"] = "SUA_CHAVE_AQUI" # Coloque sua chave aqui se rodar local sem secrets
 
-MODELO_LLM = "gpt-4o-mini"
-
 # --- 2. SISTEMA DE LOGIN ---
 USUARIOS = {
     "admin": "admin123",
@@ -115,229 +105,123 @@ if not verificar_login():
 # ÁREA RESTRITA (SISTEMA CARREGA ABAIXO)
 # =========================================================
 
-# --- 3. CONEXÃO GOOGLE SHEETS (NUVEM) ---
-def conectar_gsheets():
-    """Tenta conectar ao Google Sheets usando creds.json"""
-    scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-    try:
-        if os.path.exists("creds.json"):
-            creds = ServiceAccountCredentials.from_json_keyfile_name("creds.json", scope)
-            client = gspread.authorize(creds)
-            # ATENÇÃO: O nome aqui deve ser EXATAMENTE igual ao da sua planilha no Google
-            sheet = client.open("Dados Fiscais Opertix").sheet1
-            return sheet
-        else:
-            return None
-    except Exception as e:
-        return None
-
-# --- 4. BANCO DE DADOS (LOCAL + NUVEM) ---
-def conectar_banco():
-    return sqlite3.connect("dados_fiscais.db")
-
-def inicializar_banco():
-    conn = conectar_banco()
-    c = conn.cursor()
-    c.execute('''
-        CREATE TABLE IF NOT EXISTS notas_fiscais (
-            id INTEGER PRIMARY KEY AUTOINCREMENT,
-            data_upload TIMESTAMP,
-            arquivo_origem TEXT,
-            numero_nota TEXT,
-            data_emissao TEXT,
-            emissor_nome TEXT,
-            emissor_cnpj TEXT,
-            tomador_nome TEXT,
-            tomador_cnpj TEXT,
-            descricao_item TEXT,
-            codigo_ncm TEXT,
-            valor_bruto REAL,
-            valor_liquido REAL,
-            valor_icms REAL,
-            valor_ipi REAL,
-            valor_icms_st REAL,
-            valor_issqn REAL,
-            retencao_issqn REAL,
-            valor_desconto REAL,
-            json_completo TEXT
-        )
-    ''')
-    conn.commit()
-    conn.close()
+# Módulos do sistema só depois do login: a tela de entrada abre sem pagar por eles.
+# Os pesados (plotly, reportlab, crewai/openai) são importados nas páginas e funções que os usam.
+import pandas as pd
+from streamlit_option_menu import option_menu
+from banco import conexao, inicializar_banco, salvar_notas
+import sincronizacao
+import consultas
+import arquivamento
+import exportacao
+import analise
+import validacao
+import fila
+import metricas
+from cache_extracao import total_entradas as total_entradas_cache
+from extracao import LIMIAR_CONFIANCA, MODOS_EXTRACAO, ORCAMENTO_TOKENS
+from ingestao_xml import TAMANHO_BLOCO as TAMANHO_BLOCO_XML, ler_arquivo as ler_arquivo_xml
 
+# --- 3. BANCO DE DADOS (LOCAL + NUVEM) ---
 def salvar_no_banco(df_novo):
+    """Grava no SQLite e agenda o backup no Google Sheets, enviado em segundo plano."""
     if df_novo.empty: return
-    
-    # 1. SALVAR NO SQLITE (LOCAL)
-    conn = conectar_banco()
-    df_novo['data_upload'] = datetime.now()
-    
-    colunas_banco = ['arquivo_origem', 'numero_nota', 'data_emissao', 'emissor_nome', 'emissor_cnpj', 
-                     'tomador_nome', 'tomador_cnpj', 'descricao_item', 'codigo_ncm', 'valor_bruto', 
-                     'valor_liquido', 'valor_icms', 'valor_ipi', 'valor_icms_st', 'valor_issqn', 
-                     'retencao_issqn', 'valor_desconto', 'data_upload']
-    
-    for col in colunas_banco:
-        if col not in df_novo.columns: df_novo[col] = None
-        
-    df_novo['json_completo'] = df_novo.apply(lambda x: x.to_json(), axis=1)
-    
-    # Prepara dataframe para salvar (converte data para string)
-    df_salvar = df_novo.copy()
-    df_salvar['data_upload'] = df_salvar['data_upload'].astype(str)
-    
-    colunas_finais = colunas_banco + ['json_completo']
-    df_salvar[colunas_finais].to_sql('notas_fiscais', conn, if_exists='append', index=False)
-    conn.close()
-
-    # 2. SALVAR NO GOOGLE SHEETS (NUVEM)
-    sheet = conectar_gsheets()
-    if sheet:
-        try:
-            # Debug visual para confirmar conexão
-            st.info(f"🔗 Conectado à planilha: {sheet.title} (ID: {sheet.spreadsheet.id})")
-            
-            # Se planilha vazia, cria cabeçalho
-            if len(sheet.get_all_values()) == 0:
-                sheet.append_row(colunas_banco)
-            
-            # Converte para lista e salva
-            dados_nuvem = df_salvar[colunas_banco].fillna("").values.tolist()
-            for linha in dados_nuvem:
-                sheet.append_row(linha)
-            
-            st.toast("Backup na Nuvem (Google Sheets) realizado!", icon="☁️")
-        except Exception as e:
-            st.error(f"Erro ao salvar na nuvem: {e}")
+    with metricas.medir('gravacao', notas=len(df_novo)):
+        salvar_notas(df_novo)
+
+    if sincronizacao.credenciais_disponiveis():
+        sincronizacao.notificar()
+        st.toast("Backup na Nuvem (Google Sheets) agendado!", icon="☁️")
     else:
-        st.warning("Salvo apenas Localmente (Planilha não encontrada ou creds.json ausente).")
-
-def carregar_historico():
-    conn = conectar_banco()
-    try:
-        df = pd.read_sql("SELECT * FROM notas_fiscais ORDER BY data_upload DESC", conn)
-    except:
-        df = pd.DataFrame()
-    conn.close()
-    return df
-
-inicializar_banco()
-
-# --- 5. GERADOR DE PDF ---
-def gerar_relatorio_pdf(df_filtrado):
-    buffer = io.BytesIO()
-    c = canvas.Canvas(buffer, pagesize=letter)
-    width, height = letter
-    
-    # Cabeçalho
-    c.setFillColor(colors.darkblue)
-    c.rect(0, height - 100, width, 100, fill=True, stroke=False)
-    c.setFillColor(colors.white)
-    c.setFont("Helvetica-Bold", 28)
-    c.drawString(40, height - 60, "OPERTIX")
-    c.setFont("Helvetica", 14)
-    c.drawString(40, height - 85, "Relatório de Auditoria Fiscal & Financeira")
-    
-    # Corpo
-    c.setFillColor(colors.black)
-    y = height - 150
-    
-    # Resumo Financeiro
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(40, y, "1. Resumo do Período")
-    y -= 30
-    
-    val_bruto = df_filtrado['valor_bruto'].sum()
-    val_liq = df_filtrado['valor_liquido'].sum()
-    val_icms = df_filtrado['valor_icms'].sum()
-    val_iss = df_filtrado['valor_issqn'].sum()
-    
-    c.setFont("Helvetica", 12)
-    c.drawString(40, y, f"• Total Processado: R$ {val_bruto:,.2f}")
-    y -= 20
-    c.drawString(40, y, f"• Total Líquido a Pagar: R$ {val_liq:,.2f}")
-    y -= 20
-    c.drawString(40, y, f"• Total ICMS (Produtos): R$ {val_icms:,.2f}")
-    y -= 20
-    c.drawString(40, y, f"• Total ISSQN (Serviços): R$ {val_iss:,.2f}")
-    
-    y -= 40
-    c.setStrokeColor(colors.gray)
-    c.line(40, y, width - 40, y)
-    y -= 40
-    
-    # Detalhamento
-    c.setFont("Helvetica-Bold", 16)
-    c.drawString(40, y, "2. Detalhamento por Nota (Top Recentes)")
-    y -= 30
-    c.setFont("Helvetica-Bold", 10)
-    c.drawString(40, y, "DATA")
-    c.drawString(120, y, "EMISSOR")
-    c.drawString(300, y, "TIPO")
-    c.drawString(450, y, "VALOR")
-    y -= 15
-    
-    c.setFont("Helvetica", 9)
-    # Pega apenas as primeiras 30 notas para não quebrar o PDF de exemplo
-    for idx, row in df_filtrado.head(30).iterrows():
-        if y < 50: # Nova página se acabar espaço
-            c.showPage()
-            y = height - 50
-        
-        data = str(row['data_emissao'])[:10]
-        emissor = str(row['emissor_nome'])[:25]
-        tipo = "Produto" if row['valor_icms'] > 0 else "Serviço"
-        valor = f"R$ {row['valor_bruto']:,.2f}"
-        
-        c.drawString(40, y, data)
-        c.drawString(120, y, emissor)
-        c.drawString(300, y, tipo)
-        c.drawString(450, y, valor)
-        y -= 15
-
-    # Rodapé
-    c.setFont("Helvetica-Oblique", 8)
-    c.drawString(40, 30, f"Gerado automaticamente em {datetime.now().strftime('%d/%m/%Y')}")
-
-    c.showPage()
-    c.save()
-    buffer.seek(0)
-    return buffer
-
-# --- 6. AGENTES IA & UTILITÁRIOS ---
-def ler_pdf(uploaded_file):
-    try:
-        pdf_reader = PdfReader(uploaded_file)
-        text = ""
-        for page in pdf_reader.pages: text += page.extract_text()
-        return text
-    except: return ""
-
-def criar_equipe_extracao():
-    extrator = Agent(
-        role='Auditor Tributário Sênior',
-        goal='Extrair dados com fidelidade absoluta, distinguindo Comércio (ICMS) e Serviço (ISS).',
-        backstory='Especialista em legislação fiscal. Você não inventa dados.',
-        verbose=False, allow_delegation=False, llm=MODELO_LLM
-    )
-    auditor = Agent(
-        role='Engenheiro de Dados',
-        goal='Padronizar JSON e sanitizar dados.',
-        backstory='Garante datas em DD/MM/AAAA, floats corretos e campos vazios zerados.',
-        verbose=False, allow_delegation=False, llm=MODELO_LLM
-    )
-    return extrator, auditor
-
-def analisar_dados_com_ia(df_historico):
-    analista = Agent(
-        role='CFO Virtual',
-        goal='Analisar o histórico financeiro acumulado.',
-        backstory='Analisa tendências de longo prazo e carga tributária.',
-        verbose=True, allow_delegation=False, llm=MODELO_LLM
-    )
-    task = Task(description=f"Analise: {df_historico.head(50).to_string()}", expected_output="Relatório Executivo Markdown", agent=analista)
-    return Crew(agents=[analista], tasks=[task]).kickoff()
+        st.warning("Salvo apenas Localmente (creds.json ausente). As notas ficam na fila para a nuvem.")
+
+@st.cache_data(show_spinner=False, max_entries=4)
+def carregar_resumo_dashboard(versao):
+    """Agregados do Dashboard; `versao` (consultas.versao_dados) renova o cache a cada gravação."""
+    return consultas.resumo_dashboard()
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def carregar_resumo_estatistico(versao):
+    """Resumo do histórico inteiro enviado ao CFO Virtual; refeito só quando os dados mudam."""
+    return analise.resumo_estatistico()
+
+@st.cache_data(show_spinner=False, max_entries=32)
+def contar_notas_filtro(versao, filtros):
+    return consultas.contar_notas(filtros)
+
+@st.cache_data(show_spinner=False, max_entries=2)
+def contar_arquivadas(versao):
+    return arquivamento.contar()
+
+@st.cache_data(show_spinner=False, ttl=30, max_entries=4)
+def carregar_metricas(janela):
+    """Registros de métricas da última `janela` (s); relidos no máximo a cada 30 s, não a cada clique."""
+    return metricas.carregar(time.time() - janela)
 
+@st.cache_data(show_spinner=False, ttl=30, max_entries=1)
+def texto_prometheus():
+    return metricas.exportar_prometheus()
+
+@st.cache_resource(show_spinner=False)
+def iniciar_sistema():
+    """Uma vez por processo, não a cada rerun: migrações do banco e thread de envio ao Google Sheets."""
+    inicializar_banco()
+    sincronizacao.iniciar()
+
+@st.fragment(run_every=2)
+def acompanhar_relatorio():
+    """Mostra o andamento do relatório pedido nesta sessão sem bloquear o resto da página."""
+    futuro = st.session_state.get('relatorio_pdf')
+    if futuro is None: return
+    if not futuro.done():
+        st.info("⏳ Gerando o relatório em segundo plano...")
+    elif futuro.exception() is not None:
+        st.error(f"Falha ao gerar o relatório: {futuro.exception()}")
+    else:
+        st.download_button(
+            label="📄 Baixar Relatório Executivo (PDF)",
+            data=futuro.result(),
+            file_name="relatorio_opertix.pdf",
+            mime="application/pdf"
+        )
+
+@st.fragment(run_every=2)
+def acompanhar_lote():
+    """Progresso do último lote enviado nesta sessão, lido da fila (a extração roda no worker)."""
+    lote_id = st.session_state['lote_extracao']
+    andamento = fila.progresso(lote_id)
+    total, finalizadas = andamento['total'], andamento[fila.CONCLUIDA] + andamento[fila.FALHOU]
+    st.progress(finalizadas / total if total else 1.0)
+    if finalizadas < total:
+        st.markdown(f"🔄 **Lote {lote_id}:** {finalizadas}/{total} concluído(s), {andamento[fila.EXECUTANDO]} em extração")
+        if not fila.trabalhadores_ativos():
+            st.caption("⏳ Aguardando um worker (`python worker.py executar`)...")
+            fila.garantir_trabalhador()
+    else:
+        st.success(f"✅ Lote {lote_id} concluído! {andamento[fila.CONCLUIDA]} nota(s) processada(s).")
+
+    origens = andamento['origens']
+    c_hit, c_miss, c_regras, c_ia = st.columns(4)
+    with c_hit: st.metric("♻️ Cache (acertos)", origens.get('cache', 0))
+    with c_miss: st.metric("Cache (faltas)", sum(origens.get(o, 0) for o in ('regras', 'llm', 'sem_texto')))
+    with c_regras: st.metric("⚡ Leitor por Regras", origens.get('regras', 0))
+    with c_ia: st.metric("🤖 Agentes de IA", origens.get('llm', 0))
+    if origens.get('sem_texto'):
+        st.caption(f"🖼️ {origens['sem_texto']} PDF(s) sem camada de texto não foram enviados à IA.")
+    if andamento['tokens_antes']:
+        st.caption(f"✂️ Texto enviado à IA compactado de {andamento['tokens_antes']:,} para "
+                   f"{andamento['tokens_depois']:,} tokens.")
+
+    if andamento[fila.FALHOU]:
+        with st.expander(f"❌ {andamento[fila.FALHOU]} arquivo(s) com falha"):
+            st.dataframe(fila.falhas(lote_id), use_container_width=True, hide_index=True)
+            if st.button("Tentar de novo"):
+                fila.repetir_falhas(lote_id)
+                fila.garantir_trabalhador()
+
+iniciar_sistema()
+
+# --- 4. UTILITÁRIOS ---
 def card_metric_html(label, value, prefix="R$"):
     return f"""
     <div class="kpi-card">
@@ -346,7 +230,7 @@ def card_metric_html(label, value, prefix="R$"):
     </div>
     """
 
-# --- 7. MENU LATERAL ---
+# --- 5. MENU LATERAL ---
 with st.sidebar:
     st.markdown("<h1 style='text-align: center; color: #FF4B4B;'>OPERTIX</h1>", unsafe_allow_html=True)
     st.markdown(f"<p style='text-align: center; color: gray;'>Usuário: <b>{st.session_state['usuario_atual']}</b></p>", unsafe_allow_html=True)
@@ -354,8 +238,8 @@ with st.sidebar:
     
     selected = option_menu(
         menu_title=None,
-        options=["Nova Auditoria", "Dashboard BI", "Banco de Dados"],
-        icons=["cloud-upload", "graph-up-arrow", "database"],
+        options=["Nova Auditoria", "Dashboard BI", "Banco de Dados", "Desempenho"],
+        icons=["cloud-upload", "graph-up-arrow", "database", "speedometer2"],
         menu_icon="cast",
         default_index=0,
         styles={
@@ -372,168 +256,302 @@ with st.sidebar:
         st.session_state['usuario_atual'] = None
         st.rerun()
 
-# --- 8. PÁGINAS ---
+# --- 6. PÁGINAS ---
 
 # === NOVA AUDITORIA ===
 if selected == "Nova Auditoria":
     st.title("🚀 Nova Auditoria")
-    st.markdown("Arraste suas notas fiscais (PDF) para processamento imediato.")
+    st.markdown("Arraste suas notas fiscais (PDF, soltas ou em ZIP) para processamento em segundo plano, ou os XMLs de NF-e/NFS-e (soltos ou em ZIP) para importação direta.")
+    
+    uploaded_files = st.file_uploader("Selecione os arquivos PDF, XML ou ZIP", type=['pdf', 'xml', 'zip'], accept_multiple_files=True)
     
-    uploaded_files = st.file_uploader("Selecione os arquivos PDF", type='pdf', accept_multiple_files=True)
+    with st.expander("⚙️ Configurações de Processamento"):
+        modo = st.radio("Motor de IA", list(MODOS_EXTRACAO), format_func=MODOS_EXTRACAO.get, horizontal=True)
+        orcamento_tokens = st.number_input("Orçamento de tokens por nota (texto enviado à IA)", 500, 100_000, ORCAMENTO_TOKENS, step=500)
+        limiar_regras = st.slider("Confiança mínima do leitor por regras (abaixo disso usa IA)", 0.5, 1.0, LIMIAR_CONFIANCA, 0.05)
+        st.caption(f"⚙️ Workers de extração ativos: {fila.trabalhadores_ativos()} — paralelismo e limites de taxa são "
+                   "opções do worker (`python worker.py executar --concorrencia 8 --rpm 500 --tpm 200000`)")
+        st.caption(f"♻️ Cache de extração: {total_entradas_cache()} nota(s) armazenada(s)")
+        pendentes_nuvem, erro_nuvem = sincronizacao.status_fila()
+        st.caption(f"☁️ Fila do Google Sheets: {pendentes_nuvem} nota(s) pendente(s)"
+                   + (f" — último erro: {erro_nuvem}" if erro_nuvem else ""))
+    
+    fila_reextracao = validacao.itens_fila()
+    if not fila_reextracao.empty:
+        with st.expander(f"🔁 Fila de reextração ({len(fila_reextracao)} nota(s) reprovadas na validação)"):
+            st.dataframe(fila_reextracao, use_container_width=True, hide_index=True)
+            c_reextrair, c_aceitar = st.columns(2)
+            with c_reextrair:
+                if st.button("Reextrair só os campos inválidos"):
+                    # Roda nos workers, com o limite de taxa deles; a tabela acima mostra o status de cada nota
+                    solicitadas = validacao.solicitar_reextracao()
+                    fila.garantir_trabalhador()
+                    st.info(f"{solicitadas} nota(s) enviada(s) para reextração nos workers. As corrigidas saem "
+                            "desta fila; as que continuarem inválidas voltam como pendentes.")
+            with c_aceitar:
+                if st.button("Gravar como estão"):
+                    st.success(f"{validacao.aceitar_fila()} nota(s) gravada(s) sem correção.")
+                    sincronizacao.notificar()
     
     if uploaded_files:
         if st.button("Iniciar Processamento Inteligente", type="primary"):
-            progress_bar = st.progress(0)
             status_text = st.empty()
-            resultados = []
+            pdfs = [a for a in uploaded_files if a.name.lower().endswith('.pdf')]
+            xmls = [a for a in uploaded_files if not a.name.lower().endswith('.pdf')]
             
-            for i, arquivo in enumerate(uploaded_files):
-                progress_bar.progress((i + 1) / len(uploaded_files))
-                status_text.markdown(f"🔄 **Processando:** `{arquivo.name}`...")
-                
-                texto = ler_pdf(arquivo)
-                extrator, auditor = criar_equipe_extracao()
-                
-                # Tarefas Blindadas
-                t1 = Task(
-                    description=f"""
-                    Analise o texto:
-                    ---
-                    {texto}
-                    ---
-                    REGRAS:
-                    1. NÃO ALUCINE. Se não achar, use 0.0.
-                    2. DATAS: Converta para DD/MM/AAAA.
-                    3. EXTRAIA: Tipo (DANFE/NFSe), Emissor, Tomador, Num, Data.
-                    4. FINANCEIRO: Bruto, Líquido, Desconto.
-                    5. IMPOSTOS: ICMS, IPI, ISSQN, Retenções.
-                    """,
-                    expected_output="Dados extraídos.", agent=extrator
-                )
-                
-                t2 = Task(
-                    description="""
-                    Gere JSON válido:
-                    {
-                        "numero_nota": "string", "data_emissao": "string", 
-                        "emissor_nome": "string", "emissor_cnpj": "string", 
-                        "tomador_nome": "string", "tomador_cnpj": "string", 
-                        "descricao_item": "string", "codigo_ncm": "string", 
-                        "valor_bruto": float, "valor_desconto": float, "valor_liquido": float, 
-                        "valor_icms": float, "valor_ipi": float, "valor_icms_st": float,
-                        "valor_issqn": float, "retencao_issqn": float
-                    }
-                    """,
-                    expected_output="JSON válido.", agent=auditor
-                )
-                
-                try:
-                    res = Crew(agents=[extrator, auditor], tasks=[t1, t2]).kickoff()
-                    clean = str(res).replace("```json", "").replace("```", "").strip()
-                    if clean.startswith("json"): clean = clean[4:]
-                    dados = json.loads(clean)
-                    dados['arquivo_origem'] = arquivo.name
-                    resultados.append(dados)
-                except:
-                    st.error(f"Falha em {arquivo.name}")
+            # XML/ZIP: importação direta (sem IA), gravando em blocos para não acumular o lote inteiro
+            if xmls:
+                importadas, bloco = 0, []
+                for arquivo in xmls:
+                    status_text.markdown(f"📥 **Importando XML:** `{arquivo.name}`...")
+                    try:
+                        for nota in ler_arquivo_xml(arquivo, arquivo.name):
+                            bloco.append(nota)
+                            if len(bloco) >= TAMANHO_BLOCO_XML:
+                                salvar_no_banco(pd.DataFrame(bloco))
+                                importadas += len(bloco)
+                                bloco = []
+                    except Exception as e:
+                        st.error(f"Falha em {arquivo.name}: {e}")
+                if bloco:
+                    salvar_no_banco(pd.DataFrame(bloco))
+                    importadas += len(bloco)
+                if importadas: st.success(f"📥 {importadas} nota(s) importada(s) direto do XML.")
             
-            if resultados:
-                df = pd.DataFrame(resultados)
-                cols_num = ['valor_bruto', 'valor_liquido', 'valor_icms', 'valor_issqn', 'valor_ipi', 'valor_desconto']
-                for c in cols_num:
-                    if c not in df.columns: df[c] = 0.0
-                    df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0.0)
-                
-                salvar_no_banco(df)
-                status_text.success("✅ Processamento concluído! Dados salvos.")
-                time.sleep(2)
+            # PDFs (soltos ou dentro dos ZIPs) viram um lote na fila; quem extrai é o worker.py
+            arquivos = [(arquivo.name, arquivo.getvalue()) for arquivo in pdfs]
+            for arquivo in xmls:
+                if arquivo.name.lower().endswith('.zip'):
+                    arquivo.seek(0)
+                    arquivos += fila.pdfs_do_zip(arquivo, arquivo.name)
+            status_text.empty()
+            if arquivos:
+                opcoes = {'modo': modo, 'limiar_regras': limiar_regras, 'orcamento_tokens': orcamento_tokens}
+                st.session_state['lote_extracao'] = fila.criar_lote(
+                    arquivos, opcoes, descricao=f"{len(arquivos)} PDF(s) enviados por {st.session_state['usuario_atual']}")
+                fila.garantir_trabalhador()
+    
+    if st.session_state.get('lote_extracao'):
+        acompanhar_lote()
 
 # === DASHBOARD BI ===
 elif selected == "Dashboard BI":
     st.title("📊 Painel de Inteligência")
-    df = carregar_historico()
+    versao = consultas.versao_dados()
+    resumo = carregar_resumo_dashboard(versao)
+    totais = resumo['totais']
     
-    if df.empty:
+    if not totais['quantidade']:
         st.warning("Nenhum dado encontrado.")
     else:
-        # Botão PDF
-        col_pdf, _ = st.columns([1, 4])
-        with col_pdf:
-            pdf_bytes = gerar_relatorio_pdf(df)
-            st.download_button(
-                label="📄 Baixar Relatório Executivo (PDF)",
-                data=pdf_bytes,
-                file_name="relatorio_opertix.pdf",
-                mime="application/pdf"
-            )
-
-        # Filtro Visual
-        cols_drop = ['json_completo', 'id']
-        df_visual = df.drop(columns=[c for c in cols_drop if c in df.columns], errors='ignore')
+        # Relatório PDF: gerado só quando pedido, em segundo plano, e reaproveitado enquanto os dados não mudam
+        with st.expander("📄 Relatório Executivo (PDF)"):
+            r1, r2, r3 = st.columns(3)
+            with r1: rel_fornecedor = st.text_input("Fornecedor", key="rel_fornecedor")
+            with r2: rel_inicio = st.date_input("Emissão de", value=None, format="DD/MM/YYYY", key="rel_inicio")
+            with r3: rel_fim = st.date_input("Emissão até", value=None, format="DD/MM/YYYY", key="rel_fim")
+            if st.button("Gerar Relatório"):
+                import relatorio
+                filtros_rel = {'fornecedor': rel_fornecedor, 'data_inicio': rel_inicio, 'data_fim': rel_fim}
+                st.session_state['relatorio_pdf'] = relatorio.solicitar_relatorio(versao, filtros_rel)
+            acompanhar_relatorio()
 
         st.markdown("### Indicadores Chave")
         c1, c2, c3, c4 = st.columns(4)
         
-        for col in ['valor_bruto', 'valor_icms', 'valor_issqn', 'valor_liquido']:
-            if col not in df.columns: df[col] = 0.0
-            df[col] = df[col].fillna(0.0)
-            
-        with c1: st.markdown(card_metric_html("Total Processado", df['valor_bruto'].sum()), unsafe_allow_html=True)
-        with c2: st.markdown(card_metric_html("Total ICMS (Prod)", df['valor_icms'].sum()), unsafe_allow_html=True)
-        with c3: st.markdown(card_metric_html("Total ISSQN (Serv)", df['valor_issqn'].sum()), unsafe_allow_html=True)
-        with c4: st.markdown(card_metric_html("Total Líquido", df['valor_liquido'].sum()), unsafe_allow_html=True)
+        with c1: st.markdown(card_metric_html("Total Processado", totais['valor_bruto']), unsafe_allow_html=True)
+        with c2: st.markdown(card_metric_html("Total ICMS (Prod)", totais['valor_icms']), unsafe_allow_html=True)
+        with c3: st.markdown(card_metric_html("Total ISSQN (Serv)", totais['valor_issqn']), unsafe_allow_html=True)
+        with c4: st.markdown(card_metric_html("Total Líquido", totais['valor_liquido']), unsafe_allow_html=True)
         
         st.markdown("---")
         c_left, c_right = st.columns(2)
         
+        import plotly.express as px
         with c_left:
             st.markdown("#### 🏆 Top Fornecedores")
-            if 'emissor_nome' in df.columns:
-                df_chart = df.groupby('emissor_nome')['valor_bruto'].sum().reset_index().sort_values('valor_bruto', ascending=False).head(5)
+            df_chart = resumo['top_fornecedores']
+            if not df_chart.empty:
                 fig = px.bar(df_chart, x='valor_bruto', y='emissor_nome', orientation='h', text_auto=True, color='valor_bruto', color_continuous_scale='Reds')
                 fig.update_layout(showlegend=False, paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font=dict(color='white'))
                 st.plotly_chart(fig, use_container_width=True)
             
         with c_right:
             st.markdown("#### ⚖️ Produtos vs Serviços")
-            total_icms = df['valor_icms'].sum()
-            total_iss = df['valor_issqn'].sum()
+            total_icms = totais['valor_icms']
+            total_iss = totais['valor_issqn']
             df_pizza = pd.DataFrame({'Tipo': ['Produtos (ICMS)', 'Serviços (ISS)'], 'Valor': [total_icms, total_iss]})
             fig2 = px.pie(df_pizza, names='Tipo', values='Valor', hole=0.5, color_discrete_sequence=['#FF4B4B', '#FFA500'])
             fig2.update_layout(paper_bgcolor='rgba(0,0,0,0)', font=dict(color='white'))
             st.plotly_chart(fig2, use_container_width=True)
 
+        # Gasto por NCM somando os itens das notas (itens_nota), não só o primeiro item de cada nota
+        df_ncm = resumo['top_ncm'].dropna(subset=['codigo_ncm'])
+        df_forn_ncm = resumo['top_fornecedor_ncm'].dropna(subset=['codigo_ncm'])
+        if not df_ncm.empty:
+            n_left, n_right = st.columns(2)
+            with n_left:
+                st.markdown("#### 📦 Gasto por NCM (itens das notas)")
+                fig3 = px.bar(df_ncm, x='valor_total', y='codigo_ncm', orientation='h', text_auto=True,
+                              hover_data=['itens', 'quantidade', 'valor_icms', 'valor_ipi'])
+                fig3.update_layout(showlegend=False, yaxis=dict(type='category', autorange='reversed'),
+                                   paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font=dict(color='white'))
+                st.plotly_chart(fig3, use_container_width=True)
+            with n_right:
+                st.markdown("#### 🔗 Fornecedor x NCM (o que se compra de quem)")
+                nomes = df_forn_ncm['emissor_nome'].mask(df_forn_ncm['emissor_nome'] == '').fillna(df_forn_ncm['emissor_cnpj'])
+                df_forn_ncm = df_forn_ncm.assign(par=nomes.fillna('Não identificado') + ' · ' + df_forn_ncm['codigo_ncm'])
+                fig4 = px.bar(df_forn_ncm, x='valor_total', y='par', orientation='h', text_auto=True, color='codigo_ncm',
+                              hover_data=['emissor_cnpj', 'itens', 'quantidade'])
+                fig4.update_layout(yaxis=dict(title=None, autorange='reversed'), legend_title_text='NCM',
+                                   paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font=dict(color='white'))
+                st.plotly_chart(fig4, use_container_width=True)
+
         st.markdown("---")
         if st.button("🤖 Gerar Análise Executiva do CFO"):
             with st.spinner("O CFO Virtual está analisando os números..."):
-                analise = analisar_dados_com_ia(df)
-                st.info("Relatório de Inteligência:")
-                st.markdown(analise)
+                resumo_cfo = carregar_resumo_estatistico(versao)
+                texto_analise, do_cache = analise.analise_cfo(resumo_cfo)
+                st.info("Relatório de Inteligência:" + (" (reaproveitado: os números não mudaram)" if do_cache else ""))
+                st.markdown(texto_analise)
+                with st.expander("Resumo estatístico enviado ao CFO"):
+                    st.code(resumo_cfo)
 
 # === BANCO DE DADOS ===
 elif selected == "Banco de Dados":
     st.title("📂 Base de Dados Detalhada")
-    df = carregar_historico()
     
-    if not df.empty:
-        cols_drop = ['json_completo', 'id']
-        df_show = df.drop(columns=[c for c in cols_drop if c in df.columns], errors='ignore')
+    # Filtros aplicados no SQL: só a página visível sai do banco
+    with st.expander("🔎 Filtros", expanded=False):
+        f1, f2, f3 = st.columns(3)
+        with f1:
+            fornecedor = st.text_input("Fornecedor")
+            cnpj = st.text_input("CNPJ do emissor")
+        with f2:
+            data_inicio = st.date_input("Emissão de", value=None, format="DD/MM/YYYY")
+            data_fim = st.date_input("Emissão até", value=None, format="DD/MM/YYYY")
+        with f3:
+            valor_min = st.number_input("Valor bruto mínimo", min_value=0.0, value=None, step=100.0)
+            valor_max = st.number_input("Valor bruto máximo", min_value=0.0, value=None, step=100.0)
+        busca = st.text_input("Buscar na descrição do item")
+    filtros = {'fornecedor': fornecedor, 'cnpj': cnpj, 'data_inicio': data_inicio, 'data_fim': data_fim,
+               'valor_min': valor_min, 'valor_max': valor_max, 'busca': busca}
+    
+    # Cursores das páginas já visitadas (id mínimo de cada página); filtro novo volta ao início
+    if st.session_state.get('grade_filtros') != filtros:
+        st.session_state['grade_filtros'] = filtros
+        st.session_state['grade_cursores'] = [None]
+    cursores = st.session_state['grade_cursores']
+    
+    versao = consultas.versao_dados()
+    total_filtro = contar_notas_filtro(versao, filtros)
+    df_show = consultas.pagina_notas(filtros, cursores[-1])
+    
+    if not df_show.empty:
+        pagina = len(cursores)
+        total_paginas = max(1, -(-total_filtro // consultas.TAMANHO_PAGINA))
+        st.caption(f"{total_filtro:,} nota(s) encontrada(s) — página {pagina} de {total_paginas}")
+        arquivadas = contar_arquivadas(versao)
+        if arquivadas:
+            st.caption(f"Mais {arquivadas:,} nota(s) de meses antigos arquivadas em Parquet: entram no Dashboard, "
+                       "no relatório e nas exportações, mas não nesta grade.")
+        st.dataframe(df_show.drop(columns=['id']), use_container_width=True, height=500)
         
-        st.dataframe(df_show, use_container_width=True, height=500)
+        n_ant, n_prox, _ = st.columns([1, 1, 6])
+        with n_ant:
+            if st.button("◀ Anterior", disabled=pagina == 1):
+                cursores.pop()
+                st.rerun()
+        with n_prox:
+            if st.button("Próxima ▶", disabled=len(df_show) < consultas.TAMANHO_PAGINA or pagina >= total_paginas):
+                cursores.append(int(df_show['id'].iloc[-1]))
+                st.rerun()
         
         c1, c2 = st.columns([1, 4])
         with c1:
             if st.button("🗑️ Deletar Tudo (Local)"):
-                conn = conectar_banco()
-                conn.execute("DELETE FROM notas_fiscais")
-                conn.commit()
-                conn.close()
+                with conexao() as conn:
+                    conn.execute("DELETE FROM notas_fiscais")
+                arquivamento.apagar()
                 st.warning("Base Local limpa!")
                 time.sleep(1)
                 st.rerun()
         with c2:
-            buffer = io.BytesIO()
-            with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
-                df_show.to_excel(writer, index=False)
-            buffer.seek(0)
-            st.download_button("📥 Baixar Excel Completo", buffer, "opertix_full.xlsx", "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
+            # Exportação montada só quando pedida, em lotes direto do banco (todas as notas do filtro)
+            e1, e2, e3 = st.columns([2, 2, 1])
+            with e1: formato = st.selectbox("Formato", list(exportacao.FORMATOS), format_func=exportacao.FORMATOS.get)
+            with e2: incremental = st.checkbox("Só notas novas desde a última exportação")
+            with e3: gerar = st.button("📥 Exportar")
+            if gerar and formato == 'parquet':
+                with st.spinner("Exportando..."):
+                    caminho, quantidade, _ = exportacao.exportar(formato, filtros, incremental)
+                st.success(f"{quantidade} nota(s) gravada(s) no dataset Parquet em `{os.path.abspath(caminho)}`")
+            elif gerar:
+                # Excel/CSV vão só para o download: o arquivo temporário some logo depois de lido, e a
+                # marca da incremental só anda quando o arquivo é baixado
+                with st.spinner("Exportando..."), tempfile.TemporaryDirectory() as pasta:
+                    caminho, quantidade, marca = exportacao.exportar(formato, filtros, incremental, pasta,
+                                                                     registrar=False)
+                    with open(caminho, 'rb') as arquivo: conteudo = arquivo.read()
+                st.download_button(f"📥 Baixar {os.path.basename(caminho)} ({quantidade} notas)", conteudo,
+                                   os.path.basename(caminho),
+                                   on_click=exportacao.registrar_exportacao if marca else None,
+                                   args=(formato, marca))
+    else:
+        st.info("Nenhuma nota encontrada.")
+
+# === DESEMPENHO ===
+elif selected == "Desempenho":
+    st.title("⏱️ Desempenho do Pipeline")
+    st.caption("Tempo por etapa de cada nota, tokens, tentativas e falhas registrados pelo app e pelos workers.")
+    
+    # Período -> (segundos, tamanho do intervalo dos gráficos)
+    periodos = {"Última hora": (3600, '5min'), "Últimas 24 horas": (86400, '1h'),
+                "Últimos 7 dias": (7 * 86400, '6h'), "Últimos 30 dias": (30 * 86400, '1D')}
+    periodo = st.radio("Período", list(periodos), index=1, horizontal=True)
+    janela, frequencia = periodos[periodo]
+    df_met = carregar_metricas(janela)
+    notas_met = df_met[df_met['etapa'] == 'nota']
+    
+    if notas_met.empty:
+        st.info("Nenhuma nota processada no período.")
+    else:
+        quantidade = notas_met['notas'].sum()
+        # Paralelismo efetivo: tempo somado das notas / tempo de relógio entre a primeira e a última
+        relogio = (notas_met['registrado_em'].max() - (notas_met['registrado_em'] - notas_met['duracao']).min())
+        k1, k2, k3, k4, k5 = st.columns(5)
+        with k1: st.metric("Notas processadas", f"{quantidade:,}")
+        with k2: st.metric("Latência p95 por nota", f"{notas_met['duracao'].quantile(0.95):.2f} s")
+        with k3: st.metric("Custo médio por nota", f"US$ {notas_met['custo'].sum() / quantidade:.5f}")
+        with k4: st.metric("Falhas", f"{100 * (1 - notas_met['sucesso'].mean()):.1f}%")
+        with k5: st.metric("Paralelismo efetivo", f"{notas_met['duracao'].sum() / relogio:.1f}" if relogio > 0 else "-")
+        
+        import plotly.express as px
+        serie = metricas.serie_temporal(df_met, frequencia).reset_index()
+        g1, g2, g3 = st.columns(3)
+        with g1:
+            st.plotly_chart(px.line(serie, x='instante', y='notas_por_min', markers=True, title="Vazão (notas/min)"),
+                            use_container_width=True)
+        with g2:
+            st.plotly_chart(px.line(serie, x='instante', y=['p50_s', 'p95_s'], markers=True, title="Latência por nota (s)"),
+                            use_container_width=True)
+        with g3:
+            st.plotly_chart(px.line(serie, x='instante', y='custo_por_nota', markers=True, title="Custo por nota (US$)"),
+                            use_container_width=True)
+        
+        st.subheader("Etapas")
+        st.dataframe(metricas.resumo_etapas(df_met).style.format({
+            'p50_s': '{:.3f}', 'p95_s': '{:.3f}', 'media_s': '{:.3f}', 'falhas_pct': '{:.1f}',
+        }), use_container_width=True)
+        
+        c_origem, c_falhas = st.columns([1, 2])
+        with c_origem:
+            st.caption("Notas por origem do resultado")
+            st.dataframe(metricas.por_origem(df_met), use_container_width=True)
+        with c_falhas:
+            falhas_met = df_met[df_met['sucesso'] == 0].sort_values('registrado_em', ascending=False)
+            st.caption(f"Últimas falhas ({len(falhas_met)} no período)")
+            st.dataframe(falhas_met[['instante', 'etapa', 'arquivo', 'erro']].head(50), use_container_width=True, hide_index=True)
+    
+    st.download_button("📤 Exportar métricas (formato Prometheus)", texto_prometheus(),
+                       "opertix_metricas.prom", mime="text/plain")
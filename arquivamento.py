@@ -0,0 +1,195 @@
+"""Arquivo frio do histórico: meses antigos saem do SQLite para Parquet, um arquivo por mês de emissão.
+
+`arquivar()` move as notas emitidas antes dos últimos MESES_ATIVOS meses para
+PASTA_ARQUIVO/mes=AAAA-MM/notas.parquet (colunar, compactado), com os itens ao lado em itens.parquet,
+e as apaga do banco, que fica só com
+o histórico recente: menor para backup, varreduras e páginas. O Dashboard, o relatório, as
+exportações e o CFO continuam lendo o arquivo (`tabela()` e `itens()`, usadas por consultas.py e analise.py);
+só a grade do "Banco de Dados" mostra apenas as notas do banco.
+
+Com backup no Google Sheets ativo (creds.json), nota ainda na fila da nuvem espera no banco.
+O pyarrow só é importado quando há arquivo para ler ou escrever.
+
+Uso periódico, fora da interface:  python arquivamento.py --meses 24
+"""
+import argparse
+import os
+import shutil
+from datetime import date
+
+import sincronizacao
+from banco import CAMPOS_ITEM_VALOR, CAMPOS_VALOR, COLUNAS_ITEM, COLUNAS_NOTA, conexao, inicializar_banco
+
+PASTA_ARQUIVO = "arquivo_notas"
+ARQUIVO_MES = "notas.parquet"
+ITENS_MES = "itens.parquet"
+
+# Meses de emissão mantidos no SQLite (o mês atual e os anteriores)
+MESES_ATIVOS = 24
+
+COLUNAS_ARQUIVO = ['id'] + COLUNAS_NOTA + ['chave_nota', 'data_emissao_iso', 'extras']
+COLUNAS_ITENS_ARQUIVO = ['id_nota', 'numero_item'] + COLUNAS_ITEM
+
+
+def _esquema(colunas=COLUNAS_ARQUIVO):
+    import pyarrow as pa
+    tipos = {'id': pa.int64(), 'id_nota': pa.int64(), 'numero_item': pa.int64(), 'extras': pa.binary(),
+             **{c: pa.float64() for c in CAMPOS_VALOR + CAMPOS_ITEM_VALOR}}
+    return pa.schema([(c, tipos.get(c, pa.string())) for c in colunas])
+
+def _tabela_linhas(linhas, esquema):
+    import pyarrow as pa
+    if not linhas: return esquema.empty_table()
+    return pa.Table.from_arrays([pa.array(valores, campo.type) for valores, campo in zip(zip(*linhas), esquema)],
+                                schema=esquema)
+
+def _somar_meses(mes, meses):
+    """'AAAA-MM' deslocado de `meses` meses (negativo volta no tempo)."""
+    total = int(mes[:4]) * 12 + int(mes[5:7]) - 1 + meses
+    return f"{total // 12:04d}-{total % 12 + 1:02d}"
+
+def mes_corte(meses=MESES_ATIVOS, hoje=None):
+    """Primeiro mês (AAAA-MM) mantido no banco: as notas emitidas antes dele vão para o arquivo."""
+    return _somar_meses((hoje or date.today()).strftime("%Y-%m"), 1 - meses)
+
+def _caminho(mes, arquivo=ARQUIVO_MES):
+    return os.path.join(PASTA_ARQUIVO, f"mes={mes}", arquivo)
+
+def meses_arquivados():
+    if not os.path.isdir(PASTA_ARQUIVO): return []
+    return sorted(nome[4:] for nome in os.listdir(PASTA_ARQUIVO)
+                  if nome.startswith("mes=") and os.path.exists(os.path.join(PASTA_ARQUIVO, nome, ARQUIVO_MES)))
+
+
+# --- ARQUIVAMENTO ---
+def _gravar(tabela, caminho):
+    """Grava ao lado com '_' (fora das leituras) e troca de uma vez: leitor nunca vê arquivo pela metade."""
+    import pyarrow.parquet as pq
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    temporario = os.path.join(os.path.dirname(caminho), "_" + os.path.basename(caminho))
+    pq.write_table(tabela, temporario, compression='zstd')
+    os.replace(temporario, caminho)
+
+def _arquivar_mes(mes, condicao):
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    periodo = f"data_emissao_iso >= ? AND data_emissao_iso < ?{condicao}"
+    with conexao() as conn:
+        # Trava de escrita do começo ao fim: o que vai para o Parquet é exatamente o que sai do banco
+        conn.execute("BEGIN IMMEDIATE")
+        params = (mes, _somar_meses(mes, 1))
+        linhas = conn.execute(f"SELECT {', '.join(COLUNAS_ARQUIVO)} FROM notas_fiscais WHERE {periodo} "
+                              "ORDER BY data_emissao_iso, id", params).fetchall()
+        if not linhas: return 0
+        linhas_itens = conn.execute(f'''
+            SELECT {", ".join(COLUNAS_ITENS_ARQUIVO)} FROM itens_nota
+            WHERE id_nota IN (SELECT id FROM notas_fiscais WHERE {periodo}) ORDER BY id_nota, numero_item
+        ''', params).fetchall()
+        novas = _tabela_linhas(linhas, _esquema())
+        itens = _tabela_linhas(linhas_itens, _esquema(COLUNAS_ITENS_ARQUIVO))
+
+        # Mês já arquivado (nota reimportada ou arquivamento interrompido): a versão do banco substitui a antiga
+        caminho, caminho_itens = _caminho(mes), _caminho(mes, ITENS_MES)
+        substituidas = novas['id']
+        if os.path.exists(caminho):
+            antigas = pq.ParquetFile(caminho).read()
+            repetidas = pc.or_(pc.is_in(antigas['id'], value_set=novas['id']),
+                               pc.is_in(antigas['chave_nota'], value_set=novas['chave_nota'].drop_null()))
+            substituidas = pa.concat_arrays([*antigas.filter(repetidas)['id'].chunks, *novas['id'].chunks])
+            novas = pa.concat_tables([antigas.filter(pc.invert(repetidas)), novas])
+        if os.path.exists(caminho_itens):
+            antigos = pq.ParquetFile(caminho_itens).read()
+            itens = pa.concat_tables([antigos.filter(pc.invert(pc.is_in(antigos['id_nota'], value_set=substituidas))), itens])
+
+        # Itens antes das notas: se parar no meio, a próxima rodada refaz os dois
+        _gravar(itens, caminho_itens)
+        _gravar(novas, caminho)
+        conn.executemany("DELETE FROM notas_fiscais WHERE id = ?", [(linha[0],) for linha in linhas])
+    return len(linhas)
+
+def arquivar(meses=MESES_ATIVOS):
+    """Move para o Parquet as notas emitidas antes de `mes_corte(meses)`. Devolve {mês: notas movidas}."""
+    if meses < 1: raise ValueError("O banco precisa manter pelo menos o mês atual (meses >= 1).")
+    condicao = ""
+    if sincronizacao.credenciais_disponiveis():
+        condicao = " AND id NOT IN (SELECT id_nota FROM fila_nuvem WHERE pendente = 1)"
+    with conexao() as conn:
+        antigos = [mes for (mes,) in conn.execute(f'''
+            SELECT DISTINCT substr(data_emissao_iso, 1, 7) FROM notas_fiscais
+            WHERE data_emissao_iso < ?{condicao} ORDER BY 1
+        ''', (mes_corte(meses),))]
+    movidas = {mes: _arquivar_mes(mes, condicao) for mes in antigos}
+    if any(movidas.values()):
+        # Sem VACUUM as páginas liberadas ficam no arquivo do banco (só são reaproveitadas por gravações novas)
+        with conexao() as conn:
+            conn.execute("VACUUM")
+    return movidas
+
+def apagar():
+    """Remove o arquivo inteiro (usado pelo "Deletar Tudo" da interface)."""
+    shutil.rmtree(PASTA_ARQUIVO, ignore_errors=True)
+
+
+# --- LEITURA ---
+def _sobrepostas(ultimo_mes):
+    """ids e chaves das notas do período arquivado que estão no banco: se também estiverem no arquivo
+    (reimportadas depois de arquivar, ou arquivamento interrompido antes de apagar), vale a do banco."""
+    with conexao() as conn:
+        linhas = conn.execute("SELECT id, chave_nota FROM notas_fiscais WHERE data_emissao_iso < ?",
+                              (_somar_meses(ultimo_mes, 1),)).fetchall()
+    return [l[0] for l in linhas], [l[1] for l in linhas if l[1] is not None]
+
+def _dataset(meses, arquivo, colunas):
+    """Dataset dos arquivos `arquivo` dos meses, com a partição 'mes' como coluna."""
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    caminhos = [c for c in (_caminho(mes, arquivo) for mes in meses) if os.path.exists(c)]
+    return ds.dataset(caminhos, format='parquet', schema=_esquema(colunas).append(pa.field('mes', pa.string())),
+                      partitioning=ds.partitioning(pa.schema([('mes', pa.string())]), flavor='hive'),
+                      partition_base_dir=PASTA_ARQUIVO)
+
+def tabela(colunas, filtro=None):
+    """Tabela do pyarrow com as `colunas` (e 'mes', se pedida) das notas arquivadas que passam no `filtro`.
+
+    `filtro` é uma expressão de pyarrow.dataset (consultas.filtros_arquivo). None se não há arquivo.
+    """
+    meses = meses_arquivados()
+    if not meses: return None
+    import pyarrow.dataset as ds
+
+    dataset = _dataset(meses, ARQUIVO_MES, COLUNAS_ARQUIVO)
+    ids, chaves = _sobrepostas(meses[-1])
+    for coluna, valores in (('id', ids), ('chave_nota', chaves)):
+        if valores:
+            fora = ~ds.field(coluna).isin(valores)
+            filtro = fora if filtro is None else filtro & fora
+    return dataset.to_table(columns=colunas, filter=filtro)
+
+def itens(colunas, colunas_nota=(), filtro=None):
+    """Itens arquivados (`colunas` de itens_nota, mais `colunas_nota` da nota) das notas arquivadas do filtro."""
+    notas = tabela(['id', *colunas_nota], filtro)
+    if notas is None: return None
+    import pyarrow.dataset as ds
+    itens = _dataset(meses_arquivados(), ITENS_MES, COLUNAS_ITENS_ARQUIVO).to_table(
+        columns=['id_nota', *colunas], filter=ds.field('id_nota').isin(notas['id']))
+    return itens.join(notas, 'id_nota', 'id')
+
+def contar():
+    arquivo = tabela(['id'])
+    return arquivo.num_rows if arquivo is not None else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move as notas de meses antigos do banco local para Parquet.")
+    parser.add_argument("--meses", type=int, default=MESES_ATIVOS,
+                        help="meses de emissão mantidos no banco, contando o atual")
+    args = parser.parse_args()
+
+    inicializar_banco()
+    movidas = arquivar(args.meses)
+    for mes, quantidade in movidas.items():
+        print(f"{mes}: {quantidade} nota(s)")
+    print(f"{sum(movidas.values())} nota(s) arquivada(s) em {PASTA_ARQUIVO}/; "
+          f"o banco mantém as emitidas a partir de {mes_corte(args.meses)}")
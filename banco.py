@@ -0,0 +1,452 @@
+"""Camada de acesso ao banco local (SQLite) compartilhada pela interface e pelo motor de extração.
+
+As conexões são reaproveitadas por um pool (`conexao()`), o banco roda em modo WAL para leituras
+não esperarem as gravações em lote, e o esquema evolui por migrações numeradas (PRAGMA user_version).
+"""
+import json
+import queue
+import re
+import sqlite3
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+CAMINHO_BANCO = "dados_fiscais.db"
+
+# Espera máxima (s) por um lock de escrita antes de desistir com "database is locked"
+TIMEOUT_BLOQUEIO = 30
+# Conexões ociosas mantidas no pool
+MAX_CONEXOES_LIVRES = 8
+
+# Esquema de uma nota (mesmos campos do JSON gerado pelo agente auditor)
+CAMPOS_TEXTO = ['numero_nota', 'data_emissao', 'emissor_nome', 'emissor_cnpj',
+                'tomador_nome', 'tomador_cnpj', 'descricao_item', 'codigo_ncm']
+CAMPOS_VALOR = ['valor_bruto', 'valor_desconto', 'valor_liquido', 'valor_icms', 'valor_ipi',
+                'valor_icms_st', 'valor_issqn', 'retencao_issqn']
+# Retenções federais: sem coluna própria, ficam nos extras da nota
+CAMPOS_RETENCAO = ['retencao_pis', 'retencao_cofins', 'retencao_csll', 'retencao_irrf', 'retencao_inss']
+
+# Colunas gravadas a cada nota (também é a ordem das colunas na planilha do Google Sheets)
+COLUNAS_NOTA = ['arquivo_origem', 'numero_nota', 'data_emissao', 'emissor_nome', 'emissor_cnpj',
+                'tomador_nome', 'tomador_cnpj', 'descricao_item', 'codigo_ncm', 'valor_bruto',
+                'valor_liquido', 'valor_icms', 'valor_ipi', 'valor_icms_st', 'valor_issqn',
+                'retencao_issqn', 'valor_desconto', 'data_upload']
+
+# Itens de uma nota (lista 'itens' do JSON da nota), gravados em `itens_nota`
+CAMPOS_ITEM_TEXTO = ['descricao', 'codigo_ncm', 'cfop', 'unidade']
+CAMPOS_ITEM_VALOR = ['quantidade', 'valor_unitario', 'valor_total', 'valor_desconto', 'valor_icms', 'valor_ipi',
+                     'valor_icms_st', 'valor_issqn']
+COLUNAS_ITEM = CAMPOS_ITEM_TEXTO + CAMPOS_ITEM_VALOR
+
+
+# --- CONEXÕES ---
+def conectar_banco():
+    """Abre uma conexão nova já configurada. Prefira `conexao()`, que reaproveita conexões."""
+    conn = sqlite3.connect(CAMINHO_BANCO, timeout=TIMEOUT_BLOQUEIO, check_same_thread=False)
+    # Em WAL, NORMAL só sincroniza no checkpoint: seguro contra corrupção e bem mais rápido
+    conn.execute("PRAGMA synchronous = NORMAL")
+    return conn
+
+_livres = queue.LifoQueue()
+
+@contextmanager
+def conexao():
+    """Empresta uma conexão do pool: commit ao sair do bloco, rollback se houver exceção.
+
+    Cada conexão é usada por uma thread de cada vez, então pode circular entre as threads
+    do Streamlit, do lote de extração e da sincronização.
+    """
+    try:
+        conn = _livres.get_nowait()
+    except queue.Empty:
+        conn = conectar_banco()
+    try:
+        yield conn
+        conn.commit()
+    except BaseException:
+        conn.rollback()
+        raise
+    finally:
+        if _livres.qsize() < MAX_CONEXOES_LIVRES: _livres.put(conn)
+        else: conn.close()
+
+
+# --- MIGRAÇÕES ---
+def _migracao_1(c):
+    """Esquema inicial: notas, cache de extração e fila do Google Sheets."""
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS notas_fiscais (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            data_upload TIMESTAMP,
+            arquivo_origem TEXT,
+            numero_nota TEXT,
+            data_emissao TEXT,
+            emissor_nome TEXT,
+            emissor_cnpj TEXT,
+            tomador_nome TEXT,
+            tomador_cnpj TEXT,
+            descricao_item TEXT,
+            codigo_ncm TEXT,
+            valor_bruto REAL,
+            valor_liquido REAL,
+            valor_icms REAL,
+            valor_ipi REAL,
+            valor_icms_st REAL,
+            valor_issqn REAL,
+            retencao_issqn REAL,
+            valor_desconto REAL,
+            json_completo TEXT
+        )
+    ''')
+    # Cache de extração: hash do PDF + versão (modelo/prompts) -> JSON já interpretado
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS cache_extracao (
+            hash_pdf TEXT NOT NULL,
+            versao TEXT NOT NULL,
+            json_resultado TEXT NOT NULL,
+            criado_em REAL NOT NULL,
+            ultimo_acesso REAL NOT NULL,
+            PRIMARY KEY (hash_pdf, versao)
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_cache_ultimo_acesso ON cache_extracao (ultimo_acesso)")
+    # Outbox do Google Sheets: os triggers marcam a nota como pendente na mesma transação da gravação.
+    # `revisao` muda a cada alteração da nota, para um envio em andamento não apagar uma pendência nova.
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS fila_nuvem (
+            id_nota INTEGER PRIMARY KEY,
+            pendente INTEGER NOT NULL DEFAULT 1,
+            revisao INTEGER NOT NULL DEFAULT 1,
+            linha_planilha INTEGER,
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            ultimo_erro TEXT,
+            enviado_em REAL
+        )
+    ''')
+    c.execute("CREATE INDEX IF NOT EXISTS idx_fila_nuvem_pendente ON fila_nuvem (pendente, id_nota)")
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_fila_nuvem_insercao AFTER INSERT ON notas_fiscais
+        BEGIN
+            INSERT OR IGNORE INTO fila_nuvem (id_nota) VALUES (NEW.id);
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_fila_nuvem_alteracao AFTER UPDATE ON notas_fiscais
+        BEGIN
+            UPDATE fila_nuvem SET pendente = 1, revisao = revisao + 1 WHERE id_nota = NEW.id;
+        END
+    ''')
+    c.execute('''
+        CREATE TRIGGER IF NOT EXISTS trg_fila_nuvem_exclusao AFTER DELETE ON notas_fiscais
+        BEGIN
+            DELETE FROM fila_nuvem WHERE id_nota = OLD.id;
+        END
+    ''')
+
+def _migracao_2(c):
+    """Índices de consulta e chave única (emissor + número) para reimportações virarem upsert."""
+    # A fila só volta a pendente quando muda um campo que vai para a planilha
+    c.execute("DROP TRIGGER IF EXISTS trg_fila_nuvem_alteracao")
+    c.execute(f'''
+        CREATE TRIGGER trg_fila_nuvem_alteracao AFTER UPDATE OF {", ".join(COLUNAS_NOTA)} ON notas_fiscais
+        BEGIN
+            UPDATE fila_nuvem SET pendente = 1, revisao = revisao + 1 WHERE id_nota = NEW.id;
+        END
+    ''')
+    c.execute("ALTER TABLE notas_fiscais ADD COLUMN chave_nota TEXT")
+    c.connection.create_function("chave_nota", 2, chave_nota, deterministic=True)
+    c.execute("UPDATE notas_fiscais SET chave_nota = chave_nota(emissor_cnpj, numero_nota)")
+    # Duplicatas já gravadas: fica a versão mais recente de cada nota
+    c.execute('''
+        DELETE FROM notas_fiscais WHERE chave_nota IS NOT NULL AND id NOT IN (
+            SELECT MAX(id) FROM notas_fiscais WHERE chave_nota IS NOT NULL GROUP BY chave_nota
+        )
+    ''')
+    c.execute("CREATE UNIQUE INDEX idx_notas_chave ON notas_fiscais (chave_nota) WHERE chave_nota IS NOT NULL")
+    c.execute("CREATE INDEX idx_notas_emissor_cnpj ON notas_fiscais (emissor_cnpj)")
+    c.execute("CREATE INDEX idx_notas_data_emissao ON notas_fiscais (data_emissao)")
+    c.execute("CREATE INDEX idx_notas_data_upload ON notas_fiscais (data_upload)")
+
+def _migracao_3(c):
+    """Contador de versão dos dados (invalida os caches de leitura) e índice do ranking de fornecedores."""
+    c.execute("CREATE TABLE versao_dados (id INTEGER PRIMARY KEY CHECK (id = 1), versao INTEGER NOT NULL)")
+    c.execute("INSERT INTO versao_dados VALUES (1, 0)")
+    for evento in ('INSERT', 'UPDATE', 'DELETE'):
+        c.execute(f'''
+            CREATE TRIGGER trg_versao_dados_{evento.lower()} AFTER {evento} ON notas_fiscais
+            BEGIN
+                UPDATE versao_dados SET versao = versao + 1 WHERE id = 1;
+            END
+        ''')
+    c.execute("CREATE INDEX idx_notas_emissor_nome ON notas_fiscais (emissor_nome, valor_bruto)")
+
+def _migracao_4(c):
+    """Data de emissão em AAAA-MM-DD (coluna gerada), para filtrar e ordenar por período."""
+    c.execute('''
+        ALTER TABLE notas_fiscais ADD COLUMN data_emissao_iso TEXT GENERATED ALWAYS AS (
+            CASE
+                WHEN data_emissao GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]*'
+                    THEN substr(data_emissao, 7, 4) || '-' || substr(data_emissao, 4, 2) || '-' || substr(data_emissao, 1, 2)
+                WHEN data_emissao GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*'
+                    THEN substr(data_emissao, 1, 10)
+            END
+        ) VIRTUAL
+    ''')
+    c.execute("CREATE INDEX idx_notas_data_emissao_iso ON notas_fiscais (data_emissao_iso)")
+
+def _migracao_5(c):
+    """Marca da última exportação de cada formato (modo incremental da exportacao.py)."""
+    c.execute('''
+        CREATE TABLE exportacoes (
+            formato TEXT PRIMARY KEY,
+            ultimo_data_upload TEXT NOT NULL,
+            exportado_em REAL NOT NULL
+        )
+    ''')
+
+def _migracao_6(c):
+    """Respostas do CFO Virtual guardadas pela impressão digital do resumo enviado."""
+    c.execute('''
+        CREATE TABLE cache_analise (
+            impressao TEXT PRIMARY KEY,
+            resultado TEXT NOT NULL,
+            criado_em REAL NOT NULL
+        )
+    ''')
+
+def _migracao_7(c):
+    """Fila de reextração: notas reprovadas na validação, com o PDF para pedir de novo só os campos errados."""
+    c.execute('''
+        CREATE TABLE fila_reextracao (
+            hash_pdf TEXT PRIMARY KEY,
+            arquivo TEXT NOT NULL,
+            conteudo BLOB NOT NULL,
+            dados TEXT NOT NULL,
+            erros TEXT NOT NULL,
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            atualizado_em REAL NOT NULL
+        )
+    ''')
+
+def _migracao_8(c):
+    """Fila de extração consumida pelo worker.py: um lote por envio, uma tarefa por PDF."""
+    c.execute('''
+        CREATE TABLE lotes_extracao (
+            id INTEGER PRIMARY KEY,
+            descricao TEXT,
+            opcoes TEXT NOT NULL,
+            criado_em REAL NOT NULL
+        )
+    ''')
+    # conteudo é apagado quando a tarefa conclui; status: pendente, executando, concluida, falhou
+    c.execute('''
+        CREATE TABLE tarefas_extracao (
+            id INTEGER PRIMARY KEY,
+            lote_id INTEGER NOT NULL REFERENCES lotes_extracao(id),
+            arquivo TEXT NOT NULL,
+            conteudo BLOB,
+            status TEXT NOT NULL DEFAULT 'pendente',
+            tentativas INTEGER NOT NULL DEFAULT 0,
+            trabalhador TEXT,
+            origem TEXT,
+            tokens_antes INTEGER,
+            tokens_depois INTEGER,
+            erro TEXT,
+            iniciada_em REAL,
+            concluida_em REAL
+        )
+    ''')
+    c.execute("CREATE INDEX idx_tarefas_status ON tarefas_extracao(status, id)")
+    c.execute("CREATE INDEX idx_tarefas_lote ON tarefas_extracao(lote_id, status)")
+    c.execute('''
+        CREATE TABLE trabalhadores (
+            nome TEXT PRIMARY KEY,
+            pid INTEGER,
+            visto_em REAL NOT NULL
+        )
+    ''')
+
+def _migracao_9(c):
+    """Métricas por etapa do pipeline (metricas.py): tempo, tokens, tentativas e falhas de cada nota."""
+    c.execute('''
+        CREATE TABLE metricas_etapas (
+            id INTEGER PRIMARY KEY,
+            registrado_em REAL NOT NULL,
+            etapa TEXT NOT NULL,
+            arquivo TEXT,
+            origem TEXT,
+            modelo TEXT,
+            duracao REAL NOT NULL,
+            notas INTEGER NOT NULL DEFAULT 1,
+            tokens_prompt INTEGER NOT NULL DEFAULT 0,
+            tokens_resposta INTEGER NOT NULL DEFAULT 0,
+            tentativas INTEGER NOT NULL DEFAULT 1,
+            sucesso INTEGER NOT NULL,
+            erro TEXT
+        )
+    ''')
+    c.execute("CREATE INDEX idx_metricas_tempo ON metricas_etapas(registrado_em)")
+
+def _migracao_10(c):
+    """Troca json_completo (cópia em texto de todas as colunas) por `extras`: só os campos sem coluna, compactados."""
+    c.execute("ALTER TABLE notas_fiscais ADD COLUMN extras BLOB")
+    c.connection.create_function("extras_json", 1, _extras_json, deterministic=True)
+    c.execute("UPDATE notas_fiscais SET extras = extras_json(json_completo) WHERE json_completo IS NOT NULL")
+    c.execute("ALTER TABLE notas_fiscais DROP COLUMN json_completo")
+    return True
+
+def _migracao_11(c):
+    """Itens de cada nota (NCM, quantidade, valor unitário e impostos por item), para o gasto por item."""
+    # Sem rowid: os itens ficam agrupados pela nota na própria chave primária
+    c.execute('''
+        CREATE TABLE itens_nota (
+            id_nota INTEGER NOT NULL REFERENCES notas_fiscais(id),
+            numero_item INTEGER NOT NULL,
+            descricao TEXT,
+            codigo_ncm TEXT,
+            cfop TEXT,
+            unidade TEXT,
+            quantidade REAL,
+            valor_unitario REAL,
+            valor_total REAL,
+            valor_desconto REAL,
+            valor_icms REAL,
+            valor_ipi REAL,
+            valor_icms_st REAL,
+            valor_issqn REAL,
+            PRIMARY KEY (id_nota, numero_item)
+        ) WITHOUT ROWID
+    ''')
+    # Gasto por NCM sai só do índice; por fornecedor, idx_notas_emissor_cnpj leva às notas e a chave primária aos itens
+    c.execute("CREATE INDEX idx_itens_ncm ON itens_nota (codigo_ncm, valor_total)")
+    c.execute('''
+        CREATE TRIGGER trg_itens_exclusao AFTER DELETE ON notas_fiscais
+        BEGIN
+            DELETE FROM itens_nota WHERE id_nota = OLD.id;
+        END
+    ''')
+
+# Posição na lista = número da versão (a 1ª migração leva o banco à versão 1). Só acrescentar no fim.
+MIGRACOES = [_migracao_1, _migracao_2, _migracao_3, _migracao_4, _migracao_5, _migracao_6, _migracao_7,
+             _migracao_8, _migracao_9, _migracao_10, _migracao_11]
+
+def inicializar_banco():
+    """Liga o WAL e aplica, cada uma na sua transação, as migrações que o banco ainda não tem.
+
+    Uma migração que libera muito espaço devolve True, e o VACUUM (fora de transação) encolhe o arquivo.
+    """
+    with conexao() as conn:
+        conn.execute("PRAGMA journal_mode = WAL")
+        versao = conn.execute("PRAGMA user_version").fetchone()[0]
+    compactar = False
+    for numero, migracao in enumerate(MIGRACOES[versao:], start=versao + 1):
+        with conexao() as conn:
+            # BEGIN IMMEDIATE: duas sessões abrindo ao mesmo tempo não aplicam a mesma migração
+            conn.execute("BEGIN IMMEDIATE")
+            if conn.execute("PRAGMA user_version").fetchone()[0] >= numero: continue
+            compactar |= bool(migracao(conn.cursor()))
+            conn.execute(f"PRAGMA user_version = {numero}")
+    if compactar:
+        with conexao() as conn:
+            conn.execute("VACUUM")
+
+
+# --- GRAVAÇÃO ---
+def chave_nota(emissor_cnpj, numero_nota):
+    """Chave de deduplicação: documento do emissor só com dígitos + número sem zeros à esquerda.
+
+    None quando falta um dos dois (a nota é gravada sem deduplicar).
+    """
+    if isinstance(numero_nota, float):
+        numero_nota = int(numero_nota) if numero_nota.is_integer() else None
+    documento = re.sub(r'\D', '', str(emissor_cnpj or ''))
+    numero = re.sub(r'\D', '', str(numero_nota or '')).lstrip('0')
+    return f"{documento}-{numero}" if documento and numero else None
+
+_COLUNAS_GRAVADAS = COLUNAS_NOTA + ['extras', 'chave_nota']
+# O id vai no INSERT (reservado em salvar_notas) mas não no UPDATE: nota que já existe mantém o seu
+SQL_UPSERT_NOTA = f'''
+    INSERT INTO notas_fiscais (id, {", ".join(_COLUNAS_GRAVADAS)})
+    VALUES (:id, {", ".join(":" + c for c in _COLUNAS_GRAVADAS)})
+    ON CONFLICT (chave_nota) WHERE chave_nota IS NOT NULL DO UPDATE SET
+        {", ".join(f"{c} = excluded.{c}" for c in _COLUNAS_GRAVADAS if c != 'chave_nota')}
+'''
+
+# Nota do item: a que já existia com a mesma chave ou, se é nova, o id reservado
+_ID_NOTA = "COALESCE((SELECT id FROM notas_fiscais WHERE chave_nota = :chave_nota), :id_nota)"
+SQL_LIMPAR_ITENS = f"DELETE FROM itens_nota WHERE id_nota = {_ID_NOTA}"
+SQL_INSERIR_ITEM = f'''
+    INSERT INTO itens_nota (id_nota, numero_item, {", ".join(COLUNAS_ITEM)})
+    VALUES ({_ID_NOTA}, :numero_item, {", ".join(":" + c for c in COLUNAS_ITEM)})
+'''
+
+def _extras_json(texto):
+    """Extras de um json_completo antigo (migração 10): os campos que não têm coluna, sem os nulos."""
+    extras = {k: v for k, v in json.loads(texto).items() if k not in _COLUNAS_GRAVADAS and v is not None}
+    return zlib.compress(json.dumps(extras, ensure_ascii=False).encode()) if extras else None
+
+def _extras(df):
+    """Campos das notas que não têm coluna própria, em JSON compactado (zlib); None onde não há nenhum."""
+    extras = pd.Series(None, index=df.index, dtype=object)
+    outras = [c for c in df.columns if c not in _COLUNAS_GRAVADAS and c != 'itens']
+    presentes = df[outras].notna().any(axis=1) if outras else extras.notna()
+    if presentes.any():
+        # Um to_json para o bloco inteiro (uma linha JSON por nota) em vez de serializar nota a nota
+        linhas = df.loc[presentes, outras].to_json(orient='records', lines=True, force_ascii=False, date_format='iso')
+        extras[presentes] = [zlib.compress(l.encode()) for l in linhas.rstrip('\n').split('\n')]
+    return extras
+
+def _itens(df):
+    """Linhas de `itens_nota`: uma por item da lista 'itens' de cada nota (da última, se a nota se repete no bloco)."""
+    if 'itens' not in df.columns: return pd.DataFrame()
+    notas = df[~df.duplicated('chave_nota', keep='last') | df['chave_nota'].isna()]
+    itens = notas[['id', 'chave_nota', 'itens']].reset_index(drop=True).explode('itens')
+    itens = itens[[isinstance(item, dict) for item in itens['itens']]]
+    if itens.empty: return itens
+
+    linhas = pd.DataFrame(itens['itens'].tolist()).reindex(columns=COLUNAS_ITEM)
+    linhas[CAMPOS_ITEM_VALOR] = linhas[CAMPOS_ITEM_VALOR].apply(pd.to_numeric, errors='coerce')
+    linhas['codigo_ncm'] = linhas['codigo_ncm'].astype('string').str.replace(r'\D', '', regex=True).replace('', pd.NA)
+    linhas['id_nota'] = itens['id'].to_numpy()
+    linhas['chave_nota'] = itens['chave_nota'].to_numpy()
+    linhas['numero_item'] = itens.groupby(level=0).cumcount().to_numpy() + 1
+    return linhas.astype(object).where(linhas.notna(), None)
+
+def ler_extras(blob):
+    """Campos extras gravados em `notas_fiscais.extras` (dict vazio se não houver)."""
+    return json.loads(zlib.decompress(blob)) if blob else {}
+
+def salvar_notas(df_novo):
+    """Grava as notas em `notas_fiscais` (e, pelos triggers, na fila do Google Sheets) e os itens em `itens_nota`.
+
+    Uma nota que já existe (mesmo emissor e número) é atualizada no lugar, sem duplicar; se vier com
+    itens, eles substituem os anteriores. Notas e itens entram na mesma transação, um executemany cada.
+    """
+    if df_novo.empty: return
+    df_novo['data_upload'] = datetime.now()
+
+    for col in COLUNAS_NOTA:
+        if col not in df_novo.columns: df_novo[col] = None
+
+    # Prepara dataframe para salvar (converte data para string)
+    df_salvar = df_novo.copy()
+    df_salvar['extras'] = _extras(df_novo)
+    df_salvar['data_upload'] = df_salvar['data_upload'].astype(str)
+    df_salvar['chave_nota'] = [chave_nota(c, n) for c, n in zip(df_salvar['emissor_cnpj'], df_salvar['numero_nota'])]
+
+    with conexao() as conn:
+        # Ids reservados sob a trava de escrita: cada item sabe a que nota pertence sem reler as notas gravadas
+        conn.execute("BEGIN IMMEDIATE")
+        ultimo = conn.execute("SELECT seq FROM sqlite_sequence WHERE name = 'notas_fiscais'").fetchone()
+        inicio = (ultimo[0] if ultimo else 0) + 1
+        df_salvar['id'] = range(inicio, inicio + len(df_salvar))
+        conn.executemany(SQL_UPSERT_NOTA, df_salvar[['id'] + _COLUNAS_GRAVADAS].to_dict('records'))
+
+        itens = _itens(df_salvar)
+        if not itens.empty:
+            notas = itens[['id_nota', 'chave_nota']].drop_duplicates('id_nota')
+            conn.executemany(SQL_LIMPAR_ITENS, notas.to_dict('records'))
+            conn.executemany(SQL_INSERIR_ITEM, itens.to_dict('records'))
@@ -0,0 +1,555 @@
+"""Benchmark offline do pipeline: corpus sintético com gabarito e LLM local, sem rede nem chave da OpenAI.
+
+Gera PDFs de DANFE e NFS-e (reportlab) com valores conhecidos (algumas DANFEs com centenas de
+itens em várias folhas, totais na primeira, e algumas com a tabela de produtos que o leitor por
+regras não lê), mais uma fração em layout livre que o leitor por regras não reconhece; essas
+DANFEs e o layout livre vão ao LLM. A Crew e o cliente OpenAI de
+extracao.py são trocados por um substituto local que responde com o gabarito depois de uma
+latência configurável (e erra o CNPJ de uma fração das notas, para exercitar a validação e a
+fila de reextração). O resto roda como em produção: fila, worker, leitura dos PDFs no pool de
+processos, validação, gravação no SQLite, reextração, agregados do Dashboard e exportações.
+
+Cada tamanho roda num processo novo, em pasta temporária com banco vazio, para o pico de
+memória e o cache de extração não vazarem de uma rodada para a outra. Os tempos por etapa
+vêm da instrumentação de metricas.py.
+
+Uso:
+    python benchmark.py [--notas 100 10000 100000] [--latencia 0.3] [--fracao-llm 0.1] [--json resultado.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import types
+import zlib
+from datetime import date, timedelta
+from types import SimpleNamespace
+
+import pandas as pd
+from reportlab.pdfgen import canvas
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+import analise
+import consultas
+import exportacao
+import extracao
+import fila
+import leitura_pdf
+import metricas
+import validacao
+import worker
+from banco import CAMPOS_RETENCAO, CAMPOS_TEXTO, CAMPOS_VALOR, conexao, inicializar_banco
+from compactacao import contar_tokens
+from extracao import MAX_CONCORRENCIA, MODO_CREW, MODOS_EXTRACAO
+
+TAMANHOS_PADRAO = [100, 10_000, 100_000]
+
+# LLM local: latência média (s) por chamada, variação (± fração da média) e fração de respostas erradas
+LATENCIA_LLM = 0.3
+VARIACAO_LATENCIA = 0.5
+TAXA_ERRO_LLM = 0.02
+# Fração do corpus em layout livre (vai ao LLM); o restante é DANFE/NFS-e que o leitor por regras resolve
+FRACAO_LLM = 0.1
+# Um a cada DANFE_LONGA_A_CADA DANFEs (a começar pelo primeiro) tem ITENS_DANFE_LONGA itens, em várias folhas
+DANFE_LONGA_A_CADA = 20
+ITENS_DANFE_LONGA = 200
+# Um a cada DANFE_QUEBRADA_A_CADA DANFEs tem cada item em duas linhas (descrição, depois NCM e valores), que a
+# regex de itens não lê: sem itens a confiança do leitor por regras tem de cair e a nota ir ao LLM
+DANFE_QUEBRADA_A_CADA = 10
+# Sem cota de API por padrão: o benchmark mede o pipeline, não o limite da conta
+LIMITE_SEM_COTA = 10**9
+
+FORNECEDORES = 300
+TOMADORES = 20
+SEMENTE = 42
+
+# Números das notas do corpus: 9 dígitos, únicos, para o LLM local achar o gabarito no texto
+NUMERO_INICIAL = 700_000_000
+RE_NUMERO_CORPUS = re.compile(r'(?<!\d)7\d{8}(?!\d)')
+
+ATIVIDADES = ['Comercial', 'Distribuidora', 'Indústria', 'Serviços', 'Tecnologia', 'Transportes',
+              'Construtora', 'Metalúrgica', 'Papelaria', 'Consultoria', 'Alimentos', 'Logística']
+SOBRENOMES = ['Silva', 'Souza', 'Oliveira', 'Pereira', 'Almeida', 'Costa', 'Ribeiro', 'Carvalho',
+              'Gomes', 'Martins', 'Araújo', 'Barbosa', 'Rocha', 'Lima', 'Teixeira', 'Moreira']
+SUFIXOS = ['Ltda', 'S.A.', 'ME', 'EIRELI']
+PRODUTOS = [('Parafuso sextavado aço inox', '73181500'), ('Cabo de cobre flexível 2,5mm', '85444900'),
+            ('Papel sulfite A4 75g', '48025610'), ('Óleo lubrificante industrial', '27101932'),
+            ('Luva de segurança nitrílica', '40151900'), ('Tinta acrílica fosca 18L', '32091010')]
+SERVICOS = ['Consultoria em gestão empresarial', 'Manutenção preventiva de equipamentos',
+            'Desenvolvimento de software sob encomenda', 'Serviço de limpeza e conservação',
+            'Transporte municipal de cargas', 'Treinamento de equipe']
+
+
+# --- CORPUS SINTÉTICO ---
+def _cnpj(rng):
+    digitos = [rng.randrange(10) for _ in range(8)] + [0, 0, 0, 1]
+    for pesos in (validacao.PESOS_CNPJ[1:], validacao.PESOS_CNPJ):
+        resto = sum(d * p for d, p in zip(digitos, pesos)) % 11
+        digitos.append(0 if resto < 2 else 11 - resto)
+    d = "".join(map(str, digitos))
+    return f"{d[:2]}.{d[2:5]}.{d[5:8]}/{d[8:12]}-{d[12:]}"
+
+def _empresas(rng, quantidade):
+    return [(f"{rng.choice(ATIVIDADES)} {rng.choice(SOBRENOMES)} {rng.choice(SOBRENOMES)} {rng.choice(SUFIXOS)}",
+             _cnpj(rng)) for _ in range(quantidade)]
+
+def _moeda(valor, casas=2):
+    return f"{valor:,.{casas}f}".replace(',', '_').replace('.', ',').replace('_', '.')
+
+def gerar_gabarito(quantidade, fracao_llm=FRACAO_LLM, semente=SEMENTE):
+    """Gera (layout, nota) para `quantidade` notas; `nota` tem os campos de banco.CAMPOS_TEXTO/CAMPOS_VALOR
+    e a lista 'itens' (um item por nota, o serviço nas NFS-e e no layout livre, ou ITENS_DANFE_LONGA nas
+    DANFEs longas)."""
+    rng = random.Random(semente)
+    fornecedores, tomadores = _empresas(rng, FORNECEDORES), _empresas(rng, TOMADORES)
+    hoje = date.today()
+    danfes = 0
+    for i in range(quantidade):
+        layout = 'livre' if rng.random() < fracao_llm else rng.choice(['danfe', 'nfse'])
+        servico = layout != 'danfe'
+        (emissor, emissor_cnpj), (tomador, tomador_cnpj) = rng.choice(fornecedores), rng.choice(tomadores)
+        bruto = round(rng.lognormvariate(7, 1), 2)
+        nota = {c: "" for c in CAMPOS_TEXTO}
+        nota.update({c: 0.0 for c in CAMPOS_VALOR})
+        nota.update(numero_nota=str(NUMERO_INICIAL + i), emissor_nome=emissor, emissor_cnpj=emissor_cnpj,
+                    tomador_nome=tomador, tomador_cnpj=tomador_cnpj, valor_bruto=bruto,
+                    data_emissao=(hoje - timedelta(days=rng.randint(1, 720))).strftime('%d/%m/%Y'))
+        if servico:
+            nota['descricao_item'] = rng.choice(SERVICOS)
+            nota['valor_issqn'] = round(bruto * rng.choice([0.02, 0.03, 0.05]), 2)
+            if layout == 'nfse' and rng.random() < 0.3: nota['retencao_issqn'] = nota['valor_issqn']
+            nota['itens'] = [{
+                'descricao': nota['descricao_item'], 'codigo_ncm': "", 'cfop': "", 'unidade': "",
+                'quantidade': 1.0, 'valor_unitario': bruto, 'valor_total': bruto, 'valor_desconto': 0.0,
+                'valor_icms': 0.0, 'valor_ipi': 0.0, 'valor_icms_st': 0.0, 'valor_issqn': nota['valor_issqn'],
+            }]
+        else:
+            nota['descricao_item'], nota['codigo_ncm'] = rng.choice(PRODUTOS)
+            nota['valor_desconto'] = round(bruto * rng.choice([0, 0, 0.02, 0.05]), 2)
+            nota['valor_icms'] = round(bruto * 0.18, 2)
+            nota['valor_ipi'] = round(bruto * rng.choice([0, 0.05, 0.10]), 2)
+            # Quantidade derivada do índice (não do rng), para não mudar o resto do corpus
+            unidades = 1 + i % 12
+            nota['itens'] = [{
+                'descricao': nota['descricao_item'], 'codigo_ncm': nota['codigo_ncm'], 'cfop': '5102', 'unidade': 'UN',
+                'quantidade': float(unidades), 'valor_unitario': round(bruto / unidades, 4), 'valor_total': bruto,
+                'valor_desconto': nota['valor_desconto'], 'valor_icms': nota['valor_icms'], 'valor_ipi': nota['valor_ipi'],
+                'valor_icms_st': 0.0, 'valor_issqn': 0.0,
+            }]
+            danfes += layout == 'danfe'
+            if layout == 'danfe' and danfes % DANFE_LONGA_A_CADA == 1:
+                nota['itens'] = _itens_danfe_longa(i, nota)
+                nota['descricao_item'], nota['codigo_ncm'] = nota['itens'][0]['descricao'], nota['itens'][0]['codigo_ncm']
+            elif layout == 'danfe' and danfes % DANFE_QUEBRADA_A_CADA == 0:
+                layout = 'danfe_quebrada'
+        nota['valor_liquido'] = round(bruto - nota['valor_desconto'] - nota['retencao_issqn'] + nota['valor_ipi'], 2)
+        yield layout, nota
+
+def _itens_danfe_longa(i, nota):
+    """ITENS_DANFE_LONGA itens que somam o bruto da nota, com produtos e quantidades derivados do índice."""
+    bruto = nota['valor_bruto']
+    pesos = [1 + k % 7 for k in range(ITENS_DANFE_LONGA)]
+    totais = [round(bruto * p / sum(pesos), 2) for p in pesos[:-1]]
+    totais.append(round(bruto - sum(totais), 2))
+    itens = []
+    for k, total in enumerate(totais):
+        descricao, ncm = PRODUTOS[(i + k) % len(PRODUTOS)]
+        unidades = 1 + (i + k) % 12
+        itens.append({
+            'descricao': descricao, 'codigo_ncm': ncm, 'cfop': '5102', 'unidade': 'UN',
+            'quantidade': float(unidades), 'valor_unitario': round(total / unidades, 4), 'valor_total': total,
+            'valor_desconto': 0.0, 'valor_icms': round(nota['valor_icms'] * total / bruto, 2),
+            'valor_ipi': round(nota['valor_ipi'] * total / bruto, 2), 'valor_icms_st': 0.0, 'valor_issqn': 0.0,
+        })
+    return itens
+
+def _linhas_danfe(nota, quebrada=False):
+    cnpj = re.sub(r'\D', '', nota['emissor_cnpj'])
+    chave = f"35{nota['data_emissao'][8:10]}{nota['data_emissao'][3:5]}{cnpj}55001{nota['numero_nota']}1{12345678:08d}0"
+    return [
+        f"RECEBEMOS DE {nota['emissor_nome']} OS PRODUTOS CONSTANTES DA NOTA FISCAL INDICADA AO LADO",
+        "DANFE - DOCUMENTO AUXILIAR DA NOTA FISCAL ELETRÔNICA",
+        f"Nº {nota['numero_nota']}  SÉRIE 001",
+        "CHAVE DE ACESSO",
+        " ".join(chave[i:i + 4] for i in range(0, 44, 4)),
+        f"NOME / RAZÃO SOCIAL: {nota['emissor_nome']}",
+        f"CNPJ: {nota['emissor_cnpj']}",
+        f"DATA DE EMISSÃO: {nota['data_emissao']}",
+        "DESTINATÁRIO / REMETENTE",
+        f"NOME / RAZÃO SOCIAL: {nota['tomador_nome']}",
+        f"CNPJ: {nota['tomador_cnpj']}",
+        "DESCRIÇÃO DO PRODUTO",
+        nota['descricao_item'],
+        f"NCM: {nota['codigo_ncm'][:4]}.{nota['codigo_ncm'][4:6]}.{nota['codigo_ncm'][6:]}",
+        # Como no DANFE real, o quadro de totais vem antes da tabela de produtos (que pode seguir por outras folhas)
+        "CÁLCULO DO IMPOSTO",
+        f"VALOR DO ICMS: {_moeda(nota['valor_icms'])}",
+        f"VALOR DO IPI: {_moeda(nota['valor_ipi'])}",
+        f"VALOR DO DESCONTO: {_moeda(nota['valor_desconto'])}",
+        f"VALOR TOTAL DOS PRODUTOS: {_moeda(nota['valor_bruto'])}",
+        f"VALOR TOTAL DA NOTA: {_moeda(nota['valor_liquido'])}",
+        "DADOS DOS PRODUTOS / SERVIÇOS",
+        "CÓDIGO DESCRIÇÃO NCM/SH CST CFOP UN QUANT V.UNIT V.TOTAL BC.ICMS V.ICMS V.IPI ALÍQ.ICMS ALÍQ.IPI",
+        *(linha for n, item in enumerate(nota['itens'], start=1) for linha in _linhas_item_danfe(n, item, quebrada)),
+    ]
+
+def _linhas_item_danfe(n, item, quebrada):
+    descricao = f"{n:03d} {item['descricao']}"
+    colunas = (f"{item['codigo_ncm']} 000 {item['cfop']} {item['unidade']} "
+               f"{_moeda(item['quantidade'], 4)} {_moeda(item['valor_unitario'], 4)} {_moeda(item['valor_total'])} "
+               f"{_moeda(item['valor_total'])} {_moeda(item['valor_icms'])} {_moeda(item['valor_ipi'])} 18,00 0,00")
+    return [descricao, colunas] if quebrada else [f"{descricao} {colunas}"]
+
+def _linhas_nfse(nota):
+    return [
+        "NOTA FISCAL DE SERVIÇOS ELETRÔNICA - NFS-e",
+        f"Número da Nota: {nota['numero_nota']}",
+        f"Data de Emissão: {nota['data_emissao']}",
+        "PRESTADOR DE SERVIÇOS",
+        f"Razão Social: {nota['emissor_nome']}",
+        f"CNPJ: {nota['emissor_cnpj']}",
+        "TOMADOR DE SERVIÇOS",
+        f"Razão Social: {nota['tomador_nome']}",
+        f"CNPJ: {nota['tomador_cnpj']}",
+        "DISCRIMINAÇÃO DOS SERVIÇOS",
+        nota['descricao_item'],
+        f"VALOR DOS SERVIÇOS: {_moeda(nota['valor_bruto'])}",
+        f"VALOR DO ISS: {_moeda(nota['valor_issqn'])}",
+        f"ISS RETIDO: {_moeda(nota['retencao_issqn'])}",
+        f"VALOR LÍQUIDO DA NOTA: {_moeda(nota['valor_liquido'])}",
+    ]
+
+def _linhas_livre(nota):
+    # Sem rótulos de DANFE/NFS-e nem quadro de valores: a confiança do leitor por regras fica baixa
+    return [
+        "RECIBO DE PRESTAÇÃO DE SERVIÇOS",
+        f"Recibo {nota['numero_nota']} emitido por {nota['emissor_nome']} em {nota['data_emissao']}",
+        f"Documento do emitente {nota['emissor_cnpj']}",
+        f"Cliente {nota['tomador_nome']} ({nota['tomador_cnpj']})",
+        f"Referente a {nota['descricao_item']}",
+        f"Imposto municipal incluso R$ {_moeda(nota['valor_issqn'])}",
+        f"Recebemos a importância de R$ {_moeda(nota['valor_liquido'])}",
+    ]
+
+LAYOUTS = {'danfe': _linhas_danfe, 'danfe_quebrada': lambda nota: _linhas_danfe(nota, quebrada=True),
+           'nfse': _linhas_nfse, 'livre': _linhas_livre}
+# Layouts que o leitor por regras não resolve: o LLM local precisa do gabarito dessas notas
+LAYOUTS_LLM = ('livre', 'danfe_quebrada')
+
+def gerar_pdf(layout, nota):
+    buffer = io.BytesIO()
+    c = canvas.Canvas(buffer)
+    y = 800
+    for linha in LAYOUTS[layout](nota):
+        if y < 40:
+            c.showPage()
+            y = 800
+        c.drawString(40, y, linha)
+        y -= 18
+    c.save()
+    return buffer.getvalue()
+
+
+# --- LLM LOCAL ---
+class RespostaCrew:
+    def __init__(self, texto, prompt, resposta):
+        self.texto = texto
+        self.token_usage = SimpleNamespace(prompt_tokens=prompt, completion_tokens=resposta)
+
+    def __str__(self):
+        return self.texto
+
+
+class ContadorTokens:
+    """Como o TokenProcess do crewai: um por agente, só soma (nunca volta a zero)."""
+
+    def __init__(self):
+        self.prompt_tokens = self.completion_tokens = 0
+
+    def get_summary(self):
+        return SimpleNamespace(prompt_tokens=self.prompt_tokens, completion_tokens=self.completion_tokens)
+
+
+class AgenteLocal(SimpleNamespace):
+    def __init__(self, **campos):
+        super().__init__(**campos)
+        self._token_process = ContadorTokens()
+
+
+class CrewLocal:
+    """Crew local: uma chamada por tarefa, com os callbacks que extracao.py usa para cronometrar.
+
+    Os tokens vão para o contador do agente de cada tarefa e o `token_usage` devolvido é a soma dos
+    contadores, como no crewai: com agentes reaproveitados ele cresce a cada nota.
+    """
+
+    def __init__(self, llm, agents, tasks):
+        self.llm = llm
+        self.agents = agents
+        self.tasks = tasks
+
+    def kickoff(self):
+        conteudo = self.llm.responder(self.tasks[0].description)
+        for tarefa in self.tasks:
+            self.llm.esperar()
+            contador = tarefa.agent._token_process
+            contador.prompt_tokens += contar_tokens(tarefa.description)
+            contador.completion_tokens += contar_tokens(conteudo)
+            if tarefa.callback: tarefa.callback(conteudo)
+        resumos = [agente._token_process.get_summary() for agente in self.agents]
+        return RespostaCrew(conteudo, sum(r.prompt_tokens for r in resumos), sum(r.completion_tokens for r in resumos))
+
+
+class LLMLocal:
+    """Substitui a Crew e o cliente OpenAI de extracao.py, respondendo com o gabarito.
+
+    `gabarito` é {numero_nota: JSON da nota}. Cada chamada dorme a latência configurada e conta
+    tokens como a API contaria. Na primeira extração, uma fração `taxa_erro` das notas (sorteada
+    pelo número, então estável entre execuções) volta com o dígito verificador do CNPJ do emissor
+    errado; a reextração acerta.
+    """
+
+    def __init__(self, gabarito, latencia=LATENCIA_LLM, variacao=VARIACAO_LATENCIA, taxa_erro=TAXA_ERRO_LLM):
+        self.gabarito = gabarito
+        self.latencia = latencia
+        self.variacao = variacao
+        self.taxa_erro = taxa_erro
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self.completar))
+        self._rng = random.Random(SEMENTE)
+        self._lock = threading.Lock()
+
+    def esperar(self):
+        with self._lock: fator = 1 + self._rng.uniform(-self.variacao, self.variacao)
+        time.sleep(max(0.0, self.latencia * fator))
+
+    def responder(self, texto, campos=None):
+        """JSON com os campos do gabarito da nota citada em `texto` (todos, ou só `campos` numa reextração)."""
+        m = RE_NUMERO_CORPUS.search(texto)
+        nota = json.loads(self.gabarito[m.group(0)]) if m and m.group(0) in self.gabarito else {}
+        if campos is None and nota and zlib.crc32(m.group(0).encode()) % 10_000 < self.taxa_erro * 10_000:
+            cnpj = nota['emissor_cnpj']
+            nota['emissor_cnpj'] = cnpj[:-1] + str((int(cnpj[-1]) + 1) % 10)
+        campos = campos or extracao.CAMPOS_EXTRACAO
+        vazio = {c: [] if c == 'itens' else 0.0 if c in CAMPOS_VALOR + CAMPOS_RETENCAO else "" for c in campos}
+        return json.dumps({c: nota.get(c, vazio[c]) for c in campos}, ensure_ascii=False)
+
+    def completar(self, model, messages, response_format, **_):
+        """Mesma assinatura e resposta de chat.completions.create com saída estruturada."""
+        self.esperar()
+        texto = "\n".join(m['content'] for m in messages)
+        campos = list(response_format['json_schema']['schema']['properties'])
+        conteudo = self.responder(texto, None if set(campos) == set(extracao.CAMPOS_EXTRACAO) else campos)
+        return SimpleNamespace(
+            choices=[SimpleNamespace(message=SimpleNamespace(content=conteudo))],
+            usage=SimpleNamespace(prompt_tokens=contar_tokens(texto), completion_tokens=contar_tokens(conteudo)),
+        )
+
+    def instalar(self):
+        """Põe o substituto no lugar do módulo crewai (extracao.py o importa na hora do uso) e do cliente OpenAI."""
+        crewai = types.ModuleType("crewai")
+        crewai.Agent = AgenteLocal
+        crewai.Task = SimpleNamespace
+        crewai.Crew = lambda agents, tasks: CrewLocal(self, agents, tasks)
+        sys.modules["crewai"] = crewai
+        extracao.cliente_openai = lambda: self
+
+
+# --- RODADA (PROCESSO FILHO) ---
+def _pico_memoria_mb(filhos=False):
+    """Pico de memória residente (MB) deste processo ou dos filhos já encerrados; None sem o módulo resource."""
+    if resource is None: return None
+    pico = resource.getrusage(resource.RUSAGE_CHILDREN if filhos else resource.RUSAGE_SELF).ru_maxrss
+    return round(pico / (2**20 if sys.platform == 'darwin' else 2**10), 1)
+
+def _acerto(esperado):
+    """(% de campos corretos, % de notas com todos os campos corretos) do que foi gravado contra o gabarito."""
+    campos = CAMPOS_TEXTO + CAMPOS_VALOR
+    with conexao() as conn:
+        gravadas = pd.read_sql(f"SELECT {', '.join(campos)} FROM notas_fiscais", conn)
+    gravadas['numero_nota'] = gravadas['numero_nota'].astype(str)
+    lido = esperado[['numero_nota']].merge(gravadas.drop_duplicates('numero_nota'), on='numero_nota',
+                                           how='left', indicator=True)
+
+    certos = pd.DataFrame({'numero_nota': (lido['_merge'] == 'both').to_numpy()})
+    for c in campos[1:]:
+        if c in CAMPOS_VALOR:
+            certos[c] = ((pd.to_numeric(lido[c], errors='coerce') - esperado[c]).abs() < 0.005).to_numpy()
+        else:
+            certos[c] = (lido[c].fillna('').astype(str).str.strip() == esperado[c]).to_numpy()
+    return round(100 * certos.to_numpy().mean(), 2), round(100 * certos.all(axis=1).mean(), 2)
+
+def _acerto_itens(esperado):
+    """% dos itens do gabarito gravados em itens_nota, na mesma posição, com o mesmo NCM, quantidade e valor total."""
+    if 'itens' not in esperado: return None
+    itens = esperado[['numero_nota', 'itens']].explode('itens').dropna()
+    esperados = pd.DataFrame(itens['itens'].tolist()).assign(numero_nota=itens['numero_nota'].to_numpy())
+    esperados['numero_item'] = esperados.groupby('numero_nota').cumcount() + 1
+    with conexao() as conn:
+        gravados = pd.read_sql('''
+            SELECT n.numero_nota, i.numero_item, i.codigo_ncm, i.quantidade, i.valor_total
+            FROM itens_nota i JOIN notas_fiscais n ON n.id = i.id_nota
+        ''', conn)
+    gravados['numero_nota'] = gravados['numero_nota'].astype(str)
+    lido = esperados.merge(gravados, on=['numero_nota', 'numero_item'], how='left', suffixes=('', '_lido'))
+    # Item de serviço não tem NCM: o banco grava NULL no lugar do texto vazio
+    certos = ((lido['codigo_ncm_lido'].fillna('') == lido['codigo_ncm'])
+              & ((lido['quantidade_lido'] - lido['quantidade']).abs() < 1e-6)
+              & ((lido['valor_total_lido'] - lido['valor_total']).abs() < 0.005))
+    return round(100 * certos.mean(), 2)
+
+def _cronometrar(tempos, nome, funcao, *args, **kwargs):
+    inicio = time.perf_counter()
+    resultado = funcao(*args, **kwargs)
+    tempos[nome] = round(time.perf_counter() - inicio, 3)
+    return resultado
+
+def rodada(quantidade, latencia=LATENCIA_LLM, variacao=VARIACAO_LATENCIA, taxa_erro=TAXA_ERRO_LLM,
+           fracao_llm=FRACAO_LLM, modo=MODO_CREW, concorrencia=MAX_CONCORRENCIA, limite_rpm=LIMITE_SEM_COTA,
+           limite_tpm=LIMITE_SEM_COTA, formatos=tuple(exportacao.FORMATOS)):
+    """Roda o pipeline inteiro sobre `quantidade` notas sintéticas no diretório atual. Devolve o resultado (dict)."""
+    inicializar_banco()
+    tempos = {}
+
+    # O LLM local só guarda o gabarito das notas que vão a ele (LAYOUTS_LLM), para não inflar o pico de memória
+    gabarito_llm = {}
+    def pdfs():
+        for layout, nota in gerar_gabarito(quantidade, fracao_llm):
+            if layout in LAYOUTS_LLM: gabarito_llm[nota['numero_nota']] = json.dumps(nota, ensure_ascii=False)
+            yield f"{layout}/{nota['numero_nota']}.pdf", gerar_pdf(layout, nota)
+    lote_id = _cronometrar(tempos, 'corpus_s', fila.criar_lote, pdfs(), {'modo': modo}, descricao="benchmark")
+    LLMLocal(gabarito_llm, latencia, variacao, taxa_erro).instalar()
+
+    # Sobe todos os processos de leitura antes de cronometrar: a partida (que reimporta este
+    # módulo em cada filho) é paga uma vez por worker e não diz nada sobre a vazão
+    pool = leitura_pdf.pool_processos()
+    _cronometrar(tempos, 'partida_pool_s', lambda: list(pool.map(abs, range(leitura_pdf.MAX_PROCESSOS))))
+
+    # Worker no próprio processo, até a fila esvaziar (o log de cada bloco gravado é descartado)
+    inicio = time.time()
+    with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+        worker.executar(concorrencia, limite_rpm, limite_tpm, ocioso_max=0.001)
+    with conexao() as conn:
+        fim, = conn.execute("SELECT MAX(concluida_em) FROM tarefas_extracao WHERE lote_id = ?", (lote_id,)).fetchone()
+    progresso = fila.progresso(lote_id)
+    tempos['extracao_s'] = round((fim or time.time()) - inicio, 3)
+
+    # Reextração pedida como pela tela e feita pelo worker; as corrigidas saem da fila
+    def reextrair():
+        with conexao() as conn: antes, = conn.execute("SELECT COUNT(*) FROM fila_reextracao").fetchone()
+        validacao.solicitar_reextracao()
+        with open(os.devnull, 'w') as nulo, contextlib.redirect_stdout(nulo):
+            worker.executar(concorrencia, limite_rpm, limite_tpm, ocioso_max=0.001)
+        with conexao() as conn: depois, = conn.execute("SELECT COUNT(*) FROM fila_reextracao").fetchone()
+        return antes - depois
+    reextraidas = _cronometrar(tempos, 'reextracao_s', reextrair)
+
+    # O que o Dashboard BI e a página Banco de Dados carregam ao abrir
+    _cronometrar(tempos, 'dashboard_s', consultas.resumo_dashboard)
+    _cronometrar(tempos, 'totais_por_mes_s', consultas.totais_por_mes)
+    _cronometrar(tempos, 'totais_por_fornecedor_s', consultas.totais_por_fornecedor)
+    _cronometrar(tempos, 'grade_s', consultas.pagina_notas, {})
+    _cronometrar(tempos, 'resumo_cfo_s', analise.resumo_estatistico)
+    for formato in formatos:
+        _cronometrar(tempos, f'exportacao_{formato}_s', exportacao.exportar, formato, pasta="exportacoes")
+
+    # Picos lidos antes de montar o gabarito completo, que só existe para a conferência
+    pool.shutdown()
+    pico, pico_leitura = _pico_memoria_mb(), _pico_memoria_mb(filhos=True)
+    esperado = pd.DataFrame([nota for _, nota in gerar_gabarito(quantidade, fracao_llm)])
+    acerto_campos, notas_corretas = _acerto(esperado)
+    return {
+        'notas': quantidade,
+        'concluidas': progresso[fila.CONCLUIDA],
+        'falhas': progresso[fila.FALHOU],
+        'origens': progresso['origens'],
+        'reextraidas': reextraidas,
+        'notas_por_s': round(progresso[fila.CONCLUIDA] / max(tempos['extracao_s'], 1e-9), 2),
+        **tempos,
+        'pico_memoria_mb': pico,
+        'pico_memoria_leitura_mb': pico_leitura,
+        'acerto_campos_pct': acerto_campos,
+        'notas_corretas_pct': notas_corretas,
+        'acerto_itens_pct': _acerto_itens(esperado),
+        'etapas': json.loads(metricas.resumo_etapas(metricas.carregar(inicio)).reset_index().to_json(orient='records')),
+    }
+
+
+# --- EXECUÇÃO E RELATÓRIO ---
+def _argumentos_rodada(args, quantidade):
+    return ["--notas", str(quantidade), "--latencia", str(args.latencia), "--variacao", str(args.variacao),
+            "--taxa-erro", str(args.taxa_erro), "--fracao-llm", str(args.fracao_llm), "--modo", args.modo,
+            "--concorrencia", str(args.concorrencia), "--rpm", str(args.rpm), "--tpm", str(args.tpm),
+            "--formatos", *args.formatos]
+
+def executar(args):
+    """Uma rodada por tamanho, cada uma num processo e numa pasta temporária próprios."""
+    resultados = []
+    for quantidade in args.notas:
+        print(f"Rodando {quantidade} nota(s)...", flush=True)
+        pasta = tempfile.mkdtemp(prefix=f"benchmark_{quantidade}_", dir=args.pasta)
+        try:
+            saida = subprocess.run([sys.executable, os.path.abspath(__file__), "--interno", *_argumentos_rodada(args, quantidade)],
+                                   cwd=pasta, stdout=subprocess.PIPE, text=True, check=True).stdout
+        finally:
+            if not args.manter: shutil.rmtree(pasta, ignore_errors=True)
+        resultado = json.loads(saida.strip().splitlines()[-1])
+        resultados.append(resultado)
+        imprimir_etapas(resultado)
+    imprimir_resumo(resultados)
+    return resultados
+
+def imprimir_etapas(resultado):
+    etapas = pd.DataFrame(resultado['etapas']).set_index('etapa')
+    print(f"\nEtapas com {resultado['notas']} nota(s) (s; tokens somados):")
+    print(etapas.to_string(float_format=lambda v: f"{v:.4f}"))
+
+def imprimir_resumo(resultados):
+    colunas = ['notas', 'concluidas', 'falhas', 'reextraidas', 'notas_por_s', 'pico_memoria_mb', 'pico_memoria_leitura_mb',
+               'acerto_campos_pct', 'notas_corretas_pct', 'acerto_itens_pct']
+    resumo = pd.DataFrame(resultados)
+    tempos = [c for c in resumo.columns if c.endswith('_s') and c != 'notas_por_s']
+    print("\nResumo:")
+    print(resumo[colunas].to_string(index=False))
+    print("\nTempos (s):")
+    print(resumo[['notas'] + tempos].to_string(index=False))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark offline do pipeline com corpus sintético e LLM local.")
+    parser.add_argument("--notas", type=int, nargs="+", default=TAMANHOS_PADRAO, help="tamanhos do corpus")
+    parser.add_argument("--latencia", type=float, default=LATENCIA_LLM, help="segundos por chamada ao LLM local")
+    parser.add_argument("--variacao", type=float, default=VARIACAO_LATENCIA, help="variação da latência (± fração)")
+    parser.add_argument("--taxa-erro", type=float, default=TAXA_ERRO_LLM, help="fração de notas com CNPJ errado pelo LLM")
+    parser.add_argument("--fracao-llm", type=float, default=FRACAO_LLM, help="fração do corpus em layout livre (vai ao LLM)")
+    parser.add_argument("--modo", choices=list(MODOS_EXTRACAO), default=MODO_CREW)
+    parser.add_argument("--concorrencia", type=int, default=MAX_CONCORRENCIA)
+    parser.add_argument("--rpm", type=int, default=LIMITE_SEM_COTA)
+    parser.add_argument("--tpm", type=int, default=LIMITE_SEM_COTA)
+    parser.add_argument("--formatos", nargs="*", choices=list(exportacao.FORMATOS), default=list(exportacao.FORMATOS))
+    parser.add_argument("--pasta", help="onde criar as pastas temporárias de cada rodada")
+    parser.add_argument("--manter", action="store_true", help="não apaga a pasta (banco e exportações) de cada rodada")
+    parser.add_argument("--json", help="grava os resultados neste arquivo, para comparar execuções")
+    parser.add_argument("--interno", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.interno:
+        print(json.dumps(rodada(args.notas[0], args.latencia, args.variacao, args.taxa_erro, args.fracao_llm, args.modo,
+                                args.concorrencia, args.rpm, args.tpm, args.formatos)))
+        raise SystemExit(0)
+
+    resultados = executar(args)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f: json.dump(resultados, f, ensure_ascii=False, indent=2)
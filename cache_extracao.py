@@ -0,0 +1,67 @@
+"""Cache persistente de extrações, endereçado pelo conteúdo do PDF.
+
+A chave é o SHA-256 dos bytes do arquivo mais a versão da extração (modelo + prompts),
+então trocar `MODELO_LLM` ou o texto das tarefas invalida as entradas antigas sozinho.
+"""
+import hashlib
+import json
+import sqlite3
+import time
+
+from banco import conexao
+
+# Política de expiração
+CACHE_MAX_DIAS = 90
+CACHE_MAX_ENTRADAS = 50_000
+
+def hash_conteudo(conteudo):
+    return hashlib.sha256(conteudo).hexdigest()
+
+def calcular_versao(*partes):
+    """Impressão digital curta de tudo que muda o resultado da extração (modelo, prompts...)."""
+    return hashlib.sha256("\x1f".join(partes).encode("utf-8")).hexdigest()[:16]
+
+def buscar(hash_pdf, versao):
+    """Devolve o dict salvo para o PDF ou None em caso de falta."""
+    try:
+        with conexao() as conn:
+            linha = conn.execute(
+                "SELECT json_resultado FROM cache_extracao WHERE hash_pdf = ? AND versao = ?",
+                (hash_pdf, versao)
+            ).fetchone()
+            if linha is None: return None
+            conn.execute(
+                "UPDATE cache_extracao SET ultimo_acesso = ? WHERE hash_pdf = ? AND versao = ?",
+                (time.time(), hash_pdf, versao)
+            )
+        return json.loads(linha[0])
+    except sqlite3.Error:
+        # Cache é só otimização: qualquer falha vira "miss"
+        return None
+
+def gravar(hash_pdf, versao, dados):
+    agora = time.time()
+    try:
+        with conexao() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache_extracao VALUES (?, ?, ?, ?, ?)",
+                (hash_pdf, versao, json.dumps(dados, ensure_ascii=False), agora, agora)
+            )
+    except sqlite3.Error:
+        pass
+
+def limpar_cache(versao_atual, max_dias=CACHE_MAX_DIAS, max_entradas=CACHE_MAX_ENTRADAS):
+    """Remove entradas de versões antigas, expiradas por idade e o excedente menos usado (LRU)."""
+    limite = time.time() - max_dias * 86400
+    with conexao() as conn:
+        conn.execute("DELETE FROM cache_extracao WHERE versao != ? OR criado_em < ?", (versao_atual, limite))
+        conn.execute('''
+            DELETE FROM cache_extracao WHERE rowid IN (
+                SELECT rowid FROM cache_extracao ORDER BY ultimo_acesso DESC LIMIT -1 OFFSET ?
+            )
+        ''', (max_entradas,))
+
+def total_entradas():
+    with conexao() as conn:
+        return conn.execute("SELECT COUNT(*) FROM cache_extracao").fetchone()[0]
+
@@ -0,0 +1,134 @@
+"""Compactação do texto do PDF antes de ir para o LLM.
+
+Remove cabeçalhos/rodapés repetidos em todas as páginas, textos legais padronizados e espaços
+sobrando; se ainda passar do orçamento de tokens, mantém as linhas com conteúdo fiscal
+(CNPJ, totais, impostos...) e corta primeiro as listas de itens.
+"""
+import logging
+import re
+from collections import Counter
+
+log = logging.getLogger(__name__)
+
+# Orçamento padrão de tokens para o texto da nota (ajustável na tela de auditoria)
+ORCAMENTO_TOKENS = 3000
+
+# Incrementar ao mudar as regras abaixo (entra na versão do cache de extração)
+VERSAO_COMPACTACAO = "1"
+
+# Linhas que aparecem nesta fração das páginas (topo/rodapé) são consideradas cabeçalho repetido
+FRACAO_REPETICAO = 0.6
+LINHAS_BORDA = 6
+
+RE_ESPACOS = re.compile(r'[ \t ]+')
+RE_BOILERPLATE = re.compile('|'.join([
+    r'DOCUMENTO EMITIDO POR ME OU EPP OPTANTE PELO SIMPLES NACIONAL',
+    r'N[ÃA]O GERA DIREITO A CR[ÉE]DITO FISCAL',
+    r'CONSULTA DE AUTENTICIDADE NO PORTAL NACIONAL',
+    r'CONSULTE A AUTENTICIDADE',
+    r'WWW\.NFE\.FAZENDA\.GOV\.BR',
+    r'IDENTIFICA[ÇC][ÃA]O E ASSINATURA DO RECEBEDOR',
+    r'DATA DE RECEBIMENTO',
+    r'RESERVADO AO FISCO',
+    r'VALOR APROXIMADO DOS TRIBUTOS',
+    r'LEI (?:FEDERAL )?(?:N[ºO°]\.? )?12\.741',
+    r'FONTE:? IBPT',
+    r'P[ÁA]GINA \d+ (?:DE|/) \d+',
+    r'FOLHA \d+\s*/\s*\d+',
+]), re.I)
+RE_FISCAL = re.compile(
+    r'CNPJ|CPF|CHAVE|N[ºO°]\.?\s|N[ÚU]MERO|EMISS[ÃA]O|EMITENTE|PRESTADOR|TOMADOR|DESTINAT|RAZ[ÃA]O|'
+    r'VALOR|TOTAL|L[ÍI]QUIDO|DESCONTO|ICMS|IPI|ISS|RETEN|BASE DE C|NCM|DISCRIMINA|DESCRI[ÇC][ÃA]O|'
+    r'\d{1,3}(?:\.\d{3})*,\d{2}', re.I
+)
+
+_codificador = None
+_codificador_carregado = False
+
+
+# --- CONTAGEM DE TOKENS ---
+def contar_tokens(texto):
+    """Tokens pelo tiktoken, se disponível; senão estimativa de ~4 caracteres por token."""
+    global _codificador, _codificador_carregado
+    if not _codificador_carregado:
+        _codificador_carregado = True
+        try:
+            import tiktoken
+            _codificador = tiktoken.get_encoding("o200k_base")
+        except Exception:
+            _codificador = None
+    if _codificador is not None:
+        return len(_codificador.encode(texto, disallowed_special=()))
+    return len(texto) // 4 + 1
+
+
+# --- ETAPAS ---
+def _normalizar(linha):
+    return RE_ESPACOS.sub(' ', linha).strip()
+
+def _linhas_repetidas(paginas):
+    """Linhas do topo/rodapé que se repetem na maioria das páginas."""
+    if len(paginas) < 2: return set()
+    contagem = Counter()
+    for pagina in paginas:
+        linhas = [l for l in pagina if l]
+        contagem.update(set(linhas[:LINHAS_BORDA] + linhas[-LINHAS_BORDA:]))
+    minimo = max(2, int(len(paginas) * FRACAO_REPETICAO))
+    return {linha for linha, vezes in contagem.items() if vezes >= minimo}
+
+def _limpar(paginas):
+    paginas = [[_normalizar(l) for l in p.splitlines()] for p in paginas]
+    repetidas = _linhas_repetidas(paginas)
+    vistas, saida = set(), []
+    for pagina in paginas:
+        for linha in pagina:
+            if not linha or RE_BOILERPLATE.search(linha): continue
+            # Cabeçalho repetido fica só na primeira página
+            if linha in repetidas:
+                if linha in vistas: continue
+                vistas.add(linha)
+            saida.append(linha)
+    return saida
+
+def _recortar(linhas, orcamento):
+    """Mantém linhas fiscais (e vizinhas, por causa dos quadros rótulo/valor) dentro do orçamento."""
+    prioridade = set()
+    for i, linha in enumerate(linhas):
+        if RE_FISCAL.search(linha): prioridade.update({i - 1, i, i + 1})
+
+    mantidas, usados = set(), 0
+    # Primeiro as linhas fiscais na ordem do documento, depois o restante até esgotar o orçamento
+    for grupo in (sorted(i for i in prioridade if 0 <= i < len(linhas)), range(len(linhas))):
+        for i in grupo:
+            if i in mantidas: continue
+            custo = contar_tokens(linhas[i]) + 1
+            if usados + custo > orcamento: continue
+            mantidas.add(i)
+            usados += custo
+
+    saida, omitidas = [], 0
+    for i, linha in enumerate(linhas):
+        if i in mantidas:
+            if omitidas: saida.append(f"[... {omitidas} linha(s) omitida(s) ...]")
+            omitidas = 0
+            saida.append(linha)
+        else:
+            omitidas += 1
+    if omitidas: saida.append(f"[... {omitidas} linha(s) omitida(s) ...]")
+    return saida
+
+
+# --- ENTRADA ---
+def compactar(paginas, orcamento=ORCAMENTO_TOKENS, nome=""):
+    """Recebe o texto por página e devolve (texto_compacto, tokens_antes, tokens_depois)."""
+    original = "\n".join(paginas)
+    antes = contar_tokens(original)
+
+    linhas = _limpar(paginas)
+    texto = "\n".join(linhas)
+    if contar_tokens(texto) > orcamento:
+        texto = "\n".join(_recortar(linhas, orcamento))
+    depois = contar_tokens(texto)
+
+    log.info("Compactação %s: %d -> %d tokens (%.0f%%)", nome, antes, depois, 100 * depois / max(antes, 1))
+    return texto, antes, depois
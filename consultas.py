@@ -0,0 +1,251 @@
+"""Consultas de leitura da interface, resolvidas no SQLite.
+
+As agregações do Dashboard são feitas em SQL, sem carregar a tabela inteira no pandas.
+`versao_dados()` muda a cada gravação em `notas_fiscais` (triggers em banco.py) e serve de
+chave para os caches de leitura da interface. Os agregados, o relatório e as exportações também
+somam as notas de meses antigos arquivadas em Parquet (arquivamento.py); a grade mostra só o banco.
+O gasto por item (NCM, fornecedor) vem de `itens_nota`, gravada junto com as notas.
+"""
+import re
+from functools import reduce
+
+import pandas as pd
+
+import arquivamento
+from banco import COLUNAS_NOTA, conexao
+
+# Colunas de valor somadas nos indicadores do Dashboard
+COLUNAS_TOTAIS = ['valor_bruto', 'valor_liquido', 'valor_icms', 'valor_ipi', 'valor_icms_st',
+                  'valor_issqn', 'retencao_issqn', 'valor_desconto']
+
+# Colunas de itens_nota somadas no gasto por item
+COLUNAS_TOTAIS_ITEM = ['quantidade', 'valor_total', 'valor_desconto', 'valor_icms', 'valor_ipi', 'valor_icms_st',
+                       'valor_issqn']
+# NCMs no gráfico do Dashboard
+TOP_NCM = 10
+
+# Grade do "Banco de Dados": linhas por página e colunas projetadas (id é o cursor da paginação)
+TAMANHO_PAGINA = 100
+COLUNAS_GRADE = ['id'] + COLUNAS_NOTA
+
+# Linhas por leitura nas varreduras completas (exportação, relatório)
+TAMANHO_LOTE = 5000
+
+
+def versao_dados():
+    with conexao() as conn:
+        linha = conn.execute("SELECT versao FROM versao_dados WHERE id = 1").fetchone()
+    return linha[0] if linha else 0
+
+def totais(filtros=None):
+    """{'quantidade': n, 'valor_bruto': soma, ...} sobre as notas do filtro (todas, sem filtro)."""
+    somas = ", ".join(f"COALESCE(SUM({c}), 0)" for c in COLUNAS_TOTAIS)
+    where, params = filtros_sql(filtros or {})
+    with conexao() as conn:
+        linha = conn.execute(f"SELECT COUNT(*), {somas} FROM notas_fiscais{where}", params).fetchone()
+    resultado = dict(zip(['quantidade'] + COLUNAS_TOTAIS, linha))
+    arquivo = _arquivo(COLUNAS_TOTAIS, filtros)
+    if arquivo is not None:
+        resultado['quantidade'] += len(arquivo)
+        for c in COLUNAS_TOTAIS: resultado[c] += float(arquivo[c].sum())
+    return resultado
+
+def _totais_agrupados(expressao, nome, filtros, ordem, decrescente, colunas_arquivo, chave_arquivo):
+    """Totais por `expressao` (SQL) no banco, somados aos do arquivo agrupado por `chave_arquivo(df)`."""
+    somas = ", ".join(f"COALESCE(SUM({c}), 0) AS {c}" for c in COLUNAS_TOTAIS)
+    where, params = filtros_sql(filtros or {})
+    with conexao() as conn:
+        df = pd.read_sql(f'''
+            SELECT {expressao} AS {nome}, COUNT(*) AS quantidade, {somas}
+            FROM notas_fiscais{where} GROUP BY 1 ORDER BY {ordem}{" DESC" if decrescente else ""}
+        ''', conn, params=params)
+    arquivo = _arquivo(colunas_arquivo + COLUNAS_TOTAIS, filtros)
+    if arquivo is None: return df
+    arquivo[nome] = chave_arquivo(arquivo)
+    arquivo = arquivo.groupby(nome, as_index=False).agg(quantidade=(nome, 'size'), **{c: (c, 'sum') for c in COLUNAS_TOTAIS})
+    return (pd.concat([df, arquivo]).groupby(nome, as_index=False).sum()
+            .sort_values(ordem, ascending=not decrescente, ignore_index=True))
+
+def _fornecedor_arquivo(df):
+    return df['emissor_nome'].mask(df['emissor_nome'] == '').fillna('Não identificado') + ' | ' + df['emissor_cnpj'].fillna('')
+
+def totais_por_fornecedor(filtros=None):
+    """Uma linha por emissor (nome e CNPJ), do maior valor bruto para o menor."""
+    return _totais_agrupados("COALESCE(NULLIF(emissor_nome, ''), 'Não identificado') || ' | ' || COALESCE(emissor_cnpj, '')",
+                             'fornecedor', filtros, 'valor_bruto', True, ['emissor_nome', 'emissor_cnpj'], _fornecedor_arquivo)
+
+def totais_por_mes(filtros=None):
+    """Uma linha por mês de emissão (AAAA-MM), em ordem cronológica."""
+    # No arquivo toda nota tem data: o mês é a própria partição
+    return _totais_agrupados("COALESCE(substr(data_emissao_iso, 1, 7), 'sem data')", 'mes', filtros, 'mes', False,
+                             ['mes'], lambda df: df['mes'])
+
+def top_fornecedores(limite=5):
+    arquivo = _arquivo(['emissor_nome', 'valor_bruto'])
+    # Com arquivo, o ranking sai da soma dos dois lados: o banco devolve todos os emissores (LIMIT -1)
+    with conexao() as conn:
+        df = pd.read_sql('''
+            SELECT emissor_nome, SUM(valor_bruto) AS valor_bruto FROM notas_fiscais
+            WHERE emissor_nome IS NOT NULL
+            GROUP BY emissor_nome ORDER BY valor_bruto DESC LIMIT ?
+        ''', conn, params=(limite if arquivo is None else -1,))
+    if arquivo is None: return df
+    return (pd.concat([df, arquivo.dropna(subset=['emissor_nome'])]).groupby('emissor_nome', as_index=False)['valor_bruto']
+            .sum().nlargest(limite, 'valor_bruto').reset_index(drop=True))
+
+def resumo_dashboard():
+    """Tudo que o Dashboard BI desenha: totais, ranking de fornecedores e gasto por NCM e por fornecedor e NCM."""
+    return {'totais': totais(), 'top_fornecedores': top_fornecedores(), 'top_ncm': totais_por_ncm().head(TOP_NCM),
+            'top_fornecedor_ncm': totais_por_fornecedor_ncm().head(TOP_NCM)}
+
+
+# --- ITENS (GASTO POR NCM E POR FORNECEDOR) ---
+def _totais_itens(colunas_item, colunas_nota, filtros):
+    """Itens das notas do filtro somados por `colunas_item` (itens_nota) e `colunas_nota` (notas_fiscais)."""
+    chaves = [f"i.{c}" for c in colunas_item] + [f"n.{c}" for c in colunas_nota]
+    somas = ", ".join(f"COALESCE(SUM(i.{c}), 0) AS {c}" for c in COLUNAS_TOTAIS_ITEM)
+    where, params = filtros_sql(filtros or {})
+    with conexao() as conn:
+        df = pd.read_sql(f'''
+            SELECT {", ".join(chaves)}, COUNT(*) AS itens, {somas}
+            FROM itens_nota i JOIN notas_fiscais n ON n.id = i.id_nota{where}
+            GROUP BY {", ".join(chaves)}
+        ''', conn, params=params)
+    nomes = colunas_item + colunas_nota
+    if arquivamento.meses_arquivados():
+        arquivo = arquivamento.itens(colunas_item + COLUNAS_TOTAIS_ITEM, colunas_nota, filtros_arquivo(filtros or {}))
+        arquivo = arquivo.to_pandas().groupby(nomes, dropna=False, as_index=False).agg(
+            itens=('id_nota', 'size'), **{c: (c, 'sum') for c in COLUNAS_TOTAIS_ITEM})
+        df = pd.concat([df, arquivo]).groupby(nomes, dropna=False, as_index=False).sum()
+    return df.sort_values('valor_total', ascending=False, ignore_index=True)
+
+def totais_por_ncm(filtros=None):
+    """Gasto por NCM somando os itens das notas do filtro, do maior valor para o menor."""
+    return _totais_itens(['codigo_ncm'], [], filtros)
+
+def totais_por_fornecedor_ncm(filtros=None):
+    """Gasto de cada fornecedor (CNPJ e nome) por NCM: o que se compra de quem."""
+    return _totais_itens(['codigo_ncm'], ['emissor_cnpj', 'emissor_nome'], filtros)
+
+
+# --- GRADE PAGINADA (BANCO DE DADOS) ---
+def _like(texto):
+    return "%" + re.sub(r'([%_\\])', r'\\\1', texto.strip()) + "%"
+
+def _formas_documento(digitos):
+    """Como o documento do emissor costuma estar gravado: só dígitos ou com a máscara de CNPJ/CPF."""
+    d = digitos
+    mascara = f"{d[:2]}.{d[2:5]}.{d[5:8]}/{d[8:12]}-{d[12:]}" if len(d) == 14 else f"{d[:3]}.{d[3:6]}.{d[6:9]}-{d[9:]}"
+    return [d, mascara]
+
+def filtros_sql(filtros):
+    """Converte o dict de filtros da tela em (cláusula WHERE, parâmetros)."""
+    condicoes, params = [], []
+    if filtros.get('fornecedor'):
+        condicoes.append("emissor_nome LIKE ? ESCAPE '\\'")
+        params.append(_like(filtros['fornecedor']))
+    if filtros.get('cnpj'):
+        digitos = re.sub(r'\D', '', filtros['cnpj'])
+        if len(digitos) in (11, 14):
+            # Documento completo: faixa na chave única (documento-número), que é indexada; nota sem número
+            # não tem chave e é achada pelo índice de emissor_cnpj, nas formas em que o documento é gravado
+            condicoes.append("(chave_nota >= ? AND chave_nota < ? OR emissor_cnpj IN (?, ?) AND chave_nota IS NULL)")
+            params += [f"{digitos}-", f"{digitos}.", *_formas_documento(digitos)]
+        else:
+            condicoes.append("emissor_cnpj LIKE ? ESCAPE '\\'")
+            params.append(_like(filtros['cnpj']))
+    if filtros.get('data_inicio'):
+        condicoes.append("data_emissao_iso >= ?")
+        params.append(filtros['data_inicio'].isoformat())
+    if filtros.get('data_fim'):
+        condicoes.append("data_emissao_iso <= ?")
+        params.append(filtros['data_fim'].isoformat())
+    if filtros.get('valor_min') is not None:
+        condicoes.append("valor_bruto >= ?")
+        params.append(filtros['valor_min'])
+    if filtros.get('valor_max') is not None:
+        condicoes.append("valor_bruto <= ?")
+        params.append(filtros['valor_max'])
+    if filtros.get('busca'):
+        condicoes.append("descricao_item LIKE ? ESCAPE '\\'")
+        params.append(_like(filtros['busca']))
+    if filtros.get('upload_apos'):
+        condicoes.append("data_upload > ?")
+        params.append(filtros['upload_apos'])
+    return (" WHERE " + " AND ".join(condicoes) if condicoes else ""), params
+
+def filtros_arquivo(filtros):
+    """Os mesmos filtros de `filtros_sql` como expressão do pyarrow, para as notas arquivadas (None sem filtro).
+
+    LIKE vira busca de substring sem diferenciar maiúsculas; o período também descarta as pastas de mês fora dele.
+    """
+    import pyarrow.compute as pc
+    import pyarrow.dataset as ds
+    condicoes = []
+    for filtro, coluna in (('fornecedor', 'emissor_nome'), ('busca', 'descricao_item')):
+        if filtros.get(filtro):
+            condicoes.append(pc.match_substring(ds.field(coluna), filtros[filtro].strip(), ignore_case=True))
+    if filtros.get('cnpj'):
+        digitos = re.sub(r'\D', '', filtros['cnpj'])
+        if len(digitos) in (11, 14):
+            documento = pc.replace_substring_regex(ds.field('emissor_cnpj'), r'\D', '')
+            condicoes.append(((ds.field('chave_nota') >= f"{digitos}-") & (ds.field('chave_nota') < f"{digitos}."))
+                             | (ds.field('chave_nota').is_null() & (documento == digitos)))
+        else:
+            condicoes.append(pc.match_substring(ds.field('emissor_cnpj'), filtros['cnpj'].strip(), ignore_case=True))
+    if filtros.get('data_inicio'):
+        inicio = filtros['data_inicio'].isoformat()
+        condicoes += [ds.field('mes') >= inicio[:7], ds.field('data_emissao_iso') >= inicio]
+    if filtros.get('data_fim'):
+        fim = filtros['data_fim'].isoformat()
+        condicoes += [ds.field('mes') <= fim[:7], ds.field('data_emissao_iso') <= fim]
+    if filtros.get('valor_min') is not None:
+        condicoes.append(ds.field('valor_bruto') >= filtros['valor_min'])
+    if filtros.get('valor_max') is not None:
+        condicoes.append(ds.field('valor_bruto') <= filtros['valor_max'])
+    if filtros.get('upload_apos'):
+        condicoes.append(ds.field('data_upload') > filtros['upload_apos'])
+    return reduce(lambda a, b: a & b, condicoes) if condicoes else None
+
+def _arquivo(colunas, filtros=None):
+    """DataFrame com as `colunas` das notas arquivadas do filtro, ou None se não há arquivo."""
+    if not arquivamento.meses_arquivados(): return None
+    return arquivamento.tabela(colunas, filtros_arquivo(filtros or {})).to_pandas()
+
+def contar_notas(filtros):
+    where, params = filtros_sql(filtros)
+    with conexao() as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM notas_fiscais{where}", params).fetchone()[0]
+
+def pagina_notas(filtros, apos_id=None, tamanho=TAMANHO_PAGINA):
+    """Uma página da grade, da nota mais nova para a mais antiga.
+
+    Paginação por cursor (keyset): `apos_id` é o menor id da página anterior, então cada
+    página custa o mesmo não importa quão longe se está do início.
+    """
+    where, params = filtros_sql(filtros)
+    if apos_id is not None:
+        where += (" AND " if where else " WHERE ") + "id < ?"
+        params.append(apos_id)
+    with conexao() as conn:
+        return pd.read_sql(f"SELECT {', '.join(COLUNAS_GRADE)} FROM notas_fiscais{where} ORDER BY id DESC LIMIT ?",
+                           conn, params=params + [tamanho])
+
+def lotes_notas(colunas, filtros=None, ordem="id", tamanho=TAMANHO_LOTE):
+    """Varre as notas do filtro em listas de até `tamanho` tuplas, sem montar DataFrame.
+
+    As arquivadas vêm antes das do banco, cada parte na `ordem` pedida (colunas, crescente).
+    """
+    if arquivamento.meses_arquivados():
+        criterios = [c.strip() for c in ordem.split(',')]
+        arquivo = arquivamento.tabela(list(dict.fromkeys(colunas + criterios)), filtros_arquivo(filtros or {}))
+        arquivo = arquivo.sort_by([(c, 'ascending') for c in criterios]).select(colunas)
+        for lote in arquivo.to_batches(tamanho):
+            if lote.num_rows: yield list(zip(*(coluna.to_pylist() for coluna in lote.columns)))
+    where, params = filtros_sql(filtros or {})
+    with conexao() as conn:
+        cursor = conn.execute(f"SELECT {', '.join(colunas)} FROM notas_fiscais{where} ORDER BY {ordem}", params)
+        while True:
+            lote = cursor.fetchmany(tamanho)
+            if not lote: return
+            yield lote
@@ -0,0 +1,199 @@
+"""Exportação das notas para Excel, CSV ou Parquet (Power BI), montada só quando pedida.
+
+As linhas saem do SQLite em lotes (consultas.lotes_notas) direto para o arquivo, então a memória não
+cresce com o histórico: o XLSX usa o modo write_only do openpyxl e o Parquet é gravado lote a
+lote em pastas particionadas por mês de emissão e emissor. No modo incremental só vão as notas
+gravadas depois da última exportação do mesmo formato (pela `data_upload`); no Parquet elas entram
+em arquivos novos e saem dos antigos (uma nota regravada volta com `data_upload` nova), e a
+exportação completa substitui o dataset. A interface baixa Excel/CSV de uma pasta temporária e só
+move a marca quando o arquivo é baixado; só as exportações pela linha de comando ficam em PASTA_EXPORTACAO.
+
+Uso noturno, fora da interface:  python exportacao.py parquet --incremental
+"""
+import argparse
+import csv
+import os
+import re
+import shutil
+import time
+import uuid
+from datetime import datetime
+
+from banco import CAMPOS_VALOR, COLUNAS_NOTA, conexao, inicializar_banco
+from consultas import lotes_notas
+
+PASTA_EXPORTACAO = "exportacoes"
+
+COLUNAS_EXPORTACAO = ['id'] + COLUNAS_NOTA
+
+FORMATOS = {
+    'xlsx': "Excel (.xlsx)",
+    'csv': "CSV (.csv)",
+    'parquet': "Parquet particionado (Power BI)",
+}
+
+
+# --- MARCA DA ÚLTIMA EXPORTAÇÃO ---
+def ultima_exportacao(formato):
+    """`data_upload` da nota mais nova já exportada nesse formato (None se nunca exportou)."""
+    with conexao() as conn:
+        linha = conn.execute("SELECT ultimo_data_upload FROM exportacoes WHERE formato = ?", (formato,)).fetchone()
+    return linha[0] if linha else None
+
+def registrar_exportacao(formato, ultimo_data_upload):
+    """Move a marca do formato para `ultimo_data_upload` (nunca para trás)."""
+    with conexao() as conn:
+        conn.execute('''
+            INSERT INTO exportacoes (formato, ultimo_data_upload, exportado_em) VALUES (?, ?, ?)
+            ON CONFLICT (formato) DO UPDATE SET
+                ultimo_data_upload = MAX(ultimo_data_upload, excluded.ultimo_data_upload),
+                exportado_em = excluded.exportado_em
+        ''', (formato, ultimo_data_upload, time.time()))
+
+
+# --- ESCRITORES ---
+def _escrever_xlsx(caminho, lotes):
+    from openpyxl import Workbook
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("notas_fiscais")
+    ws.append(COLUNAS_EXPORTACAO)
+    for lote in lotes:
+        for linha in lote: ws.append(linha)
+    wb.save(caminho)
+
+def _escrever_csv(caminho, lotes):
+    # utf-8-sig: o Excel em português abre acentuação certa sem importar manualmente
+    with open(caminho, 'w', newline='', encoding='utf-8-sig') as f:
+        escritor = csv.writer(f)
+        escritor.writerow(COLUNAS_EXPORTACAO)
+        for lote in lotes: escritor.writerows(lote)
+
+def _mes(data_emissao):
+    """'15/01/2024' ou '2024-01-15' -> '2024-01'."""
+    texto = str(data_emissao or '')
+    if re.match(r'\d{2}/\d{2}/\d{4}', texto): return f"{texto[6:10]}-{texto[3:5]}"
+    if re.match(r'\d{4}-\d{2}', texto): return texto[:7]
+    return 'sem_data'
+
+def _particao_emissor(cnpj):
+    return re.sub(r'\D', '', str(cnpj or '')) or 'sem_emissor'
+
+def _escrever_parquet(pasta, lotes):
+    """Pasta no formato Hive (mes=AAAA-MM/emissor=CNPJ/...), um arquivo novo por lote e partição.
+
+    Devolve (arquivos gravados, ids exportados), para a incremental tirar esses ids dos arquivos antigos.
+    """
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+
+    campos = [pa.field('id', pa.int64())]
+    campos += [pa.field(c, pa.float64() if c in CAMPOS_VALOR else pa.string()) for c in COLUNAS_NOTA]
+    campos += [pa.field('mes', pa.string()), pa.field('emissor', pa.string())]
+    esquema = pa.schema(campos)
+
+    i_data = COLUNAS_EXPORTACAO.index('data_emissao')
+    i_cnpj = COLUNAS_EXPORTACAO.index('emissor_cnpj')
+    prefixo = f"{datetime.now():%Y%m%d%H%M%S}-{uuid.uuid4().hex[:8]}"
+    arquivos, ids = set(), set()
+    for n, lote in enumerate(lotes):
+        colunas = {c: [linha[i] for linha in lote] for i, c in enumerate(COLUNAS_EXPORTACAO)}
+        for c in CAMPOS_VALOR:
+            colunas[c] = [float(v) if isinstance(v, (int, float)) else None for v in colunas[c]]
+        colunas['data_upload'] = [None if v is None else str(v) for v in colunas['data_upload']]
+        colunas['mes'] = [_mes(linha[i_data]) for linha in lote]
+        colunas['emissor'] = [_particao_emissor(linha[i_cnpj]) for linha in lote]
+        ids.update(colunas['id'])
+        # Um lote pode cobrir mais partições (meses x emissores) que o limite padrão do pyarrow, de 1024
+        pq.write_to_dataset(
+            pa.Table.from_pydict(colunas, schema=esquema), pasta, partition_cols=['mes', 'emissor'],
+            basename_template=f"{prefixo}-{n}-{{i}}.parquet", max_partitions=len(lote),
+            file_visitor=lambda arquivo: arquivos.add(os.path.normpath(arquivo.path)),
+        )
+    return arquivos, ids
+
+def _remover_repetidos(pasta, novos, ids):
+    """Tira dos arquivos antigos do dataset as notas reexportadas agora (regravadas depois da última exportação).
+
+    Só a coluna id é lida para achar os arquivos afetados; esses são regravados sem as notas (ou apagados, se
+    ficarem vazios). A nota pode ter mudado de mês ou emissor, então todas as partições são olhadas.
+    """
+    import pyarrow as pa
+    import pyarrow.compute as pc
+    import pyarrow.parquet as pq
+
+    if not ids: return
+    procurados = pa.array(sorted(ids), pa.int64())
+    for raiz, _, nomes in os.walk(pasta):
+        for nome in nomes:
+            arquivo = os.path.normpath(os.path.join(raiz, nome))
+            if not nome.endswith('.parquet') or arquivo in novos: continue
+            if not pc.any(pc.is_in(pq.read_table(arquivo, columns=['id']).column('id'), procurados)).as_py(): continue
+            tabela = pq.ParquetFile(arquivo).read()
+            restante = tabela.filter(pc.invert(pc.is_in(tabela.column('id'), procurados)))
+            if restante.num_rows == 0:
+                os.remove(arquivo)
+            else:
+                pq.write_table(restante, arquivo + ".tmp")
+                os.replace(arquivo + ".tmp", arquivo)
+
+
+# --- ENTRADA ---
+def exportar(formato, filtros=None, incremental=False, pasta=PASTA_EXPORTACAO, registrar=True):
+    """Grava a exportação em `pasta` e devolve (caminho, quantidade de notas, marca).
+
+    Para xlsx/csv o caminho é um arquivo novo; para parquet é a pasta do dataset, que a exportação
+    completa substitui e a incremental atualiza.
+    Com `incremental`, só entram as notas gravadas depois da última exportação desse formato.
+    A marca é o `data_upload` até onde a exportação foi (None se filtrada: seria um recorte, não o
+    histórico); sem `registrar` ela não é gravada, e quem chama usa `registrar_exportacao` quando
+    a exportação for de fato entregue.
+    """
+    if formato not in FORMATOS: raise ValueError(f"Formato desconhecido: {formato}")
+    os.makedirs(pasta, exist_ok=True)
+    desde = ultima_exportacao(formato) if incremental else None
+
+    quantidade, ultimo = 0, None
+    def contar(lotes):
+        nonlocal quantidade, ultimo
+        i_upload = COLUNAS_EXPORTACAO.index('data_upload')
+        for lote in lotes:
+            quantidade += len(lote)
+            # Arquivo e banco vêm em sequência, cada um ordenado: a marca é o maior data_upload visto
+            ultimo = max(filter(None, (ultimo, lote[-1][i_upload])), default=None)
+            yield lote
+
+    lotes = contar(lotes_notas(COLUNAS_EXPORTACAO, {**(filtros or {}), 'upload_apos': desde}, "data_upload, id"))
+    if formato == 'parquet':
+        caminho = os.path.join(pasta, "notas_fiscais_parquet")
+        if incremental:
+            # Novos arquivos primeiro: se parar no meio sobra repetição, não falta nota, e a marca não se move
+            _remover_repetidos(caminho, *_escrever_parquet(caminho, lotes))
+        else:
+            # Completa: monta ao lado e troca, senão cada exportação duplicaria o histórico no dataset
+            novo = os.path.join(pasta, "_notas_fiscais_parquet")
+            shutil.rmtree(novo, ignore_errors=True)
+            os.makedirs(novo)
+            _escrever_parquet(novo, lotes)
+            shutil.rmtree(caminho, ignore_errors=True)
+            os.replace(novo, caminho)
+    else:
+        sufixo = "_incremental" if incremental else ""
+        caminho = os.path.join(pasta, f"notas_fiscais_{datetime.now():%Y%m%d_%H%M%S_%f}{sufixo}.{formato}")
+        (_escrever_xlsx if formato == 'xlsx' else _escrever_csv)(caminho, lotes)
+
+    filtrada = any(v not in (None, '') for v in (filtros or {}).values())
+    marca = str(ultimo) if ultimo and not filtrada else None
+    if marca and registrar: registrar_exportacao(formato, marca)
+    return caminho, quantidade, marca
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta as notas fiscais do banco local.")
+    parser.add_argument("formato", choices=list(FORMATOS))
+    parser.add_argument("--incremental", action="store_true", help="só as notas novas desde a última exportação")
+    parser.add_argument("--pasta", default=PASTA_EXPORTACAO)
+    args = parser.parse_args()
+
+    inicializar_banco()
+    caminho, quantidade, _ = exportar(args.formato, incremental=args.incremental, pasta=args.pasta)
+    print(f"{quantidade} nota(s) exportada(s) em {caminho}")
@@ -0,0 +1,429 @@
+"""Motor de extração de notas fiscais (PDF -> JSON), nota a nota, usado pelo worker.py.
+
+O worker chama `extrair_nota` em várias threads, que dividem um LimitadorTaxa; a página
+"Nova Auditoria" só enfileira os PDFs (fila.py).
+"""
+import json
+import re
+import threading
+import time
+from collections import Counter, deque
+
+import cache_extracao
+import compactacao
+import extrator_regras
+import leitura_pdf
+import metricas
+from banco import CAMPOS_ITEM_TEXTO, CAMPOS_ITEM_VALOR, CAMPOS_RETENCAO, CAMPOS_TEXTO, CAMPOS_VALOR, COLUNAS_ITEM
+from compactacao import ORCAMENTO_TOKENS, contar_tokens
+from extrator_regras import LIMIAR_CONFIANCA
+
+MODELO_LLM = "gpt-4o-mini"
+
+# Limites padrão do worker (ajustáveis por `python worker.py executar --concorrencia/--rpm/--tpm`)
+MAX_CONCORRENCIA = 8      # notas em processamento simultâneo
+LIMITE_RPM = 500          # requisições por minuto à API do LLM
+LIMITE_TPM = 200_000      # tokens por minuto à API do LLM
+
+# --- PROMPTS ---
+PROMPT_EXTRACAO = """
+Analise o texto:
+---
+{texto}
+---
+REGRAS:
+1. NÃO ALUCINE. Se não achar, use 0.0.
+2. DATAS: Converta para DD/MM/AAAA.
+3. EXTRAIA: Tipo (DANFE/NFSe), Emissor, Tomador, Num, Data.
+4. FINANCEIRO: Bruto, Líquido, Desconto.
+5. IMPOSTOS: ICMS, IPI, ISSQN, Retenções (ISS, PIS, COFINS, CSLL, IR, INSS).
+6. ITENS: cada linha de produto/serviço (descrição, NCM, CFOP, unidade, quantidade, valor unitário, total e impostos).
+"""
+
+PROMPT_JSON = """
+Gere JSON válido:
+{
+    "numero_nota": "string", "data_emissao": "string",
+    "emissor_nome": "string", "emissor_cnpj": "string",
+    "tomador_nome": "string", "tomador_cnpj": "string",
+    "descricao_item": "string", "codigo_ncm": "string",
+    "valor_bruto": float, "valor_desconto": float, "valor_liquido": float,
+    "valor_icms": float, "valor_ipi": float, "valor_icms_st": float,
+    "valor_issqn": float, "retencao_issqn": float,
+    "retencao_pis": float, "retencao_cofins": float, "retencao_csll": float,
+    "retencao_irrf": float, "retencao_inss": float,
+    "itens": [{
+        "descricao": "string", "codigo_ncm": "string", "cfop": "string", "unidade": "string",
+        "quantidade": float, "valor_unitario": float, "valor_total": float, "valor_desconto": float,
+        "valor_icms": float, "valor_ipi": float, "valor_icms_st": float, "valor_issqn": float
+    }]
+}
+"""
+
+PROMPT_ESTRUTURADO = """
+Você é um Auditor Tributário Sênior. Extraia os dados da nota fiscal enviada pelo usuário.
+REGRAS:
+1. NÃO ALUCINE. Se não achar, use 0.0 nos valores e "" nos textos.
+2. DATAS: Converta para DD/MM/AAAA.
+3. CNPJ/CPF exatamente como aparecem no documento.
+4. Distinga Comércio (ICMS, IPI, ICMS-ST) de Serviço (ISSQN e retenções de ISS, PIS, COFINS, CSLL, IR e INSS).
+5. Valores em reais como número (ex.: 1234.56), sem símbolo de moeda.
+6. Em `itens`, uma entrada por linha de produto/serviço da nota, com o NCM só com dígitos.
+"""
+
+PROMPT_CORRECAO = """
+Os campos abaixo vieram inválidos. Releia o documento e devolva somente estes campos:
+{erros}
+"""
+
+# Modos de extração selecionáveis por lote
+MODO_CREW = 'crew'
+MODO_ESTRUTURADO = 'estruturado'
+MODOS_EXTRACAO = {
+    MODO_CREW: "Equipe de Agentes (extrator + auditor)",
+    MODO_ESTRUTURADO: "Chamada Única Estruturada (JSON Schema)",
+}
+
+# Chamadas ao LLM por nota no modo Crew (extrator + auditor)
+CHAMADAS_POR_NOTA = 2
+
+# Novas chamadas permitidas no modo estruturado só para os campos que falharem na validação
+MAX_TENTATIVAS_CAMPOS = 2
+
+# Qualquer mudança no modelo, nos prompts ou nas regras gera outra versão e invalida o cache
+VERSAO_EXTRACAO = cache_extracao.calcular_versao(
+    MODELO_LLM, PROMPT_EXTRACAO, PROMPT_JSON, PROMPT_ESTRUTURADO,
+    extrator_regras.VERSAO_REGRAS, compactacao.VERSAO_COMPACTACAO
+)
+
+RE_DATA_BR = re.compile(r'^\d{2}/\d{2}/\d{4}$')
+
+# Chave, dentro da nota guardada no cache, de como ela foi extraída (origem e opções que importam)
+CHAVE_CONTEXTO = '_contexto'
+
+# Campos pedidos ao LLM: os da nota, as retenções federais (vão para os extras) e a lista de itens (itens_nota)
+CAMPOS_EXTRACAO = CAMPOS_TEXTO + CAMPOS_VALOR + CAMPOS_RETENCAO + ['itens']
+
+
+# --- AGENTES ---
+# crewai e openai levam segundos para importar: entram no processo só na primeira nota que vai à IA
+# (a interface e os processos de leitura de PDF, que importam este módulo, não pagam por eles)
+_equipes = threading.local()
+
+def criar_equipe_extracao():
+    from crewai import Agent
+
+    extrator = Agent(
+        role='Auditor Tributário Sênior',
+        goal='Extrair dados com fidelidade absoluta, distinguindo Comércio (ICMS) e Serviço (ISS).',
+        backstory='Especialista em legislação fiscal. Você não inventa dados.',
+        verbose=False, allow_delegation=False, llm=MODELO_LLM
+    )
+    auditor = Agent(
+        role='Engenheiro de Dados',
+        goal='Padronizar JSON e sanitizar dados.',
+        backstory='Garante datas em DD/MM/AAAA, floats corretos e campos vazios zerados.',
+        verbose=False, allow_delegation=False, llm=MODELO_LLM
+    )
+    return extrator, auditor
+
+def equipe_extracao():
+    """(extrator, auditor) desta thread, criados na primeira nota e reaproveitados nas seguintes.
+
+    Um par por thread, não por processo: o kickoff guarda o estado da execução no próprio Agent
+    (crew, agent_executor), então duas Crews rodando ao mesmo tempo não podem dividir agentes.
+    Os tokens também ficam no Agent e só se acumulam: o uso de uma nota vem de `_tokens_agentes`.
+    """
+    if not hasattr(_equipes, 'agentes'): _equipes.agentes = criar_equipe_extracao()
+    return _equipes.agentes
+
+def _tokens_agentes(agentes):
+    """(prompt, resposta) somados desde a criação dos agentes, ou None se eles não contam tokens.
+
+    O `token_usage` do kickoff é essa mesma soma, então com agentes reaproveitados o uso de uma nota
+    é a diferença entre a leitura depois e a de antes do kickoff.
+    """
+    if not all(hasattr(a, '_token_process') for a in agentes): return None
+    resumos = [a._token_process.get_summary() for a in agentes]
+    return sum(r.prompt_tokens for r in resumos), sum(r.completion_tokens for r in resumos)
+
+def _texto(valor):
+    """Campo de texto como str: o LLM às vezes devolve número, lista ou objeto, que o SQLite não grava."""
+    if valor is None or isinstance(valor, str): return valor
+    if isinstance(valor, (dict, list)): return json.dumps(valor, ensure_ascii=False)
+    return str(valor)
+
+def interpretar_resposta(resposta):
+    """Remove cercas de markdown da resposta do LLM e converte em dict, com os campos de texto em str."""
+    clean = str(resposta).replace("```json", "").replace("```", "").strip()
+    if clean.startswith("json"): clean = clean[4:]
+    dados = json.loads(clean)
+    if not isinstance(dados, dict): raise ValueError("resposta do LLM não é um objeto JSON")
+    for campo in CAMPOS_TEXTO:
+        if campo in dados: dados[campo] = _texto(dados[campo])
+    itens = dados.get('itens')
+    if isinstance(itens, list):
+        dados['itens'] = [{**item, **{c: _texto(item[c]) for c in CAMPOS_ITEM_TEXTO if c in item}}
+                          for item in itens if isinstance(item, dict)]
+    return dados
+
+
+# --- LIMITADOR DE TAXA ---
+class LimitadorTaxa:
+    """Janela deslizante de 60s que respeita os limites de requisições e tokens por minuto.
+
+    Compartilhado entre as threads do worker: `adquirir` bloqueia até haver espaço na janela.
+    """
+
+    def __init__(self, rpm=LIMITE_RPM, tpm=LIMITE_TPM):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._janela = deque()  # (instante, requisicoes, tokens)
+        self._lock = threading.Lock()
+
+    def adquirir(self, requisicoes=1, tokens=0):
+        while True:
+            with self._lock:
+                agora = time.monotonic()
+                while self._janela and agora - self._janela[0][0] >= 60:
+                    self._janela.popleft()
+                usadas = sum(r for _, r, _ in self._janela)
+                gastos = sum(t for _, _, t in self._janela)
+                # Janela vazia sempre libera, senão uma nota maior que o limite travaria o lote
+                if not self._janela or (usadas + requisicoes <= self.rpm and gastos + tokens <= self.tpm):
+                    self._janela.append((agora, requisicoes, tokens))
+                    return
+                espera = 60 - (agora - self._janela[0][0])
+            time.sleep(max(espera, 0.05))
+
+
+class EstatisticasLote:
+    """Contagem de notas por origem do resultado ('cache', 'regras', 'llm' ou 'sem_texto') dentro de um lote."""
+
+    def __init__(self):
+        self.contagem = Counter()
+        self.tokens = Counter()  # 'antes'/'depois' da compactação do texto enviado à IA
+        self._lock = threading.Lock()
+
+    def registrar(self, origem):
+        with self._lock:
+            self.contagem[origem] += 1
+
+    def registrar_tokens(self, antes, depois):
+        with self._lock:
+            self.tokens['antes'] += antes
+            self.tokens['depois'] += depois
+
+
+# --- PIPELINE POR NOTA ---
+def extrair_com_agentes(texto, limitador=None):
+    """Roda a equipe extrator + auditor sobre o texto do PDF e devolve o dict interpretado."""
+    from crewai import Crew, Task
+
+    extrator, auditor = equipe_extracao()
+
+    # Instante em que cada tarefa termina, para medir as duas chamadas de dentro do kickoff()
+    marcos = []
+    marcar = lambda _: marcos.append(time.perf_counter())
+
+    # Tarefas Blindadas
+    t1 = Task(description=PROMPT_EXTRACAO.format(texto=texto), expected_output="Dados extraídos.", agent=extrator,
+              callback=marcar)
+    t2 = Task(description=PROMPT_JSON, expected_output="JSON válido.", agent=auditor, callback=marcar)
+
+    if limitador:
+        # O auditor recebe a saída do extrator, então o custo fica perto de 2x o prompt inicial
+        limitador.adquirir(CHAMADAS_POR_NOTA, contar_tokens(t1.description + PROMPT_JSON) * CHAMADAS_POR_NOTA)
+
+    antes = _tokens_agentes((extrator, auditor))
+    marcos.append(time.perf_counter())
+    erro = None
+    try:
+        res = Crew(agents=[extrator, auditor], tasks=[t1, t2]).kickoff()
+    except Exception as e:
+        erro = e
+        raise
+    finally:
+        fim = time.perf_counter()
+        for i, etapa in enumerate(['llm_extrator', 'llm_auditor'][:len(marcos)]):
+            concluida = i + 1 < len(marcos)
+            metricas.registrar(etapa, (marcos[i + 1] if concluida else fim) - marcos[i],
+                               erro=None if concluida else erro, modelo=MODELO_LLM)
+
+    depois = _tokens_agentes((extrator, auditor))
+    if antes is not None and depois is not None:
+        metricas.somar_tokens(None, depois[0] - antes[0], depois[1] - antes[1], MODELO_LLM)
+    elif getattr(res, 'token_usage', None):
+        metricas.somar_tokens(None, res.token_usage.prompt_tokens, res.token_usage.completion_tokens, MODELO_LLM)
+    with metricas.medir('parse_json'):
+        return interpretar_resposta(res)
+
+# --- MODO ESTRUTURADO (CHAMADA ÚNICA) ---
+_cliente = None
+_cliente_lock = threading.Lock()
+
+def cliente_openai():
+    """Cliente OpenAI único por processo (é thread-safe e reaproveita as conexões HTTP)."""
+    global _cliente
+    with _cliente_lock:
+        if _cliente is None:
+            from openai import OpenAI
+            _cliente = OpenAI()
+    return _cliente
+
+def _esquema_objeto(campos, valores):
+    propriedades = {c: {"type": "number" if c in valores else "string"} for c in campos}
+    return {"type": "object", "properties": propriedades, "required": list(campos), "additionalProperties": False}
+
+def esquema_nota(campos=None):
+    """JSON Schema estrito da nota (ou só de `campos`), no formato de saída estruturada da OpenAI."""
+    campos = campos or CAMPOS_EXTRACAO
+    esquema = _esquema_objeto(campos, CAMPOS_VALOR + CAMPOS_RETENCAO)
+    if 'itens' in campos:
+        esquema['properties']['itens'] = {"type": "array", "items": _esquema_objeto(COLUNAS_ITEM, CAMPOS_ITEM_VALOR)}
+    return {"name": "nota_fiscal", "strict": True, "schema": esquema}
+
+def validar_campos(dados):
+    """Devolve {campo: motivo} para os campos ausentes ou fora do formato esperado."""
+    erros = {}
+    for campo in CAMPOS_TEXTO:
+        if not isinstance(dados.get(campo), str): erros[campo] = "deve ser texto"
+    for campo in CAMPOS_VALOR:
+        valor = dados.get(campo)
+        if isinstance(valor, bool) or not isinstance(valor, (int, float)) or valor < 0:
+            erros[campo] = "deve ser número maior ou igual a zero"
+
+    data = dados.get('data_emissao')
+    if isinstance(data, str) and data and not RE_DATA_BR.match(data):
+        erros['data_emissao'] = "data deve estar em DD/MM/AAAA"
+    for campo in ('emissor_cnpj', 'tomador_cnpj'):
+        doc = dados.get(campo)
+        if isinstance(doc, str) and doc and len(re.sub(r'\D', '', doc)) not in (11, 14):
+            erros[campo] = "CNPJ deve ter 14 dígitos (ou CPF 11)"
+    return erros
+
+def extrair_estruturado(texto, limitador=None):
+    """Uma chamada com saída em JSON Schema; só os campos que falharem na validação são pedidos de novo."""
+    mensagens = [
+        {"role": "system", "content": PROMPT_ESTRUTURADO},
+        {"role": "user", "content": texto},
+    ]
+    campos = CAMPOS_EXTRACAO
+    dados = {}
+    with metricas.medir('llm_estruturado') as medicao:
+        medicao['modelo'] = MODELO_LLM
+        for tentativa in range(MAX_TENTATIVAS_CAMPOS + 1):
+            medicao['tentativas'] = tentativa + 1
+            if limitador: limitador.adquirir(1, contar_tokens(PROMPT_ESTRUTURADO + texto))
+            resposta = cliente_openai().chat.completions.create(
+                model=MODELO_LLM, messages=mensagens, temperature=0,
+                response_format={"type": "json_schema", "json_schema": esquema_nota(campos)},
+            )
+            if resposta.usage:
+                metricas.somar_tokens(medicao, resposta.usage.prompt_tokens, resposta.usage.completion_tokens, MODELO_LLM)
+            conteudo = resposta.choices[0].message.content
+            dados.update(json.loads(conteudo))
+
+            erros = validar_campos(dados)
+            if not erros: break
+            campos = list(erros)
+            mensagens += [
+                {"role": "assistant", "content": conteudo},
+                {"role": "user", "content": PROMPT_CORRECAO.format(erros="\n".join(f"- {c}: {m}" for c, m in erros.items()))},
+            ]
+
+    # O que continuar inválido depois das tentativas fica zerado, como no modo Crew
+    for campo in validar_campos(dados):
+        dados[campo] = 0.0 if campo in CAMPOS_VALOR else ""
+    return dados
+
+
+def reextrair_campos(nome, conteudo, dados, erros, limitador=None, orcamento_tokens=ORCAMENTO_TOKENS):
+    """Pede de novo ao LLM só os campos de `erros` ({campo: motivo}) de uma nota já extraída.
+
+    Usada pela fila de reextração (validacao.py): uma chamada estruturada com o texto do PDF e a lista
+    de campos reprovados. A nota corrigida substitui a entrada do cache de extração.
+    """
+    with metricas.medir('reextracao', arquivo=nome) as medicao:
+        paginas = leitura_pdf.ler_paginas(conteudo, nome)
+        texto, _, _ = compactacao.compactar(paginas, orcamento_tokens, nome)
+        lista = "\n".join(f"- {c}: {m} (lido: {dados.get(c)!r})" for c, m in erros.items())
+        mensagens = [
+            {"role": "system", "content": PROMPT_ESTRUTURADO},
+            {"role": "user", "content": texto},
+            {"role": "user", "content": PROMPT_CORRECAO.format(erros=lista)},
+        ]
+        if limitador: limitador.adquirir(1, contar_tokens(PROMPT_ESTRUTURADO + texto + lista))
+        resposta = cliente_openai().chat.completions.create(
+            model=MODELO_LLM, messages=mensagens, temperature=0,
+            response_format={"type": "json_schema", "json_schema": esquema_nota(list(erros))},
+        )
+        if resposta.usage:
+            metricas.somar_tokens(medicao, resposta.usage.prompt_tokens, resposta.usage.completion_tokens, MODELO_LLM)
+        dados = {**dados, **json.loads(resposta.choices[0].message.content)}
+    _gravar_cache(cache_extracao.hash_conteudo(conteudo), dados, {'origem': 'reextracao'})
+    return dados
+
+
+# --- CACHE ---
+def _gravar_cache(chave, dados, contexto):
+    cache_extracao.gravar(chave, VERSAO_EXTRACAO,
+                          {**{c: v for c, v in dados.items() if c != 'arquivo_origem'}, CHAVE_CONTEXTO: contexto})
+
+def _serve(contexto, limiar_regras, modo, orcamento_tokens):
+    """A nota do cache vale para estas opções? A versão da extração já confere modelo, prompts e regras.
+
+    Resultado das regras só se a confiança dele passa no limiar atual (senão a IA tem de ser chamada);
+    resultado da IA só no mesmo modo e orçamento de tokens; nota reextraída (corrigida) sempre.
+    """
+    if not contexto: return False
+    if contexto['origem'] == 'regras': return contexto['confianca'] >= limiar_regras
+    if contexto['origem'] == 'llm': return contexto['modo'] == modo and contexto['orcamento_tokens'] == orcamento_tokens
+    return True
+
+
+def extrair_nota(nome, conteudo, limitador=None, estatisticas=None, limiar_regras=LIMIAR_CONFIANCA, modo=MODO_CREW,
+                 orcamento_tokens=ORCAMENTO_TOKENS):
+    """Extrai um único PDF e devolve o dict da nota.
+
+    Ordem: cache (mesmo PDF, mesma versão de extração e resultado válido para estas opções, ver
+    `_serve`) -> leitor por regras -> IA no `modo` escolhido, chamada só quando a confiança do
+    leitor por regras fica abaixo de `limiar_regras`.
+    O texto enviado à IA é compactado para caber em `orcamento_tokens`. PDFs sem camada de
+    texto levantam leitura_pdf.PDFSemTexto antes de qualquer chamada à IA.
+    """
+    with metricas.medir('nota', arquivo=nome) as nota:
+        chave = cache_extracao.hash_conteudo(conteudo)
+        with metricas.medir('cache'):
+            dados = cache_extracao.buscar(chave, VERSAO_EXTRACAO)
+        if dados is not None and not _serve(dados.pop(CHAVE_CONTEXTO, None), limiar_regras, modo, orcamento_tokens):
+            dados = None
+        origem = 'cache'
+
+        if dados is None:
+            try:
+                with metricas.medir('leitura_pdf'):
+                    paginas = leitura_pdf.ler_paginas(conteudo, nome)
+            except leitura_pdf.PDFSemTexto:
+                nota['origem'] = 'sem_texto'
+                if estatisticas: estatisticas.registrar('sem_texto')
+                raise
+            with metricas.medir('regras'):
+                dados, confianca = extrator_regras.extrair("\n".join(paginas))
+            origem = 'regras'
+            contexto = {'origem': origem, 'confianca': confianca}
+            if confianca < limiar_regras:
+                with metricas.medir('compactacao'):
+                    texto, antes, depois = compactacao.compactar(paginas, orcamento_tokens, nome)
+                if estatisticas: estatisticas.registrar_tokens(antes, depois)
+                if modo == MODO_ESTRUTURADO: dados = extrair_estruturado(texto, limitador)
+                else: dados = extrair_com_agentes(texto, limitador)
+                origem = 'llm'
+                contexto = {'origem': origem, 'modo': modo, 'orcamento_tokens': orcamento_tokens}
+            _gravar_cache(chave, dados, contexto)
+
+        nota['origem'] = origem
+        if estatisticas: estatisticas.registrar(origem)
+        # O nome fica fora do cache: o mesmo PDF pode voltar com outro nome
+        dados['arquivo_origem'] = nome
+        return dados
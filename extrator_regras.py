@@ -0,0 +1,285 @@
+"""Leitor determinístico (regex + heurísticas de layout) para DANFE e NFS-e padrão.
+
+Roda antes dos agentes: quando a confiança é alta a nota não passa pelo LLM.
+Devolve o mesmo esquema JSON do agente auditor.
+"""
+import re
+
+from banco import CAMPOS_ITEM_TEXTO, CAMPOS_ITEM_VALOR, CAMPOS_TEXTO, CAMPOS_VALOR
+
+# Confiança mínima para aceitar o resultado sem chamar a IA
+LIMIAR_CONFIANCA = 0.85
+# Teto da confiança do DANFE sem nenhum item lido ou cujos itens não somam o valor total dos produtos
+# (linha da tabela que a regex não reconheceu ou folha faltando): a nota vai para a IA
+CONFIANCA_ITENS_INCOMPLETOS = 0.5
+
+# Incrementar ao mudar as regras abaixo (entra na versão do cache de extração)
+VERSAO_REGRAS = "4"
+
+# --- PADRÕES PRÉ-COMPILADOS ---
+RE_CHAVE = re.compile(r'(?<!\d)((?:\d{4}[ .]?){10}\d{4})(?!\d)')
+RE_CNPJ = re.compile(r'(?<!\d)(\d{2}\.?\d{3}\.?\d{3}/?\d{4}-?\d{2})(?!\d)')
+RE_CPF = re.compile(r'(?<!\d)(\d{3}\.\d{3}\.\d{3}-\d{2})(?!\d)')
+RE_DATA = re.compile(r'(?<!\d)(\d{2})[/.-](\d{2})[/.-](\d{4})(?!\d)')
+RE_MOEDA = re.compile(r'(?<![\d,])(\d{1,3}(?:\.\d{3})*,\d{2}|\d+,\d{2})(?![\d,])')
+RE_NCM = re.compile(r'(?<!\d)(\d{4}\.?\d{2}\.?\d{2})(?!\d)')
+
+RE_DANFE = re.compile(r'DANFE|DOCUMENTO AUXILIAR DA NOTA FISCAL ELETR', re.I)
+RE_NFSE = re.compile(r'NFS-?e|NOTA FISCAL (?:ELETR[ÔO]NICA )?DE SERVI[ÇC]OS?|PRESTADOR DE SERVI[ÇC]OS?', re.I)
+RE_SECAO_TOMADOR = re.compile(r'TOMADOR DE SERVI[ÇC]OS?|TOMADOR|DESTINAT[ÁA]RIO\s*/\s*REMETENTE|DESTINAT[ÁA]RIO', re.I)
+RE_NOME = re.compile(r'(?:NOME\s*/\s*RAZ[ÃA]O\s+SOCIAL|RAZ[ÃA]O\s+SOCIAL(?:\s*/\s*NOME)?|NOME\s*EMPRESARIAL)\s*:?[ \t]*(.*)', re.I)
+RE_RECEBEMOS = re.compile(r'RECEBEMOS\s+DE\s+(.+?)\s+OS\s+PRODUTOS', re.I | re.S)
+RE_EMISSAO = re.compile(r'DATA\s+(?:DE\s+|DA\s+)?EMISS[ÃA]O|EMITIDA\s+EM|EMISS[ÃA]O', re.I)
+RE_NUMERO = re.compile(r'(?:N[ºo°]\.?|N[ÚU]MERO(?:\s+DA\s+NOTA|\s+DA\s+NFS-?e)?)\s*:?\s*(\d[\d.]{0,14})', re.I)
+# Linha da tabela de produtos do DANFE: código, descrição, NCM, CST/CSOSN, CFOP, unidade e os números
+# (quantidade, valor unitário, valor total e, quando impressos, [desconto,] BC ICMS, ICMS, IPI e alíquotas)
+RE_ITEM_DANFE = re.compile(
+    r'^\s*\S+\s+(?P<descricao>.+?)\s+(?P<ncm>\d{8}|\d{4}\.\d{2}\.\d{2})\s+\d{3,4}\s+(?P<cfop>[1-7]\d{3})\s+'
+    r'(?P<unidade>[A-Za-z]{1,6})\s+(?P<numeros>\d[\d.]*,\d+(?:\s+\d[\d.]*,\d+){2,})\s*$'
+)
+RE_DESCRICAO = re.compile(r'DISCRIMINA[ÇC][ÃA]O\s+DOS\s+SERVI[ÇC]OS|DESCRI[ÇC][ÃA]O\s+DO\s+(?:PRODUTO|SERVI[ÇC]O)', re.I)
+
+# Rótulos dos quadros de valores. Os que mapeiam para None só ocupam posição no quadro
+# (ex.: bases de cálculo), para que os valores da linha de baixo caiam na coluna certa.
+ROTULOS_VALOR = [
+    (None, r'BASE\s+DE\s+C[ÁA]LC(?:ULO|\.)?\s+(?:DO\s+)?ICMS\s+(?:S\.?\s*T\.?|SUBST)'),
+    (None, r'BASE\s+DE\s+C[ÁA]LC(?:ULO|\.)?\s+(?:DO\s+)?ICMS'),
+    (None, r'BASE\s+DE\s+C[ÁA]LC(?:ULO|\.)?(?:\s+DO\s+ISS(?:QN)?)?'),
+    (None, r'VALOR\s+DO\s+FRETE'),
+    (None, r'VALOR\s+DO\s+SEGURO'),
+    (None, r'OUTRAS\s+DESPESAS(?:\s+ACESS[ÓO]RIAS)?'),
+    (None, r'AL[ÍI]QUOTA'),
+    ('valor_icms_st', r'VALOR\s+(?:DO\s+)?ICMS\s+(?:S\.?\s*T\.?|SUBST(?:ITUI[ÇC][ÃA]O)?\.?)'),
+    ('valor_icms', r'VALOR\s+(?:DO\s+)?ICMS'),
+    ('valor_ipi', r'VALOR\s+(?:TOTAL\s+)?(?:DO\s+)?IPI'),
+    ('retencao_issqn', r'(?:VALOR\s+(?:DO\s+)?)?ISS(?:QN)?\s+RETIDO|RETEN[ÇC][ÃA]O\s+(?:DO\s+)?ISS(?:QN)?'),
+    ('valor_issqn', r'VALOR\s+(?:DO\s+)?ISS(?:QN)?'),
+    ('valor_desconto', r'(?:VALOR\s+DO\s+)?DESCONTO(?:\s+INCONDICIONADO)?'),
+    ('valor_bruto', r'VALOR\s+TOTAL\s+DOS\s+PRODUTOS|VALOR\s+(?:TOTAL\s+)?DOS\s+SERVI[ÇC]OS|VALOR\s+TOTAL\s+DO\s+SERVI[ÇC]O'),
+    ('valor_liquido', r'VALOR\s+L[ÍI]QUIDO(?:\s+DA\s+NOTA)?|VALOR\s+TOTAL\s+DA\s+NOTA|VALOR\s+TOTAL\s+DA\s+NFS-?e'),
+]
+RE_ROTULOS = re.compile('|'.join(f'(?P<r{i}>{p})' for i, (_, p) in enumerate(ROTULOS_VALOR)), re.I)
+
+# Peso de cada evidência no cálculo da confiança (soma 1.0)
+PESOS_CONFIANCA = {
+    'numero_nota': 0.15,
+    'data_emissao': 0.10,
+    'emissor_cnpj': 0.20,
+    'tomador_cnpj': 0.10,
+    'valor_total': 0.25,
+    'impostos': 0.10,
+    'consistencia': 0.10,
+}
+
+
+# --- UTILITÁRIOS ---
+def _so_digitos(texto):
+    return re.sub(r'\D', '', texto)
+
+def _moeda(texto):
+    return float(texto.replace('.', '').replace(',', '.'))
+
+def cnpj_valido(cnpj):
+    d = _so_digitos(cnpj)
+    if len(d) != 14 or d == d[0] * 14: return False
+    for tamanho in (12, 13):
+        pesos = list(range(tamanho - 7, 1, -1)) + list(range(9, 1, -1))
+        soma = sum(int(n) * p for n, p in zip(d[:tamanho], pesos))
+        dv = 0 if soma % 11 < 2 else 11 - soma % 11
+        if int(d[tamanho]) != dv: return False
+    return True
+
+def _formatar_cnpj(d):
+    return f"{d[:2]}.{d[2:5]}.{d[5:8]}/{d[8:12]}-{d[12:]}"
+
+def _limpar_nome(texto):
+    nome = RE_CNPJ.split(texto)[0]
+    nome = re.split(r'\s{2,}|CNPJ|CPF|ENDERE[ÇC]O|INSCRI[ÇC][ÃA]O', nome, flags=re.I)[0]
+    return nome.strip(' :-|')
+
+
+# --- QUADROS DE VALORES ---
+def _ler_valores(linhas):
+    """Lê os quadros de totais/impostos.
+
+    Primeiro procura o valor na própria linha do rótulo (layout "Rótulo: 1.234,56"); se a linha
+    só tiver rótulos, usa a linha seguinte e casa os valores por posição (layout em caixas do DANFE).
+    """
+    valores = {}
+    for i, linha in enumerate(linhas):
+        rotulos = []
+        for m in RE_ROTULOS.finditer(linha):
+            indice = int(m.lastgroup[1:])
+            rotulos.append((m.start(), m.end(), ROTULOS_VALOR[indice][0]))
+        if not rotulos: continue
+
+        em_linha = False
+        for j, (_, fim, campo) in enumerate(rotulos):
+            limite = rotulos[j + 1][0] if j + 1 < len(rotulos) else len(linha)
+            m = RE_MOEDA.search(linha, fim, limite)
+            if m:
+                em_linha = True
+                if campo and campo not in valores: valores[campo] = _moeda(m.group(1))
+
+        if em_linha: continue
+        proxima = next((l for l in linhas[i + 1:i + 3] if l.strip()), "")
+        numeros = RE_MOEDA.findall(proxima)
+        if len(numeros) == len(rotulos):
+            for (_, _, campo), numero in zip(rotulos, numeros):
+                if campo and campo not in valores: valores[campo] = _moeda(numero)
+        elif len(rotulos) == 1 and numeros and rotulos[0][2] and rotulos[0][2] not in valores:
+            valores[rotulos[0][2]] = _moeda(numeros[0])
+    return valores
+
+
+# --- ITENS (DANFE) ---
+def _ler_itens(linhas):
+    """Itens da tabela de produtos; só entram linhas em que quantidade x valor unitário bate com o total."""
+    itens = []
+    for linha in linhas:
+        m = RE_ITEM_DANFE.match(linha)
+        if not m: continue
+        numeros = [_moeda(n) for n in m.group('numeros').split()]
+        quantidade, unitario, total = numeros[:3]
+        if abs(quantidade * unitario - total) > max(0.01 * total, 0.05): continue
+        item = {c: "" for c in CAMPOS_ITEM_TEXTO}
+        item.update({c: 0.0 for c in CAMPOS_ITEM_VALOR})
+        item.update(descricao=m.group('descricao').strip()[:200], codigo_ncm=_so_digitos(m.group('ncm')),
+                    cfop=m.group('cfop'), unidade=m.group('unidade').upper(),
+                    quantidade=quantidade, valor_unitario=unitario, valor_total=total)
+        impostos = numeros[3:]
+        if len(impostos) >= 5:
+            item['valor_icms'], item['valor_ipi'] = impostos[-4], impostos[-3]
+            if len(impostos) == 6: item['valor_desconto'] = impostos[0]
+        itens.append(item)
+    return itens
+
+
+# --- EXTRAÇÃO ---
+def extrair(texto):
+    """Extrai uma nota do texto do PDF. Devolve (dados, confianca entre 0 e 1)."""
+    dados = {c: "" for c in CAMPOS_TEXTO}
+    dados.update({c: 0.0 for c in CAMPOS_VALOR})
+    dados['itens'] = []
+    if not texto or not texto.strip(): return dados, 0.0
+
+    linhas = texto.splitlines()
+    eh_danfe = bool(RE_DANFE.search(texto))
+    eh_nfse = not eh_danfe and bool(RE_NFSE.search(texto))
+    evidencias = set()
+
+    # Chave de acesso (DANFE): traz CNPJ do emitente e número da nota
+    chave = None
+    for m in RE_CHAVE.finditer(texto):
+        digitos = _so_digitos(m.group(1))
+        if cnpj_valido(digitos[6:20]):
+            chave = digitos
+            break
+    if chave:
+        dados['emissor_cnpj'] = _formatar_cnpj(chave[6:20])
+        dados['numero_nota'] = str(int(chave[25:34]))
+        evidencias.update({'numero_nota', 'emissor_cnpj'})
+
+    # Seções emissor x tomador
+    m_tomador = RE_SECAO_TOMADOR.search(texto)
+    corte = m_tomador.start() if m_tomador else len(texto)
+    secao_emissor, secao_tomador = texto[:corte], texto[corte:]
+
+    if not dados['emissor_cnpj']:
+        for m in RE_CNPJ.finditer(secao_emissor):
+            if cnpj_valido(m.group(1)):
+                dados['emissor_cnpj'] = _formatar_cnpj(_so_digitos(m.group(1)))
+                evidencias.add('emissor_cnpj')
+                break
+
+    for m in RE_CNPJ.finditer(secao_tomador):
+        d = _so_digitos(m.group(1))
+        if cnpj_valido(d) and _formatar_cnpj(d) != dados['emissor_cnpj']:
+            dados['tomador_cnpj'] = _formatar_cnpj(d)
+            evidencias.add('tomador_cnpj')
+            break
+    else:
+        m = RE_CPF.search(secao_tomador)
+        if m:
+            dados['tomador_cnpj'] = m.group(1)
+            evidencias.add('tomador_cnpj')
+
+    # Nomes
+    m = RE_RECEBEMOS.search(texto)
+    if m: dados['emissor_nome'] = _limpar_nome(' '.join(m.group(1).split()))
+    for campo, secao in (('emissor_nome', secao_emissor), ('tomador_nome', secao_tomador)):
+        if dados[campo]: continue
+        secao_linhas = secao.splitlines()
+        for i, linha in enumerate(secao_linhas):
+            m = RE_NOME.search(linha)
+            if not m: continue
+            nome = _limpar_nome(m.group(1))
+            if not nome and i + 1 < len(secao_linhas): nome = _limpar_nome(secao_linhas[i + 1])
+            if nome:
+                dados[campo] = nome
+                break
+
+    # Número da nota (NFS-e ou DANFE sem chave legível)
+    if not dados['numero_nota']:
+        m = RE_NUMERO.search(texto)
+        if m:
+            dados['numero_nota'] = str(int(_so_digitos(m.group(1)) or 0))
+            evidencias.add('numero_nota')
+
+    # Data de emissão: a primeira data depois do rótulo; senão a primeira do documento
+    m_rotulo = RE_EMISSAO.search(texto)
+    m_data = RE_DATA.search(texto, m_rotulo.end()) if m_rotulo else None
+    if m_data is None or (m_rotulo and m_data.start() - m_rotulo.end() > 120):
+        m_data = RE_DATA.search(texto)
+    if m_data:
+        dia, mes, ano = m_data.groups()
+        if 1 <= int(dia) <= 31 and 1 <= int(mes) <= 12:
+            dados['data_emissao'] = f"{dia}/{mes}/{ano}"
+            evidencias.add('data_emissao')
+
+    # Descrição e NCM
+    m = RE_DESCRICAO.search(texto)
+    if m:
+        depois = texto[m.end():].splitlines()
+        # No DANFE o rótulo é cabeçalho de tabela: o resto da linha são outras colunas
+        if depois and re.search(r'NCM|CFOP|QUANT|UNID|VALOR', depois[0], re.I): depois = depois[1:]
+        depois = [l.strip(' :-') for l in depois if l.strip(' :-')]
+        if depois: dados['descricao_item'] = depois[0][:200]
+    m = re.search(r'NCM', texto, re.I)
+    if m:
+        m_ncm = RE_NCM.search(texto, m.end())
+        if m_ncm: dados['codigo_ncm'] = _so_digitos(m_ncm.group(1))
+    if eh_danfe:
+        dados['itens'] = _ler_itens(linhas)
+        if dados['itens'] and not dados['codigo_ncm']: dados['codigo_ncm'] = dados['itens'][0]['codigo_ncm']
+
+    # Valores
+    dados.update(_ler_valores(linhas))
+    if dados['valor_bruto'] == 0.0: dados['valor_bruto'] = dados['valor_liquido']
+    if dados['valor_liquido'] == 0.0 and dados['valor_bruto']:
+        dados['valor_liquido'] = round(dados['valor_bruto'] - dados['valor_desconto'] - dados['retencao_issqn'], 2)
+    if dados['valor_bruto'] > 0: evidencias.add('valor_total')
+
+    if eh_danfe and (dados['valor_icms'] or dados['valor_ipi'] or 'ICMS' in texto.upper()):
+        evidencias.add('impostos')
+    elif eh_nfse and (dados['valor_issqn'] or re.search(r'\bISS', texto, re.I)):
+        evidencias.add('impostos')
+
+    # Consistência: líquido não passa do bruto e o tipo de documento foi reconhecido
+    if (eh_danfe or eh_nfse) and 0 < dados['valor_liquido'] <= dados['valor_bruto'] + dados['valor_ipi'] + dados['valor_icms_st'] + 0.01:
+        evidencias.add('consistencia')
+
+    # NFS-e traz um único serviço: vira um item, como na importação do XML (ingestao_xml) e na resposta do LLM
+    if eh_nfse:
+        item = {c: "" for c in CAMPOS_ITEM_TEXTO}
+        item.update({c: 0.0 for c in CAMPOS_ITEM_VALOR})
+        item.update(descricao=dados['descricao_item'], quantidade=1.0, valor_unitario=dados['valor_bruto'],
+                    valor_total=dados['valor_bruto'], valor_desconto=dados['valor_desconto'],
+                    valor_issqn=dados['valor_issqn'])
+        dados['itens'] = [item]
+
+    confianca = round(sum(PESOS_CONFIANCA[e] for e in evidencias), 2)
+    soma_itens = sum(item['valor_total'] for item in dados['itens'])
+    if eh_danfe and (not dados['itens'] or abs(soma_itens - dados['valor_bruto']) > max(0.01 * dados['valor_bruto'], 0.05)):
+        confianca = min(confianca, CONFIANCA_ITENS_INCOMPLETOS)
+    return dados, confianca
@@ -0,0 +1,197 @@
+"""Fila de extração no SQLite, compartilhada pela interface e pelos processos worker.py.
+
+Cada envio vira um lote com uma tarefa por PDF (pendente -> executando -> concluida | falhou).
+A interface só cria lotes e acompanha o progresso; quem extrai é o worker, em outro processo,
+então fechar a aba ou recarregar a página não interrompe nada. Uma tarefa reservada por um
+worker que morreu volta a ser pendente depois de PRAZO_TAREFA, e as que falham por erro
+passageiro (API, rede) são tentadas de novo até MAX_TENTATIVAS_TAREFA.
+"""
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import zipfile
+
+import pandas as pd
+
+from banco import conexao
+
+PENDENTE = 'pendente'
+EXECUTANDO = 'executando'
+CONCLUIDA = 'concluida'
+FALHOU = 'falhou'
+
+# Tempo (s) que uma tarefa pode ficar 'executando' antes de ser considerada abandonada
+PRAZO_TAREFA = 900
+MAX_TENTATIVAS_TAREFA = 3
+
+# Um worker sem batimento há mais que isso (s) não conta como ativo
+INTERVALO_BATIMENTO = 10
+TOLERANCIA_BATIMENTO = 3 * INTERVALO_BATIMENTO
+
+CAMINHO_WORKER = os.path.join(os.path.dirname(os.path.abspath(__file__)), "worker.py")
+LOG_WORKER = "worker.log"
+# Worker iniciado pela interface encerra sozinho depois desse tempo (s) sem tarefas
+OCIOSO_MAX_AUTOMATICO = 300
+
+
+# --- LOTES ---
+def criar_lote(arquivos, opcoes, descricao=""):
+    """Enfileira os PDFs (iterável de (nome, bytes)) como um lote novo e devolve o id do lote.
+
+    `opcoes` vai para os argumentos de extracao.extrair_nota (modo, limiar_regras, orcamento_tokens).
+    """
+    with conexao() as conn:
+        lote_id = conn.execute("INSERT INTO lotes_extracao (descricao, opcoes, criado_em) VALUES (?, ?, ?)",
+                               (descricao, json.dumps(opcoes), time.time())).lastrowid
+        conn.executemany("INSERT INTO tarefas_extracao (lote_id, arquivo, conteudo) VALUES (?, ?, ?)",
+                         ((lote_id, nome, conteudo) for nome, conteudo in arquivos))
+    return lote_id
+
+def remover_lote(lote_id):
+    with conexao() as conn:
+        conn.execute("DELETE FROM tarefas_extracao WHERE lote_id = ?", (lote_id,))
+        conn.execute("DELETE FROM lotes_extracao WHERE id = ?", (lote_id,))
+
+def pdfs_do_zip(fonte, origem):
+    """Gera (nome, bytes) de cada PDF dentro de um ZIP, um membro por vez."""
+    with zipfile.ZipFile(fonte) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or not info.filename.lower().endswith('.pdf'): continue
+            yield f"{origem}/{info.filename}", zf.read(info)
+
+def progresso(lote_id):
+    """{'total', status..., 'origens': Counter-like dict, 'tokens_antes', 'tokens_depois'} do lote."""
+    with conexao() as conn:
+        linhas = conn.execute('''
+            SELECT status, origem, COUNT(*), COALESCE(SUM(tokens_antes), 0), COALESCE(SUM(tokens_depois), 0)
+            FROM tarefas_extracao WHERE lote_id = ? GROUP BY status, origem
+        ''', (lote_id,)).fetchall()
+    resumo = {PENDENTE: 0, EXECUTANDO: 0, CONCLUIDA: 0, FALHOU: 0, 'total': 0,
+              'origens': {}, 'tokens_antes': 0, 'tokens_depois': 0}
+    for status, origem, quantidade, antes, depois in linhas:
+        resumo[status] += quantidade
+        resumo['total'] += quantidade
+        if origem: resumo['origens'][origem] = resumo['origens'].get(origem, 0) + quantidade
+        resumo['tokens_antes'] += antes
+        resumo['tokens_depois'] += depois
+    return resumo
+
+def falhas(lote_id):
+    with conexao() as conn:
+        return pd.read_sql("SELECT arquivo, tentativas, erro FROM tarefas_extracao WHERE lote_id = ? AND status = ? ORDER BY id",
+                           conn, params=(lote_id, FALHOU))
+
+def repetir_falhas(lote_id):
+    """Devolve à fila as tarefas que falharam no lote (exceto PDFs sem texto). Devolve quantas."""
+    with conexao() as conn:
+        return conn.execute('''
+            UPDATE tarefas_extracao SET status = ?, tentativas = 0, erro = NULL, trabalhador = NULL
+            WHERE lote_id = ? AND status = ? AND conteudo IS NOT NULL AND COALESCE(origem, '') != 'sem_texto'
+        ''', (PENDENTE, lote_id, FALHOU)).rowcount
+
+
+# --- TAREFAS (lado do worker) ---
+def reservar(trabalhador, quantidade):
+    """Marca até `quantidade` tarefas pendentes como do `trabalhador` e as devolve.
+
+    Lista de (id, arquivo, conteudo, opcoes). O BEGIN IMMEDIATE garante que dois workers
+    nunca peguem a mesma tarefa.
+    """
+    with conexao() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        linhas = conn.execute('''
+            SELECT t.id, t.arquivo, t.conteudo, l.opcoes FROM tarefas_extracao t
+            JOIN lotes_extracao l ON l.id = t.lote_id
+            WHERE t.status = ? ORDER BY t.id LIMIT ?
+        ''', (PENDENTE, quantidade)).fetchall()
+        conn.executemany('''
+            UPDATE tarefas_extracao SET status = ?, trabalhador = ?, iniciada_em = ?, tentativas = tentativas + 1
+            WHERE id = ?
+        ''', [(EXECUTANDO, trabalhador, time.time(), linha[0]) for linha in linhas])
+    return [(id_, arquivo, conteudo, json.loads(opcoes)) for id_, arquivo, conteudo, opcoes in linhas]
+
+def concluir(resultados):
+    """Fecha as tarefas gravadas: lista de (id, origem, tokens_antes, tokens_depois). Solta o PDF."""
+    agora = time.time()
+    with conexao() as conn:
+        conn.executemany('''
+            UPDATE tarefas_extracao SET status = ?, origem = ?, tokens_antes = ?, tokens_depois = ?,
+                erro = NULL, conteudo = NULL, concluida_em = ?
+            WHERE id = ?
+        ''', [(CONCLUIDA, origem, antes, depois, agora, id_) for id_, origem, antes, depois in resultados])
+
+def falhar(id_tarefa, erro, definitiva=False, origem=None):
+    """Registra o erro; a tarefa volta a pendente enquanto houver tentativas (e não for `definitiva`)."""
+    with conexao() as conn:
+        conn.execute('''
+            UPDATE tarefas_extracao SET
+                status = CASE WHEN ? OR tentativas >= ? THEN ? ELSE ? END,
+                erro = ?, origem = COALESCE(?, origem), concluida_em = ?
+            WHERE id = ?
+        ''', (definitiva, MAX_TENTATIVAS_TAREFA, FALHOU, PENDENTE, str(erro)[:500], origem, time.time(), id_tarefa))
+
+def recuperar_abandonadas():
+    """Tarefas 'executando' além do PRAZO_TAREFA (worker morreu) voltam para a fila."""
+    with conexao() as conn:
+        conn.execute('''
+            UPDATE tarefas_extracao SET
+                status = CASE WHEN tentativas >= ? THEN ? ELSE ? END,
+                erro = 'worker não concluiu a tarefa no prazo'
+            WHERE status = ? AND iniciada_em < ?
+        ''', (MAX_TENTATIVAS_TAREFA, FALHOU, PENDENTE, EXECUTANDO, time.time() - PRAZO_TAREFA))
+
+def liberar(trabalhador, erro=None):
+    """Devolve à fila o que o `trabalhador` tinha reservado.
+
+    Na saída limpa (ex.: Ctrl+C) a tentativa é devolvida. Se o worker saiu por `erro`, ela conta, e a
+    tarefa que esgotou as tentativas fica como falha: senão um erro que derruba o worker sempre na
+    mesma tarefa o faria cair e voltar sem fim.
+    """
+    with conexao() as conn:
+        if erro is None:
+            conn.execute('''
+                UPDATE tarefas_extracao SET status = ?, tentativas = MAX(tentativas - 1, 0), trabalhador = NULL
+                WHERE status = ? AND trabalhador = ?
+            ''', (PENDENTE, EXECUTANDO, trabalhador))
+        else:
+            conn.execute('''
+                UPDATE tarefas_extracao SET status = CASE WHEN tentativas >= ? THEN ? ELSE ? END,
+                    erro = ?, trabalhador = NULL
+                WHERE status = ? AND trabalhador = ?
+            ''', (MAX_TENTATIVAS_TAREFA, FALHOU, PENDENTE, f"worker encerrado por erro: {erro}"[:500],
+                  EXECUTANDO, trabalhador))
+        conn.execute("DELETE FROM trabalhadores WHERE nome = ?", (trabalhador,))
+
+
+# --- WORKERS ---
+def batimento(trabalhador):
+    with conexao() as conn:
+        conn.execute("INSERT OR REPLACE INTO trabalhadores (nome, pid, visto_em) VALUES (?, ?, ?)",
+                     (trabalhador, os.getpid(), time.time()))
+
+def trabalhadores_ativos():
+    with conexao() as conn:
+        return conn.execute("SELECT COUNT(*) FROM trabalhadores WHERE visto_em > ?",
+                            (time.time() - TOLERANCIA_BATIMENTO,)).fetchone()[0]
+
+_processo = None
+_processo_lock = threading.Lock()
+
+def garantir_trabalhador():
+    """Sobe um worker.py local se nenhum estiver ativo. Devolve True se iniciou um agora.
+
+    O worker iniciado daqui encerra sozinho depois de OCIOSO_MAX_AUTOMATICO sem tarefas.
+    Em produção, workers podem rodar à parte (outros processos ou máquinas com o mesmo banco).
+    """
+    global _processo
+    with _processo_lock:
+        if (_processo is not None and _processo.poll() is None) or trabalhadores_ativos(): return False
+        with open(LOG_WORKER, 'a') as log:
+            _processo = subprocess.Popen(
+                [sys.executable, CAMINHO_WORKER, "executar", "--ocioso-max", str(OCIOSO_MAX_AUTOMATICO)],
+                stdout=log, stderr=subprocess.STDOUT, start_new_session=True,
+            )
+        return True
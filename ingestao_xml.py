@@ -0,0 +1,176 @@
+"""Importação direta de XML de NF-e e NFS-e (ABRASF), soltos ou dentro de ZIP.
+
+O XML é a fonte oficial da nota: os campos vão direto para as colunas de `notas_fiscais`
+(e cada `det` da NF-e para `itens_nota`), sem LLM e sem extração de texto. A leitura é em streaming (iterparse), nota a nota, então
+arquivos e ZIPs grandes não são carregados inteiros na memória.
+"""
+import os
+import zipfile
+import xml.etree.ElementTree as ET
+
+from banco import CAMPOS_RETENCAO, CAMPOS_TEXTO, CAMPOS_VALOR
+
+# Elementos que delimitam uma nota em cada layout
+TAG_NFE = 'infNFe'
+TAG_NFSE = 'InfNfse'
+
+# Notas acumuladas antes de cada gravação no banco durante a importação
+TAMANHO_BLOCO = 1000
+
+
+# --- UTILITÁRIOS ---
+def _local(tag):
+    return tag.rpartition('}')[2]
+
+def _texto(elem, *caminhos):
+    """Primeiro caminho (relativo ao elemento, sem namespace) que tiver texto."""
+    for caminho in caminhos:
+        valor = elem.findtext(caminho)
+        if valor and valor.strip(): return valor.strip()
+    return ""
+
+def _valor(elem, *caminhos):
+    texto = _texto(elem, *caminhos)
+    try:
+        return float(texto) if texto else 0.0
+    except ValueError:
+        return 0.0
+
+def _data_br(texto):
+    """'2024-01-15T10:00:00-03:00' ou '2024-01-15' -> '15/01/2024'."""
+    if len(texto) >= 10 and texto[4] == '-' and texto[7] == '-':
+        return f"{texto[8:10]}/{texto[5:7]}/{texto[:4]}"
+    return texto
+
+def _nota_vazia(origem):
+    nota = {c: "" for c in CAMPOS_TEXTO}
+    nota.update({c: 0.0 for c in CAMPOS_VALOR})
+    nota['arquivo_origem'] = origem
+    return nota
+
+def _retencoes(elem, grupo, tags):
+    """Retenções federais (CAMPOS_RETENCAO, na ordem de `tags`) diferentes de zero: vão para os extras da nota."""
+    valores = {campo: _valor(elem, f'{grupo}/{tag}') for campo, tag in zip(CAMPOS_RETENCAO, tags)}
+    return {campo: valor for campo, valor in valores.items() if valor}
+
+def _item_nfe(det):
+    # O grupo do ICMS muda com a tributação (ICMS00, ICMS10, ICMSSN102...): '*' pega qualquer um
+    return {
+        'descricao': _texto(det, 'prod/xProd'),
+        'codigo_ncm': _texto(det, 'prod/NCM'),
+        'cfop': _texto(det, 'prod/CFOP'),
+        'unidade': _texto(det, 'prod/uCom'),
+        'quantidade': _valor(det, 'prod/qCom'),
+        'valor_unitario': _valor(det, 'prod/vUnCom'),
+        'valor_total': _valor(det, 'prod/vProd'),
+        'valor_desconto': _valor(det, 'prod/vDesc'),
+        'valor_icms': _valor(det, 'imposto/ICMS/*/vICMS'),
+        'valor_ipi': _valor(det, 'imposto/IPI/IPITrib/vIPI'),
+        'valor_icms_st': _valor(det, 'imposto/ICMS/*/vICMSST'),
+        'valor_issqn': _valor(det, 'imposto/ISSQN/vISSQN'),
+    }
+
+
+# --- MAPEAMENTO DOS LAYOUTS ---
+def _mapear_nfe(inf, origem):
+    nota = _nota_vazia(origem)
+    nota['numero_nota'] = _texto(inf, 'ide/nNF')
+    nota['data_emissao'] = _data_br(_texto(inf, 'ide/dhEmi', 'ide/dEmi'))
+    nota['emissor_nome'] = _texto(inf, 'emit/xNome')
+    nota['emissor_cnpj'] = _texto(inf, 'emit/CNPJ', 'emit/CPF')
+    nota['tomador_nome'] = _texto(inf, 'dest/xNome')
+    nota['tomador_cnpj'] = _texto(inf, 'dest/CNPJ', 'dest/CPF', 'dest/idEstrangeiro')
+    nota['descricao_item'] = _texto(inf, 'det/prod/xProd')
+    nota['codigo_ncm'] = _texto(inf, 'det/prod/NCM')
+
+    nota['valor_bruto'] = _valor(inf, 'total/ICMSTot/vProd')
+    nota['valor_desconto'] = _valor(inf, 'total/ICMSTot/vDesc')
+    nota['valor_liquido'] = _valor(inf, 'total/ICMSTot/vNF')
+    nota['valor_icms'] = _valor(inf, 'total/ICMSTot/vICMS')
+    nota['valor_ipi'] = _valor(inf, 'total/ICMSTot/vIPI')
+    nota['valor_icms_st'] = _valor(inf, 'total/ICMSTot/vST')
+    # NF-e conjugada (produtos + serviços)
+    nota['valor_issqn'] = _valor(inf, 'total/ISSQNtot/vISS')
+    nota['retencao_issqn'] = _valor(inf, 'total/ISSQNtot/vISSRet', 'total/retTrib/vRetISS')
+    nota.update(_retencoes(inf, 'total/retTrib', ('vRetPIS', 'vRetCOFINS', 'vRetCSLL', 'vIRRF', 'vRetPrev')))
+    nota['itens'] = [_item_nfe(det) for det in inf.findall('det')]
+    return nota
+
+def _mapear_nfse(inf, origem):
+    """ABRASF 1.x (Servico/Prestador direto em InfNfse) e 2.x (dentro de DeclaracaoPrestacaoServico)."""
+    decl = inf.find('DeclaracaoPrestacaoServico/InfDeclaracaoPrestacaoServico')
+    base = decl if decl is not None else inf
+
+    nota = _nota_vazia(origem)
+    nota['numero_nota'] = _texto(inf, 'Numero')
+    nota['data_emissao'] = _data_br(_texto(inf, 'DataEmissao'))
+    nota['emissor_nome'] = _texto(inf, 'PrestadorServico/RazaoSocial', 'PrestadorServico/NomeFantasia')
+    nota['emissor_cnpj'] = _texto(
+        inf, 'PrestadorServico/IdentificacaoPrestador/CpfCnpj/Cnpj', 'PrestadorServico/IdentificacaoPrestador/Cnpj',
+        'PrestadorServico/IdentificacaoPrestador/CpfCnpj/Cpf'
+    ) or _texto(base, 'Prestador/CpfCnpj/Cnpj', 'Prestador/Cnpj', 'Prestador/CpfCnpj/Cpf')
+    nota['tomador_nome'] = _texto(base, 'TomadorServico/RazaoSocial', 'Tomador/RazaoSocial')
+    nota['tomador_cnpj'] = _texto(
+        base, 'TomadorServico/IdentificacaoTomador/CpfCnpj/Cnpj', 'TomadorServico/IdentificacaoTomador/CpfCnpj/Cpf',
+        'Tomador/IdentificacaoTomador/CpfCnpj/Cnpj', 'Tomador/IdentificacaoTomador/CpfCnpj/Cpf'
+    )
+    nota['descricao_item'] = _texto(base, 'Servico/Discriminacao')
+
+    nota['valor_bruto'] = _valor(base, 'Servico/Valores/ValorServicos')
+    nota['valor_desconto'] = _valor(base, 'Servico/Valores/DescontoIncondicionado')
+    nota['valor_issqn'] = _valor(base, 'Servico/Valores/ValorIss') or _valor(inf, 'ValoresNfse/ValorIss')
+    nota['retencao_issqn'] = _valor(base, 'Servico/Valores/ValorIssRetido')
+    if not nota['retencao_issqn'] and _texto(base, 'Servico/IssRetido') == '1':
+        nota['retencao_issqn'] = nota['valor_issqn']
+    nota.update(_retencoes(base, 'Servico/Valores', ('ValorPis', 'ValorCofins', 'ValorCsll', 'ValorIr', 'ValorInss')))
+    retido = nota['retencao_issqn'] + sum(nota.get(c, 0.0) for c in CAMPOS_RETENCAO)
+    nota['valor_liquido'] = (_valor(inf, 'ValoresNfse/ValorLiquidoNfse') or _valor(base, 'Servico/Valores/ValorLiquidoNfse')
+                             or round(nota['valor_bruto'] - nota['valor_desconto'] - retido, 2))
+    # ABRASF traz um único serviço por NFS-e
+    nota['itens'] = [{
+        'descricao': nota['descricao_item'], 'codigo_ncm': "", 'cfop': "", 'unidade': "",
+        'quantidade': 1.0, 'valor_unitario': nota['valor_bruto'], 'valor_total': nota['valor_bruto'],
+        'valor_desconto': nota['valor_desconto'], 'valor_icms': 0.0, 'valor_ipi': 0.0, 'valor_icms_st': 0.0,
+        'valor_issqn': nota['valor_issqn'],
+    }]
+    return nota
+
+
+# --- LEITURA EM STREAMING ---
+def ler_xml(fonte, origem):
+    """Gera uma nota (dict) por infNFe/InfNfse encontrado em `fonte` (caminho ou arquivo binário).
+
+    Elementos já processados são descartados durante a leitura para manter a memória constante
+    mesmo em lotes ABRASF com milhares de notas no mesmo arquivo.
+    """
+    pilha = []
+    for evento, elem in ET.iterparse(fonte, events=('start', 'end')):
+        if evento == 'start':
+            pilha.append(elem)
+            continue
+        pilha.pop()
+        elem.tag = _local(elem.tag)
+        if elem.tag == TAG_NFE:
+            yield _mapear_nfe(elem, origem)
+        elif elem.tag == TAG_NFSE:
+            yield _mapear_nfse(elem, origem)
+        else:
+            continue
+        # Nota lida: solta a subárvore e o que os ancestrais ainda guardam dela
+        elem.clear()
+        for ancestral in pilha: del ancestral[:]
+
+def ler_zip(fonte, origem):
+    """Percorre os XMLs de um ZIP membro a membro, descompactando cada um em streaming."""
+    with zipfile.ZipFile(fonte) as zf:
+        for info in zf.infolist():
+            if info.is_dir() or not info.filename.lower().endswith('.xml'): continue
+            with zf.open(info) as membro:
+                yield from ler_xml(membro, f"{origem}/{info.filename}")
+
+def ler_arquivo(fonte, nome):
+    """Despacha por extensão: .zip ou .xml. `fonte` pode ser caminho ou arquivo binário."""
+    if os.path.splitext(nome)[1].lower() == '.zip':
+        yield from ler_zip(fonte, nome)
+    else:
+        yield from ler_xml(fonte, nome)
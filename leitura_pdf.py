@@ -0,0 +1,99 @@
+"""Leitura do texto dos PDFs em um pool de processos.
+
+A extração de texto do PyPDF2 é CPU-bound: rodando em processos ela não disputa o GIL com a
+interface nem com as threads do lote. Cada PDF é lido em blocos de páginas distribuídos pelo
+pool, e a leitura para assim que o cabeçalho fiscal e os totais já apareceram; o DANFE é lido
+até a última folha, porque a tabela de itens continua nas folhas seguintes à dos totais.
+PDFs sem camada de texto (imagem/digitalizado) são sinalizados logo no primeiro bloco.
+"""
+import io
+import multiprocessing
+import os
+import re
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from PyPDF2 import PdfReader
+
+from extrator_regras import RE_CHAVE, RE_CNPJ, RE_DANFE, RE_NUMERO, ROTULOS_VALOR
+
+# Páginas por tarefa enviada ao pool e limite de páginas lidas por PDF (exceto DANFE, lido inteiro)
+PAGINAS_POR_TAREFA = 4
+MAX_PAGINAS = 40
+
+# Abaixo disso (caracteres visíveis no primeiro bloco) o PDF é tratado como imagem
+MIN_CARACTERES_TEXTO = 30
+
+MAX_PROCESSOS = max(1, (os.cpu_count() or 2) - 1)
+
+_rotulos = dict(ROTULOS_VALOR)
+RE_TOTAIS = re.compile(f"{_rotulos['valor_liquido']}|{_rotulos['valor_bruto']}", re.I)
+
+
+class PDFSemTexto(Exception):
+    """PDF sem camada de texto (escaneado ou só imagens): não há o que enviar à IA."""
+
+    def __init__(self, nome=""):
+        super().__init__(f"{nome or 'PDF'} não tem camada de texto (imagem/digitalizado); precisa de OCR.")
+
+
+# --- POOL DE PROCESSOS ---
+_pool = None
+_pool_lock = threading.Lock()
+
+def pool_processos():
+    """Pool único por processo, criado no primeiro uso.
+
+    Usa 'spawn' porque o pool é alimentado pelas threads do lote, e fork com threads ativas
+    pode herdar locks presos.
+    """
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=MAX_PROCESSOS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+# --- LEITURA ---
+def _ler_intervalo(conteudo, inicio, fim):
+    """Roda no processo filho: devolve (total_de_paginas, textos das páginas [inicio, fim))."""
+    leitor = PdfReader(io.BytesIO(conteudo))
+    total = len(leitor.pages)
+    return total, [leitor.pages[i].extract_text() or "" for i in range(inicio, min(fim, total))]
+
+def _completo(texto):
+    """Cabeçalho (chave ou CNPJ + número) e totais já encontrados."""
+    cabecalho = RE_CHAVE.search(texto) or (RE_CNPJ.search(texto) and RE_NUMERO.search(texto))
+    return bool(cabecalho and RE_TOTAIS.search(texto))
+
+def ler_paginas(conteudo, nome="", max_paginas=MAX_PAGINAS):
+    """Texto de cada página lida do PDF em `conteudo` (bytes).
+
+    O primeiro bloco é lido antes dos demais: se já trouxer cabeçalho e totais (caso da
+    maioria das notas) o resto do arquivo nem é aberto. Senão, os blocos seguintes até
+    `max_paginas` (mais a última página, onde costumam ficar os totais) vão ao pool em
+    paralelo e são consumidos em ordem, cancelando os que sobrarem ao completar.
+    DANFE não para nem tem limite: os totais ficam na primeira folha e os itens vão até a última.
+
+    Erros de leitura do PDF são propagados; sem texto no primeiro bloco levanta PDFSemTexto.
+    """
+    pool = pool_processos()
+    total, paginas = pool.submit(_ler_intervalo, conteudo, 0, PAGINAS_POR_TAREFA).result()
+    if len(re.sub(r'\s', '', "".join(paginas))) < MIN_CARACTERES_TEXTO:
+        raise PDFSemTexto(nome)
+    texto = "\n".join(paginas)
+    danfe = bool(RE_DANFE.search(texto))
+    if total <= PAGINAS_POR_TAREFA or (not danfe and _completo(texto)):
+        return paginas
+
+    limite = total if danfe else min(total, max_paginas)
+    intervalos = [(i, min(i + PAGINAS_POR_TAREFA, limite)) for i in range(PAGINAS_POR_TAREFA, limite, PAGINAS_POR_TAREFA)]
+    if total > limite: intervalos.append((total - 1, total))
+    futuros = [pool.submit(_ler_intervalo, conteudo, inicio, fim) for inicio, fim in intervalos]
+    try:
+        for futuro in futuros:
+            paginas += futuro.result()[1]
+            if not danfe and _completo("\n".join(paginas)): break
+    finally:
+        for futuro in futuros: futuro.cancel()
+    return paginas
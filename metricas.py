@@ -0,0 +1,249 @@
+"""Instrumentação do pipeline: tempo, tokens, tentativas e falhas por etapa de cada nota.
+
+Cada etapa é medida com `medir(etapa)`; o registro fica num buffer em memória e vai para a tabela
+`metricas_etapas` em lote (a cada TAMANHO_BUFFER registros ou ESPERA_DESCARGA segundos), então o
+custo no caminho quente é um perf_counter e um append. A etapa 'nota' cobre a extração inteira de
+um arquivo e acumula os tokens de todas as chamadas ao LLM feitas dentro dela.
+
+Exportação no formato texto do Prometheus (ex.: para o textfile collector do node_exporter):
+    python metricas.py --arquivo /var/lib/node_exporter/opertix.prom
+"""
+import argparse
+import atexit
+import contextvars
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from banco import conexao, inicializar_banco
+
+# Registros acumulados antes de gravar, e espera máxima (s) de um registro no buffer
+TAMANHO_BUFFER = 200
+ESPERA_DESCARGA = 5
+MAX_DIAS_METRICAS = 30
+
+# Preço em US$ por 1 milhão de tokens (entrada, saída), para o custo por nota
+PRECOS_POR_MILHAO = {
+    'gpt-4o-mini': (0.15, 0.60),
+    'gpt-4o': (2.50, 10.00),
+    'gpt-4.1-mini': (0.40, 1.60),
+    'gpt-4.1': (2.00, 8.00),
+}
+
+# Etapas que não rodam dentro de uma 'nota': somando só elas, o mesmo token não é contado duas vezes
+ETAPAS_RAIZ = ('nota', 'reextracao')
+
+# Ordem das etapas na tela (as demais aparecem depois, em ordem alfabética)
+ETAPAS = ['nota', 'cache', 'leitura_pdf', 'regras', 'compactacao', 'llm_extrator', 'llm_auditor', 'parse_json',
+          'llm_estruturado', 'reextracao', 'validacao', 'gravacao', 'sincronizacao']
+
+_COLUNAS = ['registrado_em', 'etapa', 'arquivo', 'origem', 'modelo', 'duracao', 'notas',
+            'tokens_prompt', 'tokens_resposta', 'tentativas', 'sucesso', 'erro']
+
+# Registro da etapa 'nota' em andamento na thread/contexto atual
+_nota_atual = contextvars.ContextVar('nota_atual', default=None)
+
+
+# --- COLETA ---
+_buffer = []
+_buffer_lock = threading.Lock()
+_ultima_descarga = time.time()
+
+@contextmanager
+def medir(etapa, arquivo=None, notas=1):
+    """Mede o bloco como `etapa`. Devolve o dict do registro para o bloco completar (tokens, origem...).
+
+    Sem `arquivo`, usa o da nota em andamento. Uma exceção no bloco vira registro com sucesso = 0.
+    """
+    nota = _nota_atual.get()
+    registro = {'etapa': etapa, 'arquivo': arquivo or (nota['arquivo'] if nota else None), 'origem': None,
+                'modelo': None, 'notas': notas, 'tokens_prompt': 0, 'tokens_resposta': 0, 'tentativas': 1,
+                'sucesso': 1, 'erro': None}
+    token = _nota_atual.set(registro) if etapa == 'nota' else None
+    inicio = time.perf_counter()
+    try:
+        yield registro
+    except BaseException as e:
+        registro['sucesso'] = 0
+        registro['erro'] = f"{type(e).__name__}: {e}"[:300]
+        raise
+    finally:
+        registro['duracao'] = time.perf_counter() - inicio
+        registro['registrado_em'] = time.time()
+        if token is not None: _nota_atual.reset(token)
+        _registrar(registro)
+
+def registrar(etapa, duracao, erro=None, **campos):
+    """Registro de uma etapa cronometrada por fora de `medir` (ex.: pelos callbacks da Crew)."""
+    nota = _nota_atual.get()
+    registro = {'arquivo': nota['arquivo'] if nota else None, 'origem': None, 'modelo': None, 'notas': 1,
+                'tokens_prompt': 0, 'tokens_resposta': 0, 'tentativas': 1, **campos,
+                'etapa': etapa, 'duracao': duracao, 'registrado_em': time.time(),
+                'sucesso': 0 if erro else 1, 'erro': f"{type(erro).__name__}: {erro}"[:300] if erro else None}
+    _registrar(registro)
+
+def somar_tokens(registro, prompt, resposta, modelo=None):
+    """Soma tokens ao registro da etapa e ao da nota em andamento (que dá o custo por nota)."""
+    for alvo in {id(r): r for r in (registro, _nota_atual.get()) if r is not None}.values():
+        alvo['tokens_prompt'] += prompt or 0
+        alvo['tokens_resposta'] += resposta or 0
+        if modelo: alvo['modelo'] = modelo
+
+def _registrar(registro):
+    with _buffer_lock:
+        _buffer.append(tuple(registro[c] for c in _COLUNAS))
+        cheio = len(_buffer) >= TAMANHO_BUFFER or time.time() - _ultima_descarga >= ESPERA_DESCARGA
+    if cheio: descarregar()
+
+def descarregar():
+    """Grava o buffer no banco. Métrica é só observação: falha ao gravar não interrompe o pipeline."""
+    global _buffer, _ultima_descarga
+    with _buffer_lock:
+        registros, _buffer = _buffer, []
+        _ultima_descarga = time.time()
+    if not registros: return
+    try:
+        with conexao() as conn:
+            conn.executemany(f"INSERT INTO metricas_etapas ({', '.join(_COLUNAS)}) VALUES ({', '.join('?' * len(_COLUNAS))})",
+                             registros)
+    except sqlite3.Error:
+        pass
+
+atexit.register(descarregar)
+
+def limpar_metricas(max_dias=MAX_DIAS_METRICAS):
+    with conexao() as conn:
+        conn.execute("DELETE FROM metricas_etapas WHERE registrado_em < ?", (time.time() - max_dias * 86400,))
+
+
+# --- LEITURA ---
+def carregar(desde):
+    """Registros a partir do instante `desde` (epoch), com data local e custo em US$ por registro."""
+    descarregar()
+    with conexao() as conn:
+        df = pd.read_sql(f"SELECT {', '.join(_COLUNAS)} FROM metricas_etapas WHERE registrado_em >= ?",
+                         conn, params=(desde,))
+    fuso = datetime.now().astimezone().tzinfo
+    df['instante'] = pd.to_datetime(df['registrado_em'], unit='s', utc=True).dt.tz_convert(fuso).dt.tz_localize(None)
+    entrada = df['modelo'].map({m: p[0] for m, p in PRECOS_POR_MILHAO.items()}).fillna(0.0)
+    saida = df['modelo'].map({m: p[1] for m, p in PRECOS_POR_MILHAO.items()}).fillna(0.0)
+    df['custo'] = (df['tokens_prompt'] * entrada + df['tokens_resposta'] * saida) / 1e6
+    return df
+
+def _ordem_etapas(etapas):
+    return sorted(etapas, key=lambda e: (ETAPAS.index(e) if e in ETAPAS else len(ETAPAS), e))
+
+def resumo_etapas(df):
+    """Uma linha por etapa: execuções, p50/p95/média (s), falhas (%), tentativas extras e tokens."""
+    grupo = df.groupby('etapa')
+    resumo = pd.DataFrame({
+        'execucoes': grupo.size(),
+        'p50_s': grupo['duracao'].quantile(0.50),
+        'p95_s': grupo['duracao'].quantile(0.95),
+        'media_s': grupo['duracao'].mean(),
+        'falhas_pct': 100 * (1 - grupo['sucesso'].mean()),
+        'tentativas_extras': grupo['tentativas'].sum() - grupo.size(),
+        'tokens_prompt': grupo['tokens_prompt'].sum(),
+        'tokens_resposta': grupo['tokens_resposta'].sum(),
+    })
+    return resumo.loc[_ordem_etapas(resumo.index)]
+
+def serie_temporal(df, frequencia):
+    """Por intervalo: notas/min, p50/p95 da nota (s) e custo médio por nota (US$), só da etapa 'nota'."""
+    notas = df[df['etapa'] == 'nota'].set_index('instante').sort_index()
+    if notas.empty: return pd.DataFrame(columns=['notas_por_min', 'p50_s', 'p95_s', 'custo_por_nota'])
+    grupo = notas.resample(frequencia)
+    minutos = pd.Timedelta(frequencia).total_seconds() / 60
+    serie = pd.DataFrame({
+        'notas_por_min': grupo['notas'].sum() / minutos,
+        'p50_s': grupo['duracao'].quantile(0.50),
+        'p95_s': grupo['duracao'].quantile(0.95),
+        'custo_por_nota': grupo['custo'].sum() / grupo['notas'].sum().replace(0, np.nan),
+    })
+    return serie
+
+def por_origem(df):
+    notas = df[df['etapa'] == 'nota']
+    return notas.groupby(notas['origem'].fillna('falha'))['notas'].sum().sort_values(ascending=False)
+
+
+# --- PROMETHEUS ---
+def _rotulos(**rotulos):
+    escapar = lambda v: str(v).replace('\\', '\\\\').replace('"', '\\"')
+    return "{" + ",".join(f'{k}="{escapar(v)}"' for k, v in rotulos.items()) + "}"
+
+def _custo(modelo, prompt, resposta):
+    entrada, saida = PRECOS_POR_MILHAO.get(modelo, (0.0, 0.0))
+    return ((prompt or 0) * entrada + (resposta or 0) * saida) / 1e6
+
+def exportar_prometheus(janela=3600):
+    """Texto no formato de exposição do Prometheus.
+
+    Contadores cobrem todo o histórico guardado; os quantis de duração, a última `janela` (s).
+    """
+    descarregar()
+    with conexao() as conn:
+        totais = conn.execute('''
+            SELECT etapa, COUNT(*), SUM(1 - sucesso), SUM(tentativas) - COUNT(*), SUM(notas),
+                   SUM(tokens_prompt), SUM(tokens_resposta), SUM(duracao)
+            FROM metricas_etapas GROUP BY etapa
+        ''').fetchall()
+        por_modelo = conn.execute(f'''
+            SELECT modelo, SUM(tokens_prompt), SUM(tokens_resposta) FROM metricas_etapas
+            WHERE etapa IN ({", ".join("?" * len(ETAPAS_RAIZ))}) GROUP BY modelo
+        ''', ETAPAS_RAIZ).fetchall()
+    recentes = carregar(time.time() - janela)
+
+    contadores = [
+        ('opertix_etapa_execucoes_total', "Execuções de cada etapa do pipeline.", 1),
+        ('opertix_etapa_falhas_total', "Execuções que terminaram em erro.", 2),
+        ('opertix_etapa_tentativas_extras_total', "Novas tentativas além da primeira.", 3),
+        ('opertix_etapa_notas_total', "Notas processadas pela etapa.", 4),
+    ]
+    linhas = []
+    for nome, ajuda, coluna in contadores:
+        linhas += [f"# HELP {nome} {ajuda}", f"# TYPE {nome} counter"]
+        linhas += [f"{nome}{_rotulos(etapa=linha[0])} {linha[coluna]}" for linha in totais]
+
+    linhas += ["# HELP opertix_tokens_total Tokens enviados (prompt) e recebidos (resposta) do LLM.",
+               "# TYPE opertix_tokens_total counter"]
+    for etapa, _, _, _, _, prompt, resposta, _ in totais:
+        if not (prompt or resposta): continue
+        linhas.append(f"opertix_tokens_total{_rotulos(etapa=etapa, tipo='prompt')} {prompt}")
+        linhas.append(f"opertix_tokens_total{_rotulos(etapa=etapa, tipo='resposta')} {resposta}")
+
+    linhas += ["# HELP opertix_custo_dolares_total Custo estimado das chamadas ao LLM em US$.",
+               "# TYPE opertix_custo_dolares_total counter",
+               f"opertix_custo_dolares_total {sum(_custo(*linha) for linha in por_modelo):.6f}"]
+
+    linhas += [f"# HELP opertix_etapa_duracao_segundos Duração por etapa (quantis dos últimos {janela}s).",
+               "# TYPE opertix_etapa_duracao_segundos summary"]
+    for etapa, execucoes, *_, soma in totais:
+        duracoes = recentes.loc[recentes['etapa'] == etapa, 'duracao']
+        for q in (0.5, 0.95, 0.99):
+            valor = duracoes.quantile(q) if len(duracoes) else float('nan')
+            linhas.append(f"opertix_etapa_duracao_segundos{_rotulos(etapa=etapa, quantile=q)} {valor:.6f}")
+        linhas.append(f"opertix_etapa_duracao_segundos_sum{_rotulos(etapa=etapa)} {soma:.6f}")
+        linhas.append(f"opertix_etapa_duracao_segundos_count{_rotulos(etapa=etapa)} {execucoes}")
+    return "\n".join(linhas) + "\n"
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Exporta as métricas do pipeline no formato do Prometheus.")
+    parser.add_argument("--arquivo", help="grava no arquivo (atomicamente) em vez de imprimir")
+    parser.add_argument("--janela", type=int, default=3600, help="segundos considerados nos quantis de duração")
+    args = parser.parse_args()
+
+    inicializar_banco()
+    texto = exportar_prometheus(args.janela)
+    if args.arquivo:
+        temporario = args.arquivo + ".tmp"
+        with open(temporario, 'w', encoding='utf-8') as f: f.write(texto)
+        os.replace(temporario, args.arquivo)
+    else:
+        print(texto, end="")
@@ -0,0 +1,193 @@
+"""Relatório Executivo em PDF, gerado sob demanda em segundo plano.
+
+O PDF cobre todas as notas do filtro: resumo, totais por fornecedor e por mês (agregados no
+SQLite) e o detalhamento nota a nota, lido em lotes direto do banco e paginado. Cada pedido
+fica guardado pela versão dos dados + filtros, então clicar de novo sem dados novos reaproveita
+o arquivo pronto (ou a geração em andamento).
+"""
+import io
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.pdfgen import canvas
+
+import consultas
+
+# Relatórios prontos mantidos em memória (os mais antigos saem primeiro)
+MAX_RELATORIOS_CACHE = 8
+
+COLUNAS_DETALHE = ['data_emissao', 'numero_nota', 'emissor_nome', 'valor_icms', 'valor_issqn', 'valor_bruto']
+
+
+# --- PAGINAÇÃO ---
+class _Documento:
+    """Canvas com controle de altura: quebra a página e repete o cabeçalho da tabela quando precisa."""
+
+    MARGEM_TOPO = 50
+    MARGEM_RODAPE = 50
+
+    def __init__(self, buffer):
+        self.c = canvas.Canvas(buffer, pagesize=letter)
+        self.largura, self.altura = letter
+        self.pagina = 1
+        self.y = self.altura - self.MARGEM_TOPO
+        self.cabecalho_tabela = None  # [(x, título)] da tabela atual, repetido em páginas novas
+
+    def rodape(self):
+        self.c.setFont("Helvetica-Oblique", 8)
+        self.c.setFillColor(colors.black)
+        self.c.drawString(40, 30, f"Gerado automaticamente em {datetime.now().strftime('%d/%m/%Y')}")
+        self.c.drawRightString(self.largura - 40, 30, f"Página {self.pagina}")
+
+    def nova_pagina(self):
+        self.rodape()
+        self.c.showPage()
+        self.pagina += 1
+        self.y = self.altura - self.MARGEM_TOPO
+        if self.cabecalho_tabela: self._desenhar_cabecalho_tabela()
+
+    def espaco(self, altura):
+        if self.y - altura < self.MARGEM_RODAPE: self.nova_pagina()
+
+    def titulo(self, texto):
+        self.cabecalho_tabela = None
+        self.espaco(60)
+        self.c.setFillColor(colors.black)
+        self.c.setFont("Helvetica-Bold", 16)
+        self.c.drawString(40, self.y, texto)
+        self.y -= 30
+
+    def texto(self, texto, fonte="Helvetica", tamanho=12, altura=20):
+        self.espaco(altura)
+        self.c.setFont(fonte, tamanho)
+        self.c.drawString(40, self.y, texto)
+        self.y -= altura
+
+    def iniciar_tabela(self, colunas):
+        """`colunas`: lista de (x, título). Títulos à direita (valores) começam com '>'."""
+        self.cabecalho_tabela = colunas
+        self.espaco(30)
+        self._desenhar_cabecalho_tabela()
+
+    def _desenhar_cabecalho_tabela(self):
+        self.c.setFont("Helvetica-Bold", 9)
+        self._celulas([titulo.lstrip('>') for _, titulo in self.cabecalho_tabela])
+        self.y -= 15
+        self.c.setFont("Helvetica", 8)
+
+    def linha_tabela(self, valores):
+        self.espaco(12)
+        self.c.setFont("Helvetica", 8)
+        self._celulas(valores)
+        self.y -= 12
+
+    def _celulas(self, valores):
+        for (x, titulo), valor in zip(self.cabecalho_tabela, valores):
+            valor = str(valor)
+            if titulo.startswith('>'):
+                self.c.drawRightString(x, self.y, valor)
+            else:
+                self.c.drawString(x, self.y, valor)
+
+    def separador(self):
+        self.espaco(40)
+        self.y -= 10
+        self.c.setStrokeColor(colors.gray)
+        self.c.line(40, self.y, self.largura - 40, self.y)
+        self.y -= 30
+
+    def salvar(self):
+        self.rodape()
+        self.c.showPage()
+        self.c.save()
+
+
+def _moeda(valor):
+    return f"R$ {valor or 0:,.2f}"
+
+
+# --- GERAÇÃO ---
+def gerar_relatorio_pdf(filtros=None):
+    """Monta o PDF completo das notas do filtro e devolve os bytes."""
+    buffer = io.BytesIO()
+    doc = _Documento(buffer)
+    c = doc.c
+
+    # Cabeçalho
+    c.setFillColor(colors.darkblue)
+    c.rect(0, doc.altura - 100, doc.largura, 100, fill=True, stroke=False)
+    c.setFillColor(colors.white)
+    c.setFont("Helvetica-Bold", 28)
+    c.drawString(40, doc.altura - 60, "OPERTIX")
+    c.setFont("Helvetica", 14)
+    c.drawString(40, doc.altura - 85, "Relatório de Auditoria Fiscal & Financeira")
+    doc.y = doc.altura - 150
+
+    # 1. Resumo
+    totais = consultas.totais(filtros)
+    doc.titulo("1. Resumo do Período")
+    doc.texto(f"• Notas no relatório: {totais['quantidade']:,}")
+    doc.texto(f"• Total Processado: {_moeda(totais['valor_bruto'])}")
+    doc.texto(f"• Total Líquido a Pagar: {_moeda(totais['valor_liquido'])}")
+    doc.texto(f"• Total ICMS (Produtos): {_moeda(totais['valor_icms'])}")
+    doc.texto(f"• Total ISSQN (Serviços): {_moeda(totais['valor_issqn'])}")
+    doc.separador()
+
+    # 2. Por fornecedor
+    doc.titulo("2. Totais por Fornecedor")
+    doc.iniciar_tabela([(40, "FORNECEDOR"), (330, ">NOTAS"), (420, ">ICMS"), (490, ">ISSQN"), (570, ">VALOR BRUTO")])
+    por_fornecedor = consultas.totais_por_fornecedor(filtros)
+    for fornecedor, qtd, icms, iss, bruto in zip(por_fornecedor['fornecedor'], por_fornecedor['quantidade'],
+                                                 por_fornecedor['valor_icms'], por_fornecedor['valor_issqn'],
+                                                 por_fornecedor['valor_bruto']):
+        doc.linha_tabela([str(fornecedor)[:55], qtd, _moeda(icms), _moeda(iss), _moeda(bruto)])
+    doc.separador()
+
+    # 3. Por mês
+    doc.titulo("3. Totais por Mês de Emissão")
+    doc.iniciar_tabela([(40, "MÊS"), (200, ">NOTAS"), (320, ">ICMS"), (440, ">ISSQN"), (570, ">VALOR BRUTO")])
+    por_mes = consultas.totais_por_mes(filtros)
+    for mes, qtd, icms, iss, bruto in zip(por_mes['mes'], por_mes['quantidade'], por_mes['valor_icms'],
+                                         por_mes['valor_issqn'], por_mes['valor_bruto']):
+        doc.linha_tabela([mes, qtd, _moeda(icms), _moeda(iss), _moeda(bruto)])
+    doc.separador()
+
+    # 4. Detalhamento: todas as notas, lidas em lotes
+    doc.titulo("4. Detalhamento por Nota")
+    doc.iniciar_tabela([(40, "DATA"), (110, "NÚMERO"), (180, "EMISSOR"), (400, "TIPO"), (570, ">VALOR")])
+    for lote in consultas.lotes_notas(COLUNAS_DETALHE, filtros, ordem="data_emissao_iso, id"):
+        for data, numero, emissor, icms, iss, bruto in lote:
+            tipo = "Produto" if (icms or 0) > 0 else "Serviço"
+            doc.linha_tabela([str(data or '')[:10], str(numero or '')[:12], str(emissor or '')[:40], tipo, _moeda(bruto)])
+
+    doc.salvar()
+    return buffer.getvalue()
+
+
+# --- EXECUÇÃO EM SEGUNDO PLANO ---
+_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="relatorio")
+_pedidos = OrderedDict()  # (versão dos dados, filtros) -> Future com os bytes do PDF
+_pedidos_lock = threading.Lock()
+
+def _chave(versao, filtros):
+    return versao, tuple(sorted((k, v) for k, v in (filtros or {}).items() if v not in (None, '')))
+
+def solicitar_relatorio(versao, filtros=None):
+    """Devolve o Future do relatório para (versão, filtros), disparando a geração se ainda não houver.
+
+    Um pedido que terminou com erro é refeito na próxima solicitação.
+    """
+    chave = _chave(versao, filtros)
+    with _pedidos_lock:
+        futuro = _pedidos.get(chave)
+        if futuro is None or (futuro.done() and futuro.exception() is not None):
+            futuro = _executor.submit(gerar_relatorio_pdf, filtros)
+            _pedidos[chave] = futuro
+        _pedidos.move_to_end(chave)
+        while len(_pedidos) > MAX_RELATORIOS_CACHE:
+            _pedidos.popitem(last=False)
+        return futuro
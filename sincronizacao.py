@@ -0,0 +1,172 @@
+"""Backup das notas no Google Sheets em segundo plano (outbox).
+
+Toda nota gravada no SQLite entra como pendente em `fila_nuvem` (triggers em banco.py, na mesma
+transação da gravação), então salvar não espera a nuvem. Uma thread por processo envia as
+pendentes em lotes: `append_rows` para notas novas e `batch_update` por intervalo para as já
+enviadas que mudaram. Falhas da API esperam com backoff exponencial; como o estado fica no
+banco, o envio retoma de onde parou depois de um erro ou de reiniciar o app.
+"""
+import logging
+import os
+import re
+import threading
+import time
+
+import metricas
+from banco import COLUNAS_NOTA, conexao
+
+log = logging.getLogger(__name__)
+
+CAMINHO_CREDENCIAIS = "creds.json"
+# ATENÇÃO: O nome aqui deve ser EXATAMENTE igual ao da sua planilha no Google
+NOME_PLANILHA = "Dados Fiscais Opertix"
+ESCOPO = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+
+TAMANHO_LOTE = 500            # linhas por chamada à API
+INTERVALO_VERIFICACAO = 30    # segundos entre verificações da fila sem aviso de gravação
+ESPERA_INICIAL = 5            # backoff após falha (dobra a cada falha seguida)
+ESPERA_MAXIMA = 300
+
+# Linha inicial do intervalo devolvido pelo append (ex.: "Página1!A12:R20" -> 12)
+RE_LINHA_INICIAL = re.compile(r'!\$?[A-Z]+\$?(\d+)')
+
+
+# --- CONEXÃO ---
+_planilha = None
+_cabecalho_ok = False
+_conexao_lock = threading.Lock()
+
+def credenciais_disponiveis():
+    return os.path.exists(CAMINHO_CREDENCIAIS)
+
+def conectar_gsheets():
+    """Aba da planilha, autorizada uma vez e reaproveitada (None se não houver creds.json).
+
+    gspread e oauth2client só são importados aqui, quando há credenciais para usar.
+    """
+    global _planilha
+    with _conexao_lock:
+        if _planilha is None and credenciais_disponiveis():
+            import gspread
+            from oauth2client.service_account import ServiceAccountCredentials
+            creds = ServiceAccountCredentials.from_json_keyfile_name(CAMINHO_CREDENCIAIS, ESCOPO)
+            _planilha = gspread.authorize(creds).open(NOME_PLANILHA).sheet1
+        return _planilha
+
+def _descartar_conexao():
+    global _planilha, _cabecalho_ok
+    with _conexao_lock:
+        _planilha, _cabecalho_ok = None, False
+
+def _garantir_cabecalho(planilha):
+    """Cria o cabeçalho se a planilha estiver vazia (lê só a linha 1, não a planilha inteira)."""
+    global _cabecalho_ok
+    if _cabecalho_ok: return
+    if not planilha.row_values(1):
+        planilha.append_rows([COLUNAS_NOTA])
+    _cabecalho_ok = True
+
+
+# --- ENVIO ---
+def _valores(linha):
+    return ["" if v is None else v for v in linha[3:]]
+
+def _intervalo(numero_linha):
+    from gspread.utils import rowcol_to_a1
+    return f"A{numero_linha}:{rowcol_to_a1(numero_linha, len(COLUNAS_NOTA))}"
+
+def _pendentes(conn, limite):
+    colunas = ", ".join(f"n.{c}" for c in COLUNAS_NOTA)
+    return conn.execute(f'''
+        SELECT f.id_nota, f.revisao, f.linha_planilha, {colunas}
+        FROM fila_nuvem f JOIN notas_fiscais n ON n.id = f.id_nota
+        WHERE f.pendente = 1 ORDER BY f.id_nota LIMIT ?
+    ''', (limite,)).fetchall()
+
+def _enviar_lote(planilha, linhas):
+    """Envia um lote e devolve {id_nota: linha da planilha} (None se a API não informar)."""
+    novas = [l for l in linhas if l[2] is None]
+    alteradas = [l for l in linhas if l[2] is not None]
+    enviadas = {}
+    if alteradas:
+        planilha.batch_update([{'range': _intervalo(l[2]), 'values': [_valores(l)]} for l in alteradas])
+        enviadas.update({l[0]: l[2] for l in alteradas})
+    if novas:
+        resposta = planilha.append_rows([_valores(l) for l in novas])
+        m = RE_LINHA_INICIAL.search((resposta or {}).get('updates', {}).get('updatedRange', ''))
+        inicio = int(m.group(1)) if m else None
+        enviadas.update({l[0]: inicio + i if inicio else None for i, l in enumerate(novas)})
+    return enviadas
+
+def sincronizar_pendentes():
+    """Esvazia a fila em lotes de TAMANHO_LOTE. Erros da API são registrados na fila e propagados."""
+    planilha = conectar_gsheets()
+    if planilha is None: return
+    _garantir_cabecalho(planilha)
+
+    with conexao() as conn:
+        while True:
+            linhas = _pendentes(conn, TAMANHO_LOTE)
+            if not linhas: return
+            try:
+                with metricas.medir('sincronizacao', notas=len(linhas)):
+                    enviadas = _enviar_lote(planilha, linhas)
+            except Exception as e:
+                conn.executemany("UPDATE fila_nuvem SET tentativas = tentativas + 1, ultimo_erro = ? WHERE id_nota = ?",
+                                 [(str(e)[:500], l[0]) for l in linhas])
+                conn.commit()
+                raise
+            # Só sai da fila se a nota não mudou enquanto era enviada (revisão igual à lida)
+            agora = time.time()
+            conn.executemany('''
+                UPDATE fila_nuvem SET linha_planilha = COALESCE(?, linha_planilha), tentativas = 0, ultimo_erro = NULL,
+                    enviado_em = ?, pendente = CASE WHEN revisao = ? THEN 0 ELSE 1 END
+                WHERE id_nota = ?
+            ''', [(enviadas.get(l[0]), agora, l[1], l[0]) for l in linhas])
+            conn.commit()
+            log.info("Google Sheets: %d nota(s) sincronizada(s)", len(linhas))
+
+
+# --- THREAD DE SINCRONIZAÇÃO ---
+_evento = threading.Event()
+_thread = None
+_thread_lock = threading.Lock()
+
+def _laco():
+    espera = ESPERA_INICIAL
+    while True:
+        _evento.wait(INTERVALO_VERIFICACAO)
+        _evento.clear()
+        try:
+            sincronizar_pendentes()
+            espera = ESPERA_INICIAL
+        except Exception as e:
+            log.warning("Falha ao sincronizar com o Google Sheets (nova tentativa em %ss): %s", espera, e)
+            # Erro de cota/API mantém o cliente; erro de autenticação/rede reconecta na próxima
+            from gspread.exceptions import APIError
+            if not isinstance(e, APIError): _descartar_conexao()
+            time.sleep(espera)
+            espera = min(espera * 2, ESPERA_MAXIMA)
+            _evento.set()
+
+def iniciar():
+    """Sobe a thread de sincronização uma vez por processo (e já envia o que ficou pendente)."""
+    global _thread
+    with _thread_lock:
+        if _thread is None or not _thread.is_alive():
+            _thread = threading.Thread(target=_laco, name="sincronizacao-nuvem", daemon=True)
+            _thread.start()
+            _evento.set()
+
+def notificar():
+    """Avisa a thread de que há notas novas na fila."""
+    iniciar()
+    _evento.set()
+
+def status_fila():
+    """(notas pendentes, último erro registrado) para exibir na interface."""
+    with conexao() as conn:
+        pendentes = conn.execute("SELECT COUNT(*) FROM fila_nuvem WHERE pendente = 1").fetchone()[0]
+        erro = conn.execute("SELECT ultimo_erro FROM fila_nuvem WHERE pendente = 1 AND ultimo_erro IS NOT NULL "
+                            "ORDER BY tentativas DESC LIMIT 1").fetchone()
+    return pendentes, erro[0] if erro else None
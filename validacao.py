@@ -0,0 +1,280 @@
+"""Validação do lote extraído antes de gravar, e fila de reextração das notas reprovadas.
+
+As regras rodam vetorizadas sobre o DataFrame inteiro (pandas/NumPy): dígitos verificadores de
+CNPJ/CPF, data de emissão, coerência do valor líquido com bruto, desconto e impostos, e notas do
+mesmo emissor e número com valores diferentes dentro do lote ou já gravadas (pelo índice único de
+chave_nota). Uma nota reprovada não é gravada: vai para `fila_reextracao` com o PDF e a lista de
+campos errados, e depois só esses campos são pedidos de novo ao LLM (extracao.reextrair_campos),
+em vez de refazer a nota inteira. A reextração pedida na tela roda nos workers (worker.py), com o
+mesmo limite de taxa das extrações.
+"""
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+from banco import CAMPOS_RETENCAO, CAMPOS_VALOR, conexao, salvar_notas
+from cache_extracao import hash_conteudo
+
+# Diferença aceita entre o líquido lido e o calculado: o que for maior entre os dois limites.
+# Frete e seguro não são extraídos, por isso a folga relativa é larga.
+TOLERANCIA_ABSOLUTA = 0.05
+TOLERANCIA_RELATIVA = 0.10
+# Nota sem nenhuma retenção federal lida (PIS/COFINS/CSLL/IR/INSS): o líquido pode ficar abaixo do
+# calculado até esta fração do bruto, a soma das alíquotas retidas na fonte mais altas
+TETO_RETENCOES_FEDERAIS = 0.20
+
+# Reextrações por nota antes de ela ficar parada para revisão manual
+MAX_TENTATIVAS_REEXTRACAO = 2
+# Reextração 'executando' há mais que isso (s) é de um worker que morreu e volta a ser pedida
+PRAZO_REEXTRACAO = 900
+
+# Status na fila: esperando decisão na tela, pedida aos workers, em reextração, parada para revisão
+PENDENTE = 'pendente'
+SOLICITADA = 'solicitada'
+EXECUTANDO = 'executando'
+REVISAR = 'revisar'
+
+# Parâmetros por consulta ao checar chaves já gravadas (o SQLite limita a quantidade)
+TAMANHO_CONSULTA_CHAVES = 500
+
+PESOS_CNPJ = np.array([6, 5, 4, 3, 2, 9, 8, 7, 6, 5, 4, 3, 2])
+PESOS_CPF = np.arange(11, 1, -1)
+
+CAMPOS_CONSISTENCIA = (['valor_bruto', 'valor_desconto', 'valor_liquido', 'retencao_issqn', 'valor_ipi', 'valor_icms_st']
+                       + CAMPOS_RETENCAO)
+
+# Regra -> (campos pedidos de novo ao LLM, motivo mostrado a ele e na tela)
+REGRAS = {
+    'emissor_cnpj': (['emissor_cnpj'], "CNPJ/CPF do emissor ausente ou com dígito verificador inválido"),
+    'tomador_cnpj': (['tomador_cnpj'], "CNPJ/CPF do tomador com dígito verificador inválido"),
+    'data_emissao': (['data_emissao'], "data de emissão inexistente, futura ou fora do formato DD/MM/AAAA"),
+    'consistencia_valores': (CAMPOS_CONSISTENCIA,
+                             "valor líquido não confere com bruto - desconto - retenções + IPI + ICMS-ST"),
+    'duplicada_lote': (['emissor_cnpj', 'numero_nota'], "outra nota do lote tem o mesmo emissor e número com outro valor"),
+    'duplicada_banco': (['emissor_cnpj', 'numero_nota', 'valor_bruto'],
+                        "já há nota gravada com o mesmo emissor e número e outro valor bruto"),
+    **{c: ([c], "valor negativo") for c in CAMPOS_VALOR},
+}
+
+
+# --- REGRAS VETORIZADAS ---
+def _somente_digitos(serie):
+    return serie.fillna('').astype(str).str.replace(r'\D', '', regex=True)
+
+def _digito_verificador(matriz, pesos):
+    resto = (matriz * pesos).sum(axis=1) % 11
+    return np.where(resto < 2, 0, 11 - resto)
+
+def documentos_validos(serie, obrigatorio=False):
+    """Vetor booleano: CNPJ (14 dígitos) ou CPF (11) com os dois dígitos verificadores corretos.
+
+    Vazio só é aceito quando o documento não é `obrigatorio`.
+    """
+    docs = _somente_digitos(serie)
+    validos = (docs == '').to_numpy() & (not obrigatorio)
+    for tamanho, pesos in ((14, PESOS_CNPJ), (11, PESOS_CPF)):
+        mascara = (docs.str.len() == tamanho).to_numpy()
+        if not mascara.any(): continue
+        # Uma linha por documento, uma coluna por dígito (texto de largura fixa visto como códigos UCS-4)
+        m = docs[mascara].to_numpy(dtype=f'U{tamanho}').view(np.int32).reshape(-1, tamanho) - ord('0')
+        validos[mascara] = (
+            (_digito_verificador(m[:, :-2], pesos[1:]) == m[:, -2])
+            & (_digito_verificador(m[:, :-1], pesos) == m[:, -1])
+            & (m != m[:, :1]).any(axis=1)  # 000.000.000-00, 111... passam na conta mas não existem
+        )
+    return validos
+
+def datas_validas(serie):
+    """Vetor booleano: data real em DD/MM/AAAA e não posterior a hoje."""
+    datas = pd.to_datetime(serie.fillna('').astype(str).str.strip(), format='%d/%m/%Y', errors='coerce')
+    return (datas.notna() & (datas <= pd.Timestamp.now())).to_numpy()
+
+def valores_numericos(df):
+    colunas = {c: (pd.to_numeric(df[c], errors='coerce') if c in df.columns else pd.Series(0.0, index=df.index))
+               for c in CAMPOS_VALOR}
+    return pd.DataFrame(colunas).fillna(0.0)
+
+def retencoes_federais(df):
+    """DataFrame com CAMPOS_RETENCAO numéricos; NaN onde a retenção não foi lida (nem como zero)."""
+    return pd.DataFrame({c: (pd.to_numeric(df[c], errors='coerce') if c in df.columns else np.nan)
+                         for c in CAMPOS_RETENCAO}, index=df.index)
+
+def valores_consistentes(valores, retencoes):
+    """Vetor booleano: líquido = bruto - desconto - ISS retido - retenções federais + IPI + ICMS-ST,
+    dentro da tolerância.
+
+    Se nenhuma retenção federal foi lida, a nota pode tê-las sem que a extração as tenha visto:
+    o líquido é aceito abaixo do calculado até TETO_RETENCOES_FEDERAIS do bruto.
+    """
+    esperado = (valores['valor_bruto'] - valores['valor_desconto'] - valores['retencao_issqn']
+                - retencoes.sum(axis=1) + valores['valor_ipi'] + valores['valor_icms_st'])
+    tolerancia = np.maximum(TOLERANCIA_ABSOLUTA, TOLERANCIA_RELATIVA * valores['valor_bruto'].abs())
+    folga_retencoes = np.where(retencoes.isna().all(axis=1), TETO_RETENCOES_FEDERAIS * valores['valor_bruto'].abs(), 0.0)
+    diferenca = valores['valor_liquido'] - esperado
+    return ((diferenca <= tolerancia) & (diferenca >= -(tolerancia + folga_retencoes))).to_numpy()
+
+def chaves_notas(df):
+    """banco.chave_nota para a coluna inteira (NaN onde falta emissor ou número)."""
+    documento = _somente_digitos(df.get('emissor_cnpj', pd.Series('', index=df.index)))
+    numero = df.get('numero_nota', pd.Series('', index=df.index)).fillna('').astype(str)
+    numero = numero.str.replace(r'\.0$', '', regex=True).str.replace(r'\D', '', regex=True).str.lstrip('0')
+    return (documento + '-' + numero).where((documento != '') & (numero != ''))
+
+def validar_lote(df):
+    """DataFrame booleano com uma coluna por regra de REGRAS: True onde a nota falhou na regra."""
+    valores = valores_numericos(df)
+    coluna = lambda c: df[c] if c in df.columns else pd.Series('', index=df.index)
+    # Mesmo emissor e número com valores diferentes: um dos dois números (ou emissores) foi mal lido
+    valores_por_chave = valores['valor_bruto'].groupby(chaves_notas(df)).transform('nunique')
+    # Mesma chave já gravada com outro bruto: reenvio da mesma nota passa, número mal lido não
+    gravado = valores_cadastrados(df)
+    diferente_gravada = ~np.isnan(gravado) & (np.abs(gravado - valores['valor_bruto'].to_numpy()) > TOLERANCIA_ABSOLUTA)
+
+    falhas = pd.DataFrame({
+        'emissor_cnpj': ~documentos_validos(coluna('emissor_cnpj'), obrigatorio=True),
+        'tomador_cnpj': ~documentos_validos(coluna('tomador_cnpj')),
+        'data_emissao': ~datas_validas(coluna('data_emissao')),
+        'consistencia_valores': ~valores_consistentes(valores, retencoes_federais(df)),
+        'duplicada_lote': (valores_por_chave.fillna(0) > 1).to_numpy(),
+        'duplicada_banco': diferente_gravada,
+    }, index=df.index)
+    return falhas.join(valores < 0)
+
+def erros_da_linha(falhas_linha):
+    """{campo: motivo} de uma linha de `validar_lote` ({} se a nota passou em tudo)."""
+    erros = {}
+    for regra in falhas_linha.index[falhas_linha.to_numpy()]:
+        campos, motivo = REGRAS[regra]
+        for campo in campos:
+            erros[campo] = f"{erros[campo]}; {motivo}" if campo in erros else motivo
+    return erros
+
+def valores_cadastrados(df):
+    """Vetor com o valor_bruto da nota já gravada com a mesma chave_nota (NaN se não existe), pelo índice único."""
+    chaves = chaves_notas(df)
+    unicas = chaves.dropna().unique().tolist()
+    existentes = {}
+    with conexao() as conn:
+        for inicio in range(0, len(unicas), TAMANHO_CONSULTA_CHAVES):
+            bloco = unicas[inicio:inicio + TAMANHO_CONSULTA_CHAVES]
+            marcadores = ", ".join("?" * len(bloco))
+            existentes.update(conn.execute(
+                f"SELECT chave_nota, valor_bruto FROM notas_fiscais WHERE chave_nota IN ({marcadores})", bloco))
+    return pd.to_numeric(chaves.map(existentes), errors='coerce').to_numpy(dtype=float)
+
+def ja_cadastradas(df):
+    """Vetor booleano: a nota já existe no banco e será atualizada."""
+    return ~np.isnan(valores_cadastrados(df))
+
+
+# --- FILA DE REEXTRAÇÃO ---
+def enfileirar(df, falhas, conteudos):
+    """Manda para a fila as notas reprovadas em `falhas`; `conteudos` traz os bytes do PDF de cada linha
+    de `df`, na mesma ordem (pelo nome não dá: dois envios podem ter arquivos com o mesmo nome).
+
+    Devolve quantas notas entraram. Um PDF que já estava na fila volta a ser pendente, com os dados novos.
+    """
+    reprovadas = falhas.any(axis=1).to_numpy()
+    agora = time.time()
+    linhas = []
+    conteudos_reprovadas = (c for c, reprovada in zip(conteudos, reprovadas) if reprovada)
+    for dados, (_, falhas_linha), conteudo in zip(df[reprovadas].to_dict('records'), falhas[reprovadas].iterrows(),
+                                                   conteudos_reprovadas):
+        linhas.append((hash_conteudo(conteudo), dados['arquivo_origem'], conteudo,
+                       json.dumps(dados, ensure_ascii=False, default=str),
+                       json.dumps(erros_da_linha(falhas_linha), ensure_ascii=False), agora))
+    with conexao() as conn:
+        conn.executemany('''
+            INSERT INTO fila_reextracao (hash_pdf, arquivo, conteudo, dados, erros, atualizado_em)
+            VALUES (?, ?, ?, ?, ?, ?)
+            ON CONFLICT (hash_pdf) DO UPDATE SET
+                arquivo = excluded.arquivo, dados = excluded.dados, erros = excluded.erros,
+                tentativas = 0, status = 'pendente', atualizado_em = excluded.atualizado_em
+        ''', linhas)
+    return len(linhas)
+
+def itens_fila():
+    """Notas na fila (sem o PDF), da mais recente para a mais antiga, para a tela."""
+    with conexao() as conn:
+        df = pd.read_sql('''
+            SELECT arquivo, status, tentativas, erros FROM fila_reextracao ORDER BY atualizado_em DESC
+        ''', conn)
+    df['erros'] = [", ".join(json.loads(e)) for e in df['erros']]
+    return df
+
+def _gravar_e_remover(hashes, notas):
+    salvar_notas(pd.DataFrame(notas))
+    with conexao() as conn:
+        conn.executemany("DELETE FROM fila_reextracao WHERE hash_pdf = ?", [(h,) for h in hashes])
+
+def solicitar_reextracao():
+    """Pede aos workers a reextração das notas pendentes (botão da tela). Devolve quantas."""
+    with conexao() as conn:
+        return conn.execute("UPDATE fila_reextracao SET status = ?, atualizado_em = ? WHERE status = ?",
+                            (SOLICITADA, time.time(), PENDENTE)).rowcount
+
+def reservar_reextracao(quantidade):
+    """Marca até `quantidade` notas pedidas (ou abandonadas por um worker além do PRAZO_REEXTRACAO) como
+    em reextração e as devolve: lista de (hash_pdf, arquivo, conteudo, dados, erros, tentativas).
+
+    O BEGIN IMMEDIATE garante que dois workers nunca peguem a mesma nota.
+    """
+    agora = time.time()
+    with conexao() as conn:
+        conn.execute("BEGIN IMMEDIATE")
+        linhas = conn.execute('''
+            SELECT hash_pdf, arquivo, conteudo, dados, erros, tentativas FROM fila_reextracao
+            WHERE status = ? OR (status = ? AND atualizado_em < ?) ORDER BY atualizado_em LIMIT ?
+        ''', (SOLICITADA, EXECUTANDO, agora - PRAZO_REEXTRACAO, quantidade)).fetchall()
+        conn.executemany("UPDATE fila_reextracao SET status = ?, atualizado_em = ? WHERE hash_pdf = ?",
+                         [(EXECUTANDO, agora, linha[0]) for linha in linhas])
+    return linhas
+
+def liberar_reextracao(hashes, status=SOLICITADA):
+    """Devolve notas em reextração (saída do worker: pedidas de novo; erro inesperado: de volta à tela)."""
+    with conexao() as conn:
+        conn.executemany("UPDATE fila_reextracao SET status = ? WHERE hash_pdf = ? AND status = ?",
+                         [(status, h, EXECUTANDO) for h in hashes])
+
+def reprocessar(nota, limitador=None):
+    """Reextrai só os campos reprovados de uma nota de `reservar_reextracao` e a grava se passar na validação.
+
+    Devolve (arquivo, erros que sobraram, exceção). Se não passar, a nota volta a pendente na tela; depois de
+    MAX_TENTATIVAS_REEXTRACAO fica com status 'revisar'.
+    """
+    # extracao carrega os agentes e o cliente do LLM: só importa quando a fila é usada
+    from extracao import reextrair_campos
+
+    hash_pdf, arquivo, conteudo, dados, erros, tentativas = nota
+    dados, erros = json.loads(dados), json.loads(erros)
+    try:
+        dados = reextrair_campos(arquivo, conteudo, dados, erros, limitador)
+        erros = erros_da_linha(validar_lote(pd.DataFrame([dados])).iloc[0])
+    except Exception as e:
+        falha = e
+    else:
+        falha = None
+        if not erros:
+            _gravar_e_remover([hash_pdf], [dados])
+            return arquivo, {}, None
+
+    tentativas += 1
+    with conexao() as conn:
+        conn.execute('''
+            UPDATE fila_reextracao SET dados = ?, erros = ?, tentativas = ?, status = ?, atualizado_em = ?
+            WHERE hash_pdf = ?
+        ''', (json.dumps(dados, ensure_ascii=False, default=str), json.dumps(erros, ensure_ascii=False), tentativas,
+              REVISAR if tentativas >= MAX_TENTATIVAS_REEXTRACAO else PENDENTE, time.time(), hash_pdf))
+    return arquivo, erros, falha
+
+def aceitar_fila():
+    """Grava como estão as notas da fila (decisão manual) e as tira da fila. Devolve quantas.
+
+    As que um worker está reextraindo ficam de fora.
+    """
+    with conexao() as conn:
+        linhas = conn.execute("SELECT hash_pdf, dados FROM fila_reextracao WHERE status != ?", (EXECUTANDO,)).fetchall()
+    if linhas: _gravar_e_remover([h for h, _ in linhas], [json.loads(d) for _, d in linhas])
+    return len(linhas)
@@ -0,0 +1,259 @@
+"""Worker de extração: consome a fila do SQLite (fila.py) fora da interface.
+
+Cada worker mantém até `--concorrencia` notas em extração, valida e grava os resultados em blocos
+e marca as tarefas como concluídas só depois de gravar, então um worker derrubado no meio do
+lote é retomado por outro (as notas já extraídas voltam do cache). Vários workers podem rodar
+ao mesmo tempo, na mesma máquina ou em outras com acesso ao mesmo banco. As reextrações pedidas
+na tela (validacao.fila_reextracao) ocupam as mesmas vagas e o mesmo limite de taxa.
+
+Uso:
+    python worker.py executar [--concorrencia 8] [--rpm 500] [--tpm 200000] [--ocioso-max 0] [--nuvem]
+    python worker.py enfileirar CAMINHO [--modo estruturado] [--executar]
+
+CAMINHO pode ser uma pasta (lida recursivamente), um ZIP ou um arquivo. PDFs viram tarefas;
+XMLs de NF-e/NFS-e são importados na hora, sem IA.
+"""
+import argparse
+import logging
+import os
+import signal
+import socket
+import sys
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+import pandas as pd
+
+import cache_extracao
+import fila
+import metricas
+import sincronizacao
+import validacao
+from banco import CAMPOS_VALOR, inicializar_banco, salvar_notas
+from extracao import (LIMIAR_CONFIANCA, LIMITE_RPM, LIMITE_TPM, MAX_CONCORRENCIA, MODO_CREW, MODOS_EXTRACAO,
+                      ORCAMENTO_TOKENS, VERSAO_EXTRACAO, EstatisticasLote, LimitadorTaxa, extrair_nota)
+from ingestao_xml import TAMANHO_BLOCO as TAMANHO_BLOCO_XML, ler_arquivo as ler_arquivo_xml
+from leitura_pdf import PDFSemTexto
+
+# Notas extraídas acumuladas antes de validar e gravar (ou o que houver depois de ESPERA_GRAVACAO s)
+TAMANHO_GRAVACAO = 50
+ESPERA_GRAVACAO = 5
+# Espera (s) entre consultas à fila quando não há tarefas
+INTERVALO_OCIOSO = 2
+
+
+# --- EXTRAÇÃO ---
+def _extrair(tarefa, limitador):
+    """Extrai uma tarefa e devolve (dados, origem, tokens_antes, tokens_depois)."""
+    _, arquivo, conteudo, opcoes = tarefa
+    estatisticas = EstatisticasLote()
+    dados = extrair_nota(arquivo, conteudo, limitador, estatisticas, **opcoes)
+    origem = next(iter(estatisticas.contagem), None)
+    return dados, origem, estatisticas.tokens['antes'], estatisticas.tokens['depois']
+
+def _reextraida(nota, futuro, nuvem):
+    """Registra no log o resultado de uma reextração de validacao.reprocessar."""
+    try:
+        arquivo, erros, falha = futuro.result()
+    except Exception as e:
+        # Erro fora da extração (ex.: banco): a nota volta para a tela em vez de ser pedida de novo sem fim
+        print(f"Falha na reextração de {nota[1]}: {e}", flush=True)
+        validacao.liberar_reextracao([nota[0]], validacao.PENDENTE)
+        return
+    if falha: print(f"Falha na reextração de {arquivo}: {falha}", flush=True)
+    elif erros: print(f"{arquivo}: ainda inválida em {', '.join(erros)}", flush=True)
+    else:
+        print(f"{arquivo}: corrigida na reextração e gravada", flush=True)
+        if nuvem: sincronizacao.notificar()
+
+def _gravar(prontas, nuvem):
+    """Valida o bloco inteiro, manda as reprovadas para a fila de reextração e grava as demais."""
+    df = pd.DataFrame([dados for _, (dados, *_) in prontas])
+    for c in CAMPOS_VALOR:
+        if c not in df.columns: df[c] = 0.0
+        df[c] = pd.to_numeric(df[c], errors='coerce').fillna(0.0)
+
+    with metricas.medir('validacao', notas=len(df)):
+        falhas = validacao.validar_lote(df)
+        reprovadas = falhas.any(axis=1).to_numpy()
+        if reprovadas.any():
+            validacao.enfileirar(df, falhas, [tarefa[2] for tarefa, _ in prontas])
+        aprovadas = df[~reprovadas].copy()
+        atualizadas = validacao.ja_cadastradas(aprovadas).sum()
+    with metricas.medir('gravacao', notas=len(aprovadas)):
+        salvar_notas(aprovadas)
+    fila.concluir([(tarefa[0], origem, antes, depois) for tarefa, (_, origem, antes, depois) in prontas])
+    metricas.descarregar()
+    if nuvem: sincronizacao.notificar()
+    print(f"{len(aprovadas)} nota(s) gravada(s) ({atualizadas} já existiam), {reprovadas.sum()} para reextração",
+          flush=True)
+
+def _gravar_protegido(prontas, nuvem):
+    """`_gravar` do bloco; se ele falhar, grava nota por nota e marca como falha só a tarefa que não grava."""
+    try:
+        _gravar(prontas, nuvem)
+        return
+    except Exception as e:
+        print(f"Falha ao gravar o bloco ({e}); gravando nota por nota", flush=True)
+    for pronta in prontas:
+        tarefa = pronta[0]
+        try:
+            _gravar([pronta], nuvem)
+        except Exception as e:
+            print(f"Falha ao gravar {tarefa[1]}: {e}", flush=True)
+            fila.falhar(tarefa[0], e)
+
+def executar(concorrencia=MAX_CONCORRENCIA, limite_rpm=LIMITE_RPM, limite_tpm=LIMITE_TPM, ocioso_max=0, nuvem=False):
+    """Consome a fila até ser interrompido (ou, com `ocioso_max`, até ficar esse tempo sem tarefas).
+
+    Com `nuvem`, este processo também envia as notas ao Google Sheets; deixe desligado quando a
+    interface estiver aberta, que já faz esse envio.
+    """
+    nome = f"{socket.gethostname()}-{os.getpid()}"
+    inicializar_banco()
+    cache_extracao.limpar_cache(VERSAO_EXTRACAO)
+    metricas.limpar_metricas()
+    if nuvem: sincronizacao.iniciar()
+    limitador = LimitadorTaxa(limite_rpm, limite_tpm)
+    em_andamento, reextracoes, prontas = {}, {}, []
+    ocioso_desde = ultima_gravacao = ultimo_batimento = 0.0
+    print(f"Worker {nome} aguardando tarefas ({concorrencia} em paralelo)", flush=True)
+
+    erro = None
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, concorrencia)) as pool:
+            while True:
+                agora = time.time()
+                if agora - ultimo_batimento >= fila.INTERVALO_BATIMENTO:
+                    fila.batimento(nome)
+                    fila.recuperar_abandonadas()
+                    ultimo_batimento = agora
+
+                # Mantém o pool cheio: reserva só o que cabe, primeiro as tarefas e depois as reextrações
+                if len(em_andamento) + len(reextracoes) < concorrencia:
+                    for tarefa in fila.reservar(nome, concorrencia - len(em_andamento) - len(reextracoes)):
+                        em_andamento[pool.submit(_extrair, tarefa, limitador)] = tarefa
+                if len(em_andamento) + len(reextracoes) < concorrencia:
+                    for nota in validacao.reservar_reextracao(concorrencia - len(em_andamento) - len(reextracoes)):
+                        reextracoes[pool.submit(validacao.reprocessar, nota, limitador)] = nota
+
+                if not em_andamento and not reextracoes and not prontas:
+                    metricas.descarregar()
+                    ocioso_desde = ocioso_desde or agora
+                    if ocioso_max and agora - ocioso_desde >= ocioso_max: break
+                    time.sleep(INTERVALO_OCIOSO)
+                    continue
+                ocioso_desde = 0.0
+
+                feitos, _ = wait([*em_andamento, *reextracoes], timeout=ESPERA_GRAVACAO, return_when=FIRST_COMPLETED)
+                for futuro in feitos:
+                    if futuro in reextracoes:
+                        _reextraida(reextracoes.pop(futuro), futuro, nuvem)
+                        continue
+                    tarefa = em_andamento.pop(futuro)
+                    try:
+                        prontas.append((tarefa, futuro.result()))
+                    except PDFSemTexto as e:
+                        fila.falhar(tarefa[0], e, definitiva=True, origem='sem_texto')
+                    except Exception as e:
+                        print(f"Falha em {tarefa[1]}: {e}", flush=True)
+                        fila.falhar(tarefa[0], e)
+
+                if prontas and (len(prontas) >= TAMANHO_GRAVACAO or not em_andamento
+                                or time.time() - ultima_gravacao >= ESPERA_GRAVACAO):
+                    _gravar_protegido(prontas, nuvem)
+                    prontas, ultima_gravacao = [], time.time()
+    except Exception as e:
+        erro = e
+        raise
+    finally:
+        # Extraídas e ainda não gravadas voltam para a fila (a próxima rodada pega do cache)
+        fila.liberar(nome, erro)
+        validacao.liberar_reextracao([nota[0] for nota in reextracoes.values()])
+
+
+# --- ENFILEIRAMENTO PELA LINHA DE COMANDO ---
+def _arquivos(caminho):
+    """Caminhos de PDF/XML/ZIP em `caminho` (arquivo ou pasta, recursivo)."""
+    if os.path.isfile(caminho):
+        yield caminho
+        return
+    for raiz, _, nomes in os.walk(caminho):
+        for nome in sorted(nomes):
+            if nome.lower().endswith(('.pdf', '.xml', '.zip')): yield os.path.join(raiz, nome)
+
+def enfileirar(caminho, opcoes):
+    """Importa os XMLs na hora e cria um lote com os PDFs. Devolve (id do lote ou None, PDFs, XMLs)."""
+    base = os.path.dirname(os.path.abspath(caminho))
+    arquivos = [(a, os.path.relpath(a, base)) for a in _arquivos(caminho)]
+
+    importadas, bloco = 0, []
+    for arquivo, nome in arquivos:
+        if arquivo.lower().endswith('.pdf'): continue
+        for nota in ler_arquivo_xml(arquivo, nome):
+            bloco.append(nota)
+            if len(bloco) >= TAMANHO_BLOCO_XML:
+                salvar_notas(pd.DataFrame(bloco))
+                importadas, bloco = importadas + len(bloco), []
+    if bloco:
+        salvar_notas(pd.DataFrame(bloco))
+        importadas += len(bloco)
+
+    # PDFs lidos um a um enquanto são inseridos, sem carregar a pasta inteira na memória
+    quantidade = 0
+    def pdfs():
+        nonlocal quantidade
+        for arquivo, nome in arquivos:
+            if arquivo.lower().endswith('.zip'):
+                lidos = fila.pdfs_do_zip(arquivo, nome)
+            elif arquivo.lower().endswith('.pdf'):
+                with open(arquivo, 'rb') as f: lidos = [(nome, f.read())]
+            else:
+                continue
+            for pdf in lidos:
+                quantidade += 1
+                yield pdf
+
+    lote_id = fila.criar_lote(pdfs(), opcoes, descricao=caminho)
+    if not quantidade:
+        fila.remover_lote(lote_id)
+        lote_id = None
+    return lote_id, quantidade, importadas
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Worker da fila de extração de notas fiscais.")
+    comandos = parser.add_subparsers(dest="comando", required=True)
+
+    p_exec = comandos.add_parser("executar", help="consome a fila")
+    p_enf = comandos.add_parser("enfileirar", help="enfileira uma pasta, ZIP ou arquivo")
+    p_enf.add_argument("caminho")
+    p_enf.add_argument("--modo", choices=list(MODOS_EXTRACAO), default=MODO_CREW)
+    p_enf.add_argument("--orcamento", type=int, default=ORCAMENTO_TOKENS, help="tokens de texto por nota enviados à IA")
+    p_enf.add_argument("--limiar", type=float, default=LIMIAR_CONFIANCA, help="confiança mínima do leitor por regras")
+    p_enf.add_argument("--executar", action="store_true", help="consome a fila em seguida, até esvaziar")
+    for p in (p_exec, p_enf):
+        p.add_argument("--concorrencia", type=int, default=MAX_CONCORRENCIA)
+        p.add_argument("--rpm", type=int, default=LIMITE_RPM)
+        p.add_argument("--tpm", type=int, default=LIMITE_TPM)
+        p.add_argument("--nuvem", action="store_true", help="envia também ao Google Sheets")
+    p_exec.add_argument("--ocioso-max", type=float, default=0, help="encerra após N segundos sem tarefas (0 = nunca)")
+    args = parser.parse_args()
+
+    # Logs dos módulos (ex.: tokens antes/depois da compactação de cada PDF) na saída do worker
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+    inicializar_banco()
+    ocioso_max = getattr(args, "ocioso_max", 0)
+    if args.comando == "enfileirar":
+        opcoes = {'modo': args.modo, 'orcamento_tokens': args.orcamento, 'limiar_regras': args.limiar}
+        lote_id, pdfs, xmls = enfileirar(args.caminho, opcoes)
+        print(f"{xmls} nota(s) importada(s) de XML; {pdfs} PDF(s) na fila" + (f" (lote {lote_id})" if lote_id else ""))
+        if not args.executar: raise SystemExit(0)
+        ocioso_max = fila.INTERVALO_BATIMENTO
+
+    # SIGTERM (parada do serviço) sai pelo mesmo caminho do Ctrl+C, devolvendo as tarefas reservadas
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    try:
+        executar(args.concorrencia, args.rpm, args.tpm, ocioso_max, args.nuvem)
+    except KeyboardInterrupt:
+        pass